@@ -0,0 +1,208 @@
+import hashlib
+import re
+import threading
+import time
+from collections import OrderedDict
+
+# Words that usually point back to earlier messages; such questions are not cached
+REFERRING_WORDS = frozenset("""
+it its that this these those they them he she his her above previous earlier again more else
+""".split())
+
+
+QUESTION_TOKEN = re.compile(r"[a-z0-9]+")
+
+# Instruction and filler words that do not change what is being asked.
+# Unlike the retrieval stopwords, question words, auxiliaries and negations
+# are kept: "why did X" and "when did X" (or "did X" and "didn't X") are
+# different questions.
+QUESTION_FILLER = frozenset("""
+a an the about briefly define describe detail details explain give know me please say summarize tell
+""".split())
+
+# "can you"/"could you" only introduce a request ("can you explain X")
+POLITE_PREFIXES = frozenset('can could would will'.split())
+POLITE_SUBJECTS = frozenset('you i we'.split())
+
+# Words that decide what kind of answer is wanted; near-duplicate matches must agree on them
+INTENT_WORDS = frozenset("""
+what when where which who whom whose why how whether not no never
+""".split())
+
+
+def normalize_question(question):
+    """Lowercase words of a question, without punctuation, instruction words and polite prefixes."""
+    text = question.lower().replace('’', "'")
+    text = text.replace("can't", 'can not').replace("won't", 'will not').replace("n't", ' not')
+    words = QUESTION_TOKEN.findall(text)
+    kept = []
+    skip = False
+    for word, following in zip(words, words[1:] + ['']):
+        if skip:
+            skip = False
+            continue
+        if word in POLITE_PREFIXES and following in POLITE_SUBJECTS:
+            skip = True
+            continue
+        if word not in QUESTION_FILLER:
+            kept.append(word)
+    return ' '.join(kept)
+
+
+def question_intent(normalized):
+    """Question words and negations of a normalized question."""
+    return frozenset(normalized.split()) & INTENT_WORDS
+
+
+def shingles(normalized):
+    """Word unigrams and bigrams of a normalized question."""
+    words = normalized.split()
+    return set(words) | {f'{a} {b}' for a, b in zip(words, words[1:])}
+
+
+def simhash(features, bits=64):
+    """64-bit SimHash fingerprint of a set of string features."""
+    weights = [0] * bits
+    for feature in features:
+        value = int.from_bytes(hashlib.blake2b(feature.encode('utf-8'), digest_size=8).digest(), 'big')
+        for bit in range(bits):
+            weights[bit] += 1 if value >> bit & 1 else -1
+    return sum(1 << bit for bit in range(bits) if weights[bit] > 0)
+
+
+def document_answer_key(document_id, content_sha256):
+    """Cache namespace for answers about a document; documents uploaded from the same file share it."""
+    if content_sha256:
+        return f'sha:{content_sha256}'
+    return f'doc:{document_id}'
+
+
+def is_cacheable(question, has_history):
+    """Follow-up questions that refer to the conversation cannot be answered from the cache."""
+    words = set(re.findall(r'[a-z]+', question.lower()))
+    return bool(normalize_question(question)) and not (has_history and words & REFERRING_WORDS)
+
+
+class AnswerCache:
+    """
+    In-process cache of AI answers per document.
+
+    Lookups match the normalized question exactly first, then fall back to
+    near-duplicates: a cached question matches when its SimHash is within
+    `max_distance` bits and the word shingles overlap by at least
+    `min_similarity` (Jaccard). Entries expire after `ttl` seconds and the
+    least recently used ones are evicted beyond `max_entries`.
+    """
+
+    def __init__(self, app=None):
+        self.ttl = 3600
+        self.max_entries = 2000
+        self.max_distance = 16
+        self.min_similarity = 0.7
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()  # (document_key, normalized) -> entry
+        self._by_document = {}         # document_key -> set of normalized questions
+        self._lock = threading.Lock()
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.ttl = app.config.get('ANSWER_CACHE_TTL', self.ttl)
+        self.max_entries = app.config.get('ANSWER_CACHE_MAX_ENTRIES', self.max_entries)
+        app.extensions['answer_cache'] = self
+
+    @property
+    def enabled(self):
+        return self.ttl > 0 and self.max_entries > 0
+
+    def get(self, document_key, question):
+        """Return a cached answer for the question (or a paraphrase of it), or None."""
+        if not self.enabled:
+            return None
+
+        normalized = normalize_question(question)
+        now = time.monotonic()
+
+        with self._lock:
+            entry = self._entries.get((document_key, normalized))
+
+            if entry is None:
+                features = shingles(normalized)
+                fingerprint = simhash(features)
+                intent = question_intent(normalized)
+                for candidate in self._by_document.get(document_key, ()):
+                    other = self._entries[(document_key, candidate)]
+                    if other['intent'] != intent:
+                        continue
+                    if bin(fingerprint ^ other['simhash']).count('1') > self.max_distance:
+                        continue
+                    overlap = len(features & other['shingles']) / len(features | other['shingles'])
+                    if overlap >= self.min_similarity:
+                        entry = other
+                        break
+
+            if entry is not None and now - entry['created'] > self.ttl:
+                self._remove(entry['key'])
+                entry = None
+
+            if entry is None:
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(entry['key'])
+            self.hits += 1
+            return entry['answer']
+
+    def put(self, document_key, question, answer):
+        if not self.enabled:
+            return
+
+        normalized = normalize_question(question)
+        features = shingles(normalized)
+        key = (document_key, normalized)
+
+        with self._lock:
+            self._entries[key] = {
+                'key': key,
+                'answer': answer,
+                'shingles': features,
+                'simhash': simhash(features),
+                'intent': question_intent(normalized),
+                'created': time.monotonic()
+            }
+            self._entries.move_to_end(key)
+            self._by_document.setdefault(document_key, set()).add(normalized)
+
+            while len(self._entries) > self.max_entries:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def invalidate(self, document_key):
+        """Forget every answer for a document (e.g. when its content changes)."""
+        with self._lock:
+            for normalized in list(self._by_document.get(document_key, ())):
+                self._remove((document_key, normalized))
+
+    def _remove(self, key):
+        self._entries.pop(key, None)
+        questions = self._by_document.get(key[0])
+        if questions is not None:
+            questions.discard(key[1])
+            if not questions:
+                del self._by_document[key[0]]
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions
+            }
+
+
+answer_cache = AnswerCache()
@@ -1,25 +1,94 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, stream_with_context
 from flask_cors import CORS
 from werkzeug.security import generate_password_hash, check_password_hash
 from functools import wraps
 from dotenv import load_dotenv
+from sqlalchemy import text
+from sqlalchemy.exc import IntegrityError
+import click
 import jwt
 import datetime
+import hmac
+import ipaddress
+import json
 import os
-from models import db, User, Document, Chat, Message
-from document_extractor import extract_text_from_file
-from groq_service import get_groq_response
+from models import db, init_db, User, Document, DocumentChunk, ExtractedText, StudyMaterial, Chat, Message
+from groq_service import (get_groq_response, generate_study_material, check_question, context_token_limit,
+                          PromptTooLarge, STUDY_PROMPT_VERSION)
+from extraction_cache import extraction_cache
+from document_extractor import SUPPORTED_TYPES
+from ingestion import ingestion
+from bulk_import import StagedFile, stage_directory, stage_zip, cleanup, queue_import, import_files
+from migrations import upgrade_schema, compress_existing_text, database_size, measure_read_latency
+from answer_cache import answer_cache, document_answer_key, is_cacheable
+from auth_cache import principal_cache
+from metrics import metrics
+from compression import compressor
+from change_tracking import conditional_get, touch_user
+from memory import build_history, schedule_summary_update
+from retrieval import document_token_count, invalidate_index, select_context
+from document_structure import PAGE_KINDS, blocks_within, load_sections, outline
+from search import search_documents, search_messages, to_fts_query
 
 load_dotenv()
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'dev-secret-key-change-in-production')
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///answerxtractor.db'
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
+
+# Database: SQLite by default, any SQLAlchemy URL (e.g. PostgreSQL) via DATABASE_URL
+database_url = os.environ.get('DATABASE_URL', 'sqlite:///answerxtractor.db')
+if database_url.startswith('postgres://'):
+    database_url = database_url.replace('postgres://', 'postgresql://', 1)
+app.config['SQLALCHEMY_DATABASE_URI'] = database_url
+app.config['SQLITE_BUSY_TIMEOUT_MS'] = int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', 5000))
+app.config['SQLITE_SYNCHRONOUS'] = os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL')
+
+if database_url.startswith('sqlite'):
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+        'connect_args': {'timeout': app.config['SQLITE_BUSY_TIMEOUT_MS'] / 1000}
+    }
+else:
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+        'pool_size': int(os.environ.get('DB_POOL_SIZE', 5)),
+        'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW', 10)),
+        'pool_timeout': int(os.environ.get('DB_POOL_TIMEOUT', 30)),
+        'pool_recycle': int(os.environ.get('DB_POOL_RECYCLE', 1800)),
+        'pool_pre_ping': True
+    }
+
+# Uploads are spooled to disk, so the size limit does not bound worker memory
+app.config['MAX_CONTENT_LENGTH'] = int(os.environ.get('MAX_UPLOAD_MB', 256)) * 1024 * 1024
+app.config['UPLOAD_TMP_DIR'] = os.environ.get('UPLOAD_TMP_DIR')
+app.config['BULK_IMPORT_MAX_FILES'] = int(os.environ.get('BULK_IMPORT_MAX_FILES', 500))
+app.config['BULK_IMPORT_MAX_BYTES'] = int(os.environ.get('BULK_IMPORT_MAX_MB', 2048)) * 1024 * 1024
+app.config['BULK_IMPORT_BATCH_SIZE'] = int(os.environ.get('BULK_IMPORT_BATCH_SIZE', 50))
+app.config['INGESTION_WORKERS'] = int(os.environ.get('INGESTION_WORKERS', 0)) or None
+app.config['EXTRACTION_TIMEOUT'] = float(os.environ.get('EXTRACTION_TIMEOUT', 0)) or None
+app.config['EXTRACTION_CACHE_DIR'] = os.environ.get('EXTRACTION_CACHE_DIR')
+app.config['EXTRACTION_CACHE_MAX_BYTES'] = int(os.environ.get('EXTRACTION_CACHE_MAX_MB', 512)) * 1024 * 1024
+app.config['ANSWER_CACHE_TTL'] = int(os.environ.get('ANSWER_CACHE_TTL', 3600))
+app.config['ANSWER_CACHE_MAX_ENTRIES'] = int(os.environ.get('ANSWER_CACHE_MAX_ENTRIES', 2000))
+app.config['RETRIEVAL_TOP_K'] = int(os.environ.get('RETRIEVAL_TOP_K', 6))
+app.config['RETRIEVAL_MAX_TOP_K'] = int(os.environ.get('RETRIEVAL_MAX_TOP_K', 20))
+app.config['RETRIEVAL_TOKEN_BUDGET'] = int(os.environ.get('RETRIEVAL_TOKEN_BUDGET', 3000))
+app.config['RETRIEVAL_MAX_TOKEN_BUDGET'] = int(os.environ.get('RETRIEVAL_MAX_TOKEN_BUDGET', 12000))
+app.config['AUTH_CACHE_TTL'] = int(os.environ.get('AUTH_CACHE_TTL', 60))
+app.config['SLOW_REQUEST_MS'] = int(os.environ.get('SLOW_REQUEST_MS', 0))
+app.config['METRICS_TOKEN'] = os.environ.get('METRICS_TOKEN')
+app.config['MESSAGES_PAGE_SIZE'] = int(os.environ.get('MESSAGES_PAGE_SIZE', 50))
+app.config['COMPRESS_MIN_BYTES'] = int(os.environ.get('COMPRESS_MIN_BYTES', 1024))
+app.config['COMPRESS_LEVEL'] = int(os.environ.get('COMPRESS_LEVEL', 6))
 
 CORS(app)
-db.init_app(app)
+init_db(app)
+extraction_cache.init_app(app)
+ingestion.init_app(app)
+answer_cache.init_app(app)
+principal_cache.init_app(app)
+metrics.init_app(app)
+# After metrics, so its hook runs first and response sizes are measured compressed
+compressor.init_app(app)
 
 # Authentication decorator
 def token_required(f):
@@ -34,7 +103,8 @@ def token_required(f):
             if token.startswith('Bearer '):
                 token = token[7:]
             data = jwt.decode(token, app.config['SECRET_KEY'], algorithms=['HS256'])
-            current_user = User.query.get(data['user_id'])
+            # A Principal (id, username, email), usually served without a database query
+            current_user = principal_cache.load(data['user_id'])
             if not current_user:
                 return jsonify({'message': 'User not found!'}), 401
         except Exception as e:
@@ -44,6 +114,169 @@ def token_required(f):
     
     return decorated
 
+def load_message_request(current_user, chat_id):
+    """
+    Validate a send-message request.
+    
+    Returns (chat, document, data, error_response); error_response is None when valid.
+    """
+    chat = Chat.query.filter_by(id=chat_id, user_id=current_user.id).first()
+    
+    if not chat:
+        return None, None, None, (jsonify({'message': 'Chat not found!'}), 404)
+    
+    data = request.get_json()
+    
+    if not data or not data.get('message'):
+        return chat, None, None, (jsonify({'message': 'Message is required!'}), 400)
+    
+    try:
+        check_question(data['message'])
+    except PromptTooLarge as e:
+        return chat, None, data, (jsonify({'message': 'Message is too long!', 'error': str(e)}), 413)
+    
+    # Get document context
+    document = Document.query.get(chat.document_id)
+    
+    if not document:
+        return chat, None, data, (jsonify({'message': 'Document not found!'}), 404)
+    
+    return chat, document, data, document_not_ready(document)
+
+def build_document_context(document, data, history):
+    """
+    Select the document excerpts to send with a question (None for no_context requests).
+    
+    The retrieval budget is capped to the room the question and `history`
+    leave in the prompt, so excerpts are dropped by relevance rather than cut.
+    """
+    if data.get('no_context', False):
+        return None
+    
+    top_k, token_budget = get_retrieval_settings(data)
+    token_budget = min(token_budget, context_token_limit(data['message'], history))
+    if token_budget <= 0:
+        return ''
+    return select_context(document, data['message'], top_k, token_budget)
+
+def answer_cache_key(document, data):
+    """
+    Cache namespace for answers about a document.
+    
+    Documents uploaded from the same file share their answers; general
+    (no_context) answers do not depend on the document at all.
+    """
+    if data.get('no_context', False):
+        return 'general'
+    return document_answer_key(document.id, document.content_sha256)
+
+def get_retrieval_settings(data):
+    """Read per-request top_k / context_tokens overrides, clamped to the configured maximums."""
+    try:
+        top_k = int(data.get('top_k') or app.config['RETRIEVAL_TOP_K'])
+        token_budget = int(data.get('context_tokens') or app.config['RETRIEVAL_TOKEN_BUDGET'])
+    except (TypeError, ValueError):
+        top_k = app.config['RETRIEVAL_TOP_K']
+        token_budget = app.config['RETRIEVAL_TOKEN_BUDGET']
+    
+    top_k = max(1, min(top_k, app.config['RETRIEVAL_MAX_TOP_K']))
+    token_budget = max(1, min(token_budget, app.config['RETRIEVAL_MAX_TOKEN_BUDGET']))
+    return top_k, token_budget
+
+def document_not_ready(document):
+    """Return an error response if the document has not finished ingestion, else None."""
+    if document.status in (Document.STATUS_READY, Document.STATUS_UPDATING):
+        return None
+    
+    if document.status == Document.STATUS_FAILED:
+        return jsonify({
+            'message': 'Document processing failed!',
+            'status': document.status,
+            'error': document.error_message
+        }), 409
+    
+    return jsonify({'message': 'Document is still being processed!', 'status': document.status}), 409
+
+def serialize_message(message):
+    return {
+        'id': message.id,
+        'sender': message.sender,
+        'message': message.message,
+        'timestamp': message.timestamp.isoformat()
+    }
+
+def sse_event(event, payload):
+    """Format a Server-Sent Events frame with a JSON payload."""
+    return f"event: {event}\ndata: {json.dumps(payload)}\n\n"
+
+def update_chat_preview(chat, message):
+    """Keep the denormalized chat list columns in sync with a newly saved message."""
+    chat.last_message_at = message.timestamp or datetime.datetime.utcnow()
+    if chat.preview is None and message.sender == 'user':
+        chat.preview = message.message[:50] + ('...' if len(message.message) > 50 else '')
+
+def encode_chat_cursor(chat):
+    return f"{chat.created_at.isoformat()}_{chat.id}"
+
+def decode_chat_cursor(cursor):
+    created_at, chat_id = cursor.rsplit('_', 1)
+    return datetime.datetime.fromisoformat(created_at), int(chat_id)
+
+def load_document_sections(document):
+    """Structure of a document's extracted text, or None if it was extracted without one."""
+    if document.content_sha256 is None:
+        return None
+    structure = db.session.query(ExtractedText.structure).filter_by(sha256=document.content_sha256).scalar()
+    return load_sections(structure) if structure is not None else None
+
+def serialize_section(position, section):
+    return {
+        'position': position,
+        'kind': section.kind,
+        'number': section.number,
+        'title': section.title,
+        'level': section.level,
+        'start': section.start,
+        'end': section.end
+    }
+
+def document_section_response(current_user, document_id, find_section):
+    """Text and blocks of the outline section picked by `find_section(outline)`."""
+    document = Document.query.filter_by(id=document_id, user_id=current_user.id).first()
+    
+    if not document:
+        return jsonify({'message': 'Document not found!'}), 404
+    
+    not_ready = document_not_ready(document)
+    if not_ready:
+        return not_ready
+    
+    sections = load_document_sections(document) or []
+    section_outline = outline(sections)
+    section = find_section(section_outline)
+    
+    if section is None:
+        return jsonify({'message': 'Section not found!'}), 404
+    
+    result = serialize_section(section_outline.index(section), section)
+    result['text'] = document.extracted_text[section.start:section.end]
+    result['blocks'] = [
+        {'kind': block.kind, 'title': block.title, 'level': block.level, 'start': block.start, 'end': block.end}
+        for block in blocks_within(sections, section.start, section.end)
+    ]
+    return jsonify(result), 200
+
+def serialize_document(document):
+    return {
+        'id': document.id,
+        'filename': document.filename,
+        'uploaded_at': document.uploaded_at.isoformat(),
+        'status': document.status,
+        'version': document.version,
+        'token_count': document.token_count,
+        'error': document.error_message
+    }
+
 # ==================== AUTH ENDPOINTS ====================
 
 @app.route('/api/auth/register', methods=['POST'])
@@ -106,13 +339,10 @@ def login():
 
 @app.route('/api/documents', methods=['GET'])
 @token_required
+@conditional_get
 def get_documents(current_user):
     documents = Document.query.filter_by(user_id=current_user.id).order_by(Document.uploaded_at.desc()).all()
-    return jsonify([{
-        'id': doc.id,
-        'filename': doc.filename,
-        'uploaded_at': doc.uploaded_at.isoformat()
-    } for doc in documents]), 200
+    return jsonify([serialize_document(doc) for doc in documents]), 200
 
 @app.route('/api/documents/upload', methods=['POST'])
 @token_required
@@ -125,45 +355,226 @@ def upload_document(current_user):
     if file.filename == '':
         return jsonify({'message': 'No file selected!'}), 400
     
-    allowed_extensions = {'pdf', 'docx', 'pptx', 'txt'}
     file_ext = file.filename.rsplit('.', 1)[1].lower() if '.' in file.filename else ''
     
-    if file_ext not in allowed_extensions:
+    if file_ext not in SUPPORTED_TYPES:
         return jsonify({'message': 'File type not supported!'}), 400
     
     try:
-        # Extract text from file
-        extracted_text = extract_text_from_file(file, file_ext)
-        
-        if not extracted_text.strip():
-            return jsonify({'message': 'No text could be extracted from the document!'}), 400
-        
-        # Save document to database
+        path, digest = ingestion.spool(file.stream, suffix=f'.{file_ext}')
+    except Exception as e:
+        print(f"Error receiving document {file.filename}: {str(e)}")
+        return jsonify({'message': 'Error receiving document!', 'error': str(e)}), 500
+    
+    try:
+        # Save a pending document; text extraction runs in the background
         new_document = Document(
             user_id=current_user.id,
             filename=file.filename,
-            extracted_text=extracted_text
+            extracted_text='',
+            status=Document.STATUS_PENDING
         )
         
         db.session.add(new_document)
         db.session.commit()
         
+        ingestion.submit(new_document.id, path, file_ext, digest)
+        
         return jsonify({
-            'message': 'Document uploaded successfully!',
-            'document': {
-                'id': new_document.id,
-                'filename': new_document.filename,
-                'uploaded_at': new_document.uploaded_at.isoformat()
-            }
-        }), 201
+            'message': 'Document upload accepted!',
+            'job_id': new_document.id,
+            'document': serialize_document(new_document)
+        }), 202
     
     except Exception as e:
         import traceback
         error_details = traceback.format_exc()
-        print(f"Error processing document {file.filename}: {str(e)}")
+        print(f"Error queueing document {file.filename}: {str(e)}")
         print(f"Details: {error_details}")
+        db.session.rollback()
+        if os.path.exists(path):
+            os.unlink(path)
         return jsonify({'message': 'Error processing document!', 'error': str(e)}), 500
 
+@app.route('/api/documents/<int:document_id>/versions', methods=['POST'])
+@token_required
+def upload_document_version(current_user, document_id):
+    """Replace a document's file with a new version; chats and unchanged pages are kept."""
+    document = Document.query.filter_by(id=document_id, user_id=current_user.id).first()
+    
+    if not document:
+        return jsonify({'message': 'Document not found!'}), 404
+    
+    # A failed document can be fixed by uploading the file again
+    if document.status not in (Document.STATUS_READY, Document.STATUS_FAILED):
+        message = 'A new version is already being processed!' if document.status == Document.STATUS_UPDATING \
+            else 'Only a processed document can get a new version!'
+        return jsonify({'message': message, 'status': document.status}), 409
+    
+    if 'file' not in request.files:
+        return jsonify({'message': 'No file provided!'}), 400
+    
+    file = request.files['file']
+    
+    if file.filename == '':
+        return jsonify({'message': 'No file selected!'}), 400
+    
+    file_ext = file.filename.rsplit('.', 1)[1].lower() if '.' in file.filename else ''
+    
+    if file_ext not in SUPPORTED_TYPES:
+        return jsonify({'message': 'File type not supported!'}), 400
+    
+    try:
+        path, digest = ingestion.spool(file.stream, suffix=f'.{file_ext}')
+    except Exception as e:
+        print(f"Error receiving document {file.filename}: {str(e)}")
+        return jsonify({'message': 'Error receiving document!', 'error': str(e)}), 500
+    
+    if digest == document.content_sha256:
+        os.unlink(path)
+        return jsonify({
+            'message': 'This file is identical to the current version.',
+            'document': serialize_document(document)
+        }), 200
+    
+    try:
+        # The previous version keeps being served until the new one is swapped in;
+        # if processing fails the document goes back to ready with an error message.
+        # A failed document has nothing to serve, so it is pending like a new upload.
+        document.status = Document.STATUS_UPDATING if document.status == Document.STATUS_READY \
+            else Document.STATUS_PENDING
+        document.error_message = None
+        db.session.commit()
+        
+        ingestion.submit_version(document.id, path, file_ext, digest, file.filename)
+        
+        return jsonify({
+            'message': 'New version accepted!',
+            'job_id': document.id,
+            'document': serialize_document(document)
+        }), 202
+    
+    except Exception as e:
+        import traceback
+        print(f"Error queueing new version of document {document_id}: {str(e)}")
+        print(f"Details: {traceback.format_exc()}")
+        db.session.rollback()
+        if os.path.exists(path):
+            os.unlink(path)
+        return jsonify({'message': 'Error processing document!', 'error': str(e)}), 500
+
+@app.route('/api/documents/bulk', methods=['POST'])
+@token_required
+def bulk_upload_documents(current_user):
+    """Import a zip archive ('file') or several files at once ('files', e.g. a folder upload)."""
+    archive = request.files.get('file')
+    uploads = request.files.getlist('files')
+    
+    if not archive and not uploads:
+        return jsonify({'message': 'No file provided!'}), 400
+    
+    staged, skipped, errors = [], [], []
+    try:
+        if archive:
+            zip_path, _ = ingestion.spool(archive.stream, suffix='.zip')
+            try:
+                staged, skipped, errors = stage_zip(
+                    zip_path, app.config['BULK_IMPORT_MAX_FILES'], app.config['BULK_IMPORT_MAX_BYTES']
+                )
+            finally:
+                os.unlink(zip_path)
+        else:
+            if len(uploads) > app.config['BULK_IMPORT_MAX_FILES']:
+                return jsonify({'message': f"Too many files! The limit is {app.config['BULK_IMPORT_MAX_FILES']}."}), 400
+            for upload in uploads:
+                file_ext = upload.filename.rsplit('.', 1)[1].lower() if '.' in upload.filename else ''
+                if file_ext not in SUPPORTED_TYPES:
+                    skipped.append(upload.filename)
+                    continue
+                path, digest = ingestion.spool(upload.stream, suffix=f'.{file_ext}')
+                staged.append(StagedFile(upload.filename[-255:], file_ext, path, digest, True))
+    except ValueError as e:
+        cleanup(staged)
+        return jsonify({'message': str(e)}), 400
+    except Exception as e:
+        cleanup(staged)
+        print(f"Error receiving bulk import: {str(e)}")
+        return jsonify({'message': 'Error receiving documents!', 'error': str(e)}), 500
+    
+    if not staged:
+        return jsonify({'message': 'No supported documents found!', 'skipped': skipped, 'errors': errors}), 400
+    
+    try:
+        documents = queue_import(current_user.id, staged, app.config['BULK_IMPORT_BATCH_SIZE'])
+    except Exception as e:
+        import traceback
+        print(f"Error queueing bulk import: {str(e)}")
+        print(f"Details: {traceback.format_exc()}")
+        db.session.rollback()
+        cleanup(staged)
+        return jsonify({'message': 'Error processing documents!', 'error': str(e)}), 500
+    
+    return jsonify({
+        'message': f'{len(documents)} documents accepted!',
+        'documents': [serialize_document(document) for document in documents],
+        'skipped': skipped,
+        'errors': errors
+    }), 202
+
+@app.route('/api/documents/<int:document_id>/status', methods=['GET'])
+@token_required
+def get_document_status(current_user, document_id):
+    document = Document.query.filter_by(id=document_id, user_id=current_user.id).first()
+    
+    if not document:
+        return jsonify({'message': 'Document not found!'}), 404
+    
+    return jsonify({
+        'job_id': document.id,
+        'document_id': document.id,
+        'status': document.status,
+        'error': document.error_message
+    }), 200
+
+@app.route('/api/documents/<int:document_id>/sections', methods=['GET'])
+@token_required
+def get_document_sections(current_user, document_id):
+    document = Document.query.filter_by(id=document_id, user_id=current_user.id).first()
+    
+    if not document:
+        return jsonify({'message': 'Document not found!'}), 404
+    
+    not_ready = document_not_ready(document)
+    if not_ready:
+        return not_ready
+    
+    # Only the structure is read here, not the text
+    sections = [
+        serialize_section(position, section)
+        for position, section in enumerate(outline(load_document_sections(document) or []))
+    ]
+    
+    # Clients fall back to /pages or the full text when there is nothing to navigate
+    return jsonify({
+        'document_id': document.id,
+        'structured': bool(sections),
+        'sections': sections
+    }), 200
+
+@app.route('/api/documents/<int:document_id>/sections/<int:position>', methods=['GET'])
+@token_required
+def get_document_section(current_user, document_id, position):
+    return document_section_response(current_user, document_id, lambda sections: (
+        sections[position] if position < len(sections) else None
+    ))
+
+@app.route('/api/documents/<int:document_id>/pages/<int:number>', methods=['GET'])
+@token_required
+def get_document_page(current_user, document_id, number):
+    return document_section_response(current_user, document_id, lambda sections: next(
+        (section for section in sections if section.kind in PAGE_KINDS and section.number == number), None
+    ))
+
 @app.route('/api/documents/<int:document_id>', methods=['DELETE'])
 @token_required
 def delete_document(current_user, document_id):
@@ -172,13 +583,26 @@ def delete_document(current_user, document_id):
     if not document:
         return jsonify({'message': 'Document not found!'}), 404
     
-    # Delete associated chats and messages
-    chats = Chat.query.filter_by(document_id=document_id).all()
-    for chat in chats:
-        Message.query.filter_by(chat_id=chat.id).delete()
-    Chat.query.filter_by(document_id=document_id).delete()
+    content_sha256 = document.content_sha256
+    
+    # One set-based DELETE per table instead of loading and deleting rows one by one
+    chat_ids = db.session.query(Chat.id).filter(Chat.document_id == document_id)
+    Message.query.filter(Message.chat_id.in_(chat_ids.scalar_subquery())).delete(synchronize_session=False)
+    Chat.query.filter_by(document_id=document_id).delete(synchronize_session=False)
+    DocumentChunk.query.filter_by(document_id=document_id).delete(synchronize_session=False)
+    StudyMaterial.query.filter_by(document_id=document_id).delete(synchronize_session=False)
+    Document.query.filter_by(id=document_id).delete(synchronize_session=False)
+    db.session.expunge(document)
+    invalidate_index(document_id)
+    touch_user(current_user.id)
+    
+    # Drop the shared extracted text once no document references it
+    if content_sha256:
+        if ExtractedText.delete_unreferenced(content_sha256):
+            answer_cache.invalidate(document_answer_key(document_id, content_sha256))
+    else:
+        answer_cache.invalidate(document_answer_key(document_id, None))
     
-    db.session.delete(document)
     db.session.commit()
     
     return jsonify({'message': 'Document deleted successfully!'}), 200
@@ -187,30 +611,50 @@ def delete_document(current_user, document_id):
 
 @app.route('/api/chats', methods=['GET'])
 @token_required
+@conditional_get
 def get_chats(current_user):
-    chats = Chat.query.filter_by(user_id=current_user.id).order_by(Chat.created_at.desc()).all()
+    # One query: chat rows (with their denormalized preview) joined to the document name
+    query = db.session.query(Chat, Document.filename) \
+        .outerjoin(Document, Chat.document_id == Document.id) \
+        .filter(Chat.user_id == current_user.id) \
+        .order_by(Chat.created_at.desc(), Chat.id.desc())
     
-    result = []
-    for chat in chats:
-        document = Document.query.get(chat.document_id)
-        messages = Message.query.filter_by(chat_id=chat.id).order_by(Message.timestamp.asc()).all()
-        
-        # Get first user message as preview
-        preview = "New chat"
-        for msg in messages:
-            if msg.sender == 'user':
-                preview = msg.message[:50] + ('...' if len(msg.message) > 50 else '')
-                break
-        
-        result.append({
-            'id': chat.id,
-            'document_id': chat.document_id,
-            'document_name': document.filename if document else 'Unknown',
-            'created_at': chat.created_at.isoformat(),
-            'preview': preview
-        })
+    # Optional keyset pagination: ?limit=N&cursor=<X-Next-Cursor of the previous page>
+    limit = request.args.get('limit', type=int)
+    cursor = request.args.get('cursor')
     
-    return jsonify(result), 200
+    if cursor:
+        try:
+            cursor_created_at, cursor_id = decode_chat_cursor(cursor)
+        except ValueError:
+            return jsonify({'message': 'Invalid cursor!'}), 400
+        query = query.filter(db.or_(
+            Chat.created_at < cursor_created_at,
+            db.and_(Chat.created_at == cursor_created_at, Chat.id < cursor_id)
+        ))
+    
+    if limit:
+        limit = max(1, min(limit, 200))
+        rows = query.limit(limit + 1).all()
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+    else:
+        rows = query.all()
+        has_more = False
+    
+    result = [{
+        'id': chat.id,
+        'document_id': chat.document_id,
+        'document_name': filename or 'Unknown',
+        'created_at': chat.created_at.isoformat(),
+        'last_message_at': chat.last_message_at.isoformat() if chat.last_message_at else None,
+        'preview': chat.preview or "New chat"
+    } for chat, filename in rows]
+    
+    response = jsonify(result)
+    if has_more:
+        response.headers['X-Next-Cursor'] = encode_chat_cursor(rows[-1][0])
+    return response, 200
 
 @app.route('/api/chats', methods=['POST'])
 @token_required
@@ -226,6 +670,10 @@ def create_chat(current_user):
     if not document:
         return jsonify({'message': 'Document not found!'}), 404
     
+    not_ready = document_not_ready(document)
+    if not_ready:
+        return not_ready
+    
     new_chat = Chat(
         user_id=current_user.id,
         document_id=data['document_id']
@@ -242,39 +690,57 @@ def create_chat(current_user):
 
 @app.route('/api/chats/<int:chat_id>', methods=['GET'])
 @token_required
+@conditional_get
 def get_chat_messages(current_user, chat_id):
     chat = Chat.query.filter_by(id=chat_id, user_id=current_user.id).first()
     
     if not chat:
         return jsonify({'message': 'Chat not found!'}), 404
     
-    messages = Message.query.filter_by(chat_id=chat_id).order_by(Message.timestamp.asc()).all()
+    query = Message.query.options(db.undefer(Message.message)).filter_by(chat_id=chat_id)
     
-    return jsonify([{
-        'id': msg.id,
-        'sender': msg.sender,
-        'message': msg.message,
-        'timestamp': msg.timestamp.isoformat()
-    } for msg in messages]), 200
-
-@app.route('/api/chats/<int:chat_id>/messages', methods=['POST'])
-@token_required
-def send_message(current_user, chat_id):
-    chat = Chat.query.filter_by(id=chat_id, user_id=current_user.id).first()
+    # Optional keyset pagination by message id: ?limit=N returns the latest N messages,
+    # &before=<id> the N before a message (older history), &after=<id> the N after it
+    limit = request.args.get('limit', type=int)
+    before = request.args.get('before', type=int)
+    after = request.args.get('after', type=int)
     
-    if not chat:
-        return jsonify({'message': 'Chat not found!'}), 404
+    if before is not None and after is not None:
+        return jsonify({'message': 'Use either before or after, not both!'}), 400
     
-    data = request.get_json()
+    if not limit and before is None and after is None:
+        messages = query.order_by(Message.id.asc()).all()
+        return jsonify([serialize_message(msg) for msg in messages]), 200
     
-    if not data or not data.get('message'):
-        return jsonify({'message': 'Message is required!'}), 400
+    limit = max(1, min(limit or app.config['MESSAGES_PAGE_SIZE'], 200))
     
-    # Get document context
-    document = Document.query.get(chat.document_id)
+    if after is not None:
+        rows = query.filter(Message.id > after).order_by(Message.id.asc()).limit(limit + 1).all()
+        has_more = len(rows) > limit
+        messages = rows[:limit]
+    else:
+        if before is not None:
+            query = query.filter(Message.id < before)
+        rows = query.order_by(Message.id.desc()).limit(limit + 1).all()
+        has_more = len(rows) > limit
+        messages = rows[:limit][::-1]
     
-    if not document:
-        return jsonify({'message': 'Document not found!'}), 404
+    response = jsonify([serialize_message(msg) for msg in messages])
+    response.headers['X-Has-More'] = 'true' if has_more else 'false'
+    if has_more:
+        # Pass as `before` (or `after` when paging forward) to get the next page
+        response.headers['X-Next-Cursor'] = str(messages[-1].id if after is not None else messages[0].id)
+    return response, 200
+
+@app.route('/api/chats/<int:chat_id>/messages', methods=['POST'])
+@token_required
+def send_message(current_user, chat_id):
+    chat, document, data, error = load_message_request(current_user, chat_id)
+    if error:
+        return error
+    
+    use_cache = not data.get('no_cache', False) and \
+        is_cacheable(data['message'], has_history=chat.last_message_at is not None)
     
     # Save user message
     user_message = Message(
@@ -283,12 +749,23 @@ def send_message(current_user, chat_id):
         message=data['message']
     )
     db.session.add(user_message)
+    db.session.flush()
+    update_chat_preview(chat, user_message)
     db.session.commit()
     
     try:
-        # Get AI response from Groq
+        # Get AI response from the answer cache or Groq
         no_context = data.get('no_context', False)
-        ai_response = get_groq_response(document.extracted_text, data['message'], no_context=no_context)
+        cache_key = answer_cache_key(document, data)
+        ai_response = answer_cache.get(cache_key, data['message']) if use_cache else None
+        cached = ai_response is not None
+        
+        if not cached:
+            history = build_history(chat, before_id=user_message.id)
+            document_context = build_document_context(document, data, history)
+            ai_response = get_groq_response(document_context, data['message'], no_context=no_context, history=history)
+            if use_cache:
+                answer_cache.put(cache_key, data['message'], ai_response)
         
         # Save AI message
         ai_message = Message(
@@ -297,26 +774,96 @@ def send_message(current_user, chat_id):
             message=ai_response
         )
         db.session.add(ai_message)
+        db.session.flush()
+        update_chat_preview(chat, ai_message)
         db.session.commit()
         
+        schedule_summary_update(app, chat_id)
+        
         return jsonify({
-            'user_message': {
-                'id': user_message.id,
-                'sender': 'user',
-                'message': user_message.message,
-                'timestamp': user_message.timestamp.isoformat()
-            },
-            'ai_message': {
-                'id': ai_message.id,
-                'sender': 'ai',
-                'message': ai_message.message,
-                'timestamp': ai_message.timestamp.isoformat()
-            }
+            'user_message': serialize_message(user_message),
+            'ai_message': serialize_message(ai_message),
+            'cached': cached
         }), 201
     
     except Exception as e:
         return jsonify({'message': 'Error getting AI response!', 'error': str(e)}), 500
 
+@app.route('/api/chats/<int:chat_id>/messages/stream', methods=['POST'])
+@token_required
+def stream_message(current_user, chat_id):
+    """Streaming variant of send_message: forwards the AI response as Server-Sent Events."""
+    chat, document, data, error = load_message_request(current_user, chat_id)
+    if error:
+        return error
+    
+    use_cache = not data.get('no_cache', False) and \
+        is_cacheable(data['message'], has_history=chat.last_message_at is not None)
+    
+    user_message = Message(
+        chat_id=chat_id,
+        sender='user',
+        message=data['message']
+    )
+    db.session.add(user_message)
+    db.session.flush()
+    update_chat_preview(chat, user_message)
+    db.session.commit()
+    
+    no_context = data.get('no_context', False)
+    
+    def generate():
+        yield sse_event('user_message', serialize_message(user_message))
+        
+        parts = []
+        saved = False
+        try:
+            cache_key = answer_cache_key(document, data)
+            cached_answer = answer_cache.get(cache_key, data['message']) if use_cache else None
+            
+            if cached_answer is not None:
+                parts.append(cached_answer)
+                yield sse_event('token', {'token': cached_answer, 'cached': True})
+            else:
+                history = build_history(chat, before_id=user_message.id)
+                document_context = build_document_context(document, data, history)
+                for token in get_groq_response(document_context, data['message'], no_context=no_context,
+                                               stream=True, history=history):
+                    parts.append(token)
+                    yield sse_event('token', {'token': token})
+                if use_cache:
+                    answer_cache.put(cache_key, data['message'], ''.join(parts))
+            
+            ai_message = Message(chat_id=chat_id, sender='ai', message=''.join(parts))
+            db.session.add(ai_message)
+            db.session.flush()
+            update_chat_preview(chat, ai_message)
+            db.session.commit()
+            saved = True
+            
+            yield sse_event('done', {'ai_message': serialize_message(ai_message)})
+            
+            schedule_summary_update(app, chat_id)
+        
+        except GeneratorExit:
+            # Client disconnected; keep whatever was generated so far
+            if parts and not saved:
+                ai_message = Message(chat_id=chat_id, sender='ai', message=''.join(parts))
+                db.session.add(ai_message)
+                db.session.flush()
+                update_chat_preview(chat, ai_message)
+                db.session.commit()
+            raise
+        
+        except Exception as e:
+            yield sse_event('error', {'message': 'Error getting AI response!', 'error': str(e)})
+    
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
 @app.route('/api/chats/<int:chat_id>', methods=['DELETE'])
 @token_required
 def delete_chat(current_user, chat_id):
@@ -326,17 +873,85 @@ def delete_chat(current_user, chat_id):
         return jsonify({'message': 'Chat not found!'}), 404
     
     # Delete messages first
-    Message.query.filter_by(chat_id=chat_id).delete()
-    db.session.delete(chat)
+    Message.query.filter_by(chat_id=chat_id).delete(synchronize_session=False)
+    Chat.query.filter_by(id=chat_id).delete(synchronize_session=False)
+    db.session.expunge(chat)
+    touch_user(current_user.id)
     db.session.commit()
     
     return jsonify({'message': 'Chat deleted successfully!'}), 200
 
+# ==================== SEARCH ENDPOINT ====================
+
+@app.route('/api/search', methods=['GET'])
+@token_required
+def search(current_user):
+    query = request.args.get('q', '')
+    search_type = request.args.get('type', 'all')
+    
+    if search_type not in ('all', 'documents', 'messages'):
+        return jsonify({'message': 'Search type must be all, documents or messages!'}), 400
+    if to_fts_query(query) is None:
+        return jsonify({'message': 'Search query is required!'}), 400
+    
+    limit = max(1, min(request.args.get('limit', 20, type=int), 100))
+    offset = max(0, request.args.get('offset', 0, type=int))
+    
+    result = {'query': query, 'documents': [], 'messages': [], 'has_more': False}
+    
+    if search_type in ('all', 'documents'):
+        result['documents'], has_more = search_documents(current_user.id, query, limit, offset)
+        result['has_more'] = result['has_more'] or has_more
+    if search_type in ('all', 'messages'):
+        result['messages'], has_more = search_messages(current_user.id, query, limit, offset)
+        result['has_more'] = result['has_more'] or has_more
+    
+    return jsonify(result), 200
+
 # ==================== HEALTH CHECK ====================
 
+@app.errorhandler(413)
+def upload_too_large(e):
+    limit_mb = app.config['MAX_CONTENT_LENGTH'] // (1024 * 1024)
+    return jsonify({'message': f'File is too large! The maximum upload size is {limit_mb}MB.'}), 413
+
 @app.route('/api/health', methods=['GET'])
 def health_check():
-    return jsonify({'status': 'healthy'}), 200
+    return jsonify({
+        'status': 'healthy',
+        'answer_cache': answer_cache.stats(),
+        'auth_cache': principal_cache.stats()
+    }), 200
+
+def metrics_access_error():
+    """
+    Error response for a request that may not read /api/metrics, else None.
+    
+    With METRICS_TOKEN set the scraper must send it as a Bearer token.
+    Without it only direct requests from this machine are served; requests
+    passed on by a reverse proxy carry X-Real-IP/X-Forwarded-For and are refused.
+    """
+    token = app.config.get('METRICS_TOKEN')
+    if token:
+        supplied = request.headers.get('Authorization', '')
+        if not hmac.compare_digest(supplied.encode(), f'Bearer {token}'.encode()):
+            return jsonify({'message': 'Metrics token is missing or invalid!'}), 401
+        return None
+    
+    try:
+        local = ipaddress.ip_address(request.remote_addr or '').is_loopback
+    except ValueError:
+        local = False
+    if not local or 'X-Real-IP' in request.headers or 'X-Forwarded-For' in request.headers:
+        return jsonify({'message': 'Metrics are only served locally unless METRICS_TOKEN is set!'}), 403
+    return None
+
+@app.route('/api/metrics', methods=['GET'])
+def get_metrics():
+    error = metrics_access_error()
+    if error:
+        return error
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
 
 @app.route('/api/documents/<int:doc_id>/study-tools', methods=['POST'])
 @token_required
@@ -344,23 +959,140 @@ def get_study_tools(current_user, doc_id):
     document = Document.query.filter_by(id=doc_id, user_id=current_user.id).first()
     if not document:
         return jsonify({'message': 'Document not found!'}), 404
+    
+    not_ready = document_not_ready(document)
+    if not_ready:
+        return not_ready
         
     data = request.json
     tool_type = data.get('type') # flashcards, quiz, mindmap
     
     if tool_type not in ['flashcards', 'quiz', 'mindmap']:
         return jsonify({'message': 'Invalid tool type!'}), 400
+    
+    cached = StudyMaterial.query.filter_by(
+        document_id=doc_id,
+        tool_type=tool_type,
+        prompt_version=STUDY_PROMPT_VERSION
+    ).first()
+    
+    if cached and not data.get('regenerate'):
+        return Response(cached.content, mimetype='application/json', headers={'X-Cache': 'HIT'})
         
     try:
-        from groq_service import generate_study_material
-        result = generate_study_material(document.extracted_text, tool_type)
-        return jsonify(result)
+        result = generate_study_material(document.extracted_text, tool_type, document_token_count(document))
     except Exception as e:
         return jsonify({'message': str(e)}), 500
+    
+    content = json.dumps(result)
+    
+    # Material generated with older prompts will never be served again
+    StudyMaterial.query.filter(
+        StudyMaterial.document_id == doc_id,
+        StudyMaterial.tool_type == tool_type,
+        StudyMaterial.prompt_version != STUDY_PROMPT_VERSION
+    ).delete(synchronize_session=False)
+    
+    if cached:
+        cached.content = content
+        cached.created_at = datetime.datetime.utcnow()
+    else:
+        db.session.add(StudyMaterial(
+            document_id=doc_id,
+            tool_type=tool_type,
+            prompt_version=STUDY_PROMPT_VERSION,
+            content=content
+        ))
+    
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # A concurrent request cached the same material first
+        db.session.rollback()
+    
+    return Response(content, mimetype='application/json', headers={'X-Cache': 'MISS'})
 
 # ==================== DATABASE INITIALIZATION ====================
 
+@app.cli.command('upgrade-db')
+def upgrade_db_command():
+    """Create missing tables, columns and indexes in an existing database."""
+    upgrade_schema()
+    print("Database schema is up to date.")
+
+@app.cli.command('recover-documents')
+def recover_documents_command():
+    """Settle documents left pending by a stopped server (run before starting it)."""
+    documents = ingestion.recover_interrupted()
+    for document in documents:
+        print(f"{document.id} {document.filename}: {document.status} ({document.error_message})")
+    print(f"{len(documents)} interrupted documents recovered.")
+
+@app.cli.command('compress-text')
+@click.option('--batch-size', default=500, show_default=True, help='Rows rewritten per transaction.')
+@click.option('--vacuum/--no-vacuum', default=True, show_default=True, help='Reclaim the freed space afterwards.')
+def compress_text_command(batch_size, vacuum):
+    """Compress extracted text and messages stored before compression (SQLite)."""
+    if db.engine.dialect.name != 'sqlite':
+        print("Compression only applies to SQLite databases.")
+        return
+    
+    upgrade_schema()
+    size_before = database_size()
+    latency_before = measure_read_latency()
+    
+    rewritten = compress_existing_text(batch_size=batch_size)
+    
+    if vacuum:
+        print("Vacuuming database...")
+        db.session.remove()
+        with db.engine.connect() as connection:
+            connection.execution_options(isolation_level='AUTOCOMMIT').execute(text('VACUUM'))
+    
+    size_after = database_size()
+    latency_after = measure_read_latency()
+    
+    for column, count in rewritten.items():
+        print(f"{column}: {count} rows compressed, "
+              f"read latency {latency_before.get(column, 0):.3f}ms -> {latency_after.get(column, 0):.3f}ms per row")
+    print(f"Database size: {size_before / 1024 / 1024:.1f}MB -> {size_after / 1024 / 1024:.1f}MB")
+
+@app.cli.command('import-documents')
+@click.argument('source', type=click.Path(exists=True))
+@click.option('--user', 'identifier', required=True, help='Username or email of the owner.')
+@click.option('--workers', type=int, default=None, help='Extraction processes (default: INGESTION_WORKERS).')
+@click.option('--batch-size', default=20, show_default=True, help='Documents committed per transaction.')
+def import_documents_command(source, identifier, workers, batch_size):
+    """Import every PDF/DOCX/PPTX/TXT file of a directory or zip archive."""
+    user = User.query.filter((User.username == identifier) | (User.email == identifier)).first()
+    if not user:
+        raise click.ClickException(f'User not found: {identifier}')
+    
+    if os.path.isdir(source):
+        staged, skipped, errors = stage_directory(source)
+    else:
+        try:
+            staged, skipped, errors = stage_zip(source, max_files=float('inf'), max_bytes=float('inf'))
+        except ValueError as e:
+            raise click.ClickException(str(e))
+    
+    print(f"Importing {len(staged)} documents for {user.username} ({len(skipped)} unsupported files skipped)")
+    try:
+        imported, extraction_errors = import_files(user.id, staged, workers=workers, batch_size=batch_size)
+    finally:
+        cleanup(staged)
+    errors.extend(extraction_errors)
+    
+    print(f"Imported {len(imported)} documents, {len(errors)} failed.")
+    for error in errors:
+        print(f"  {error['name']}: {error['error']}")
+    if errors:
+        raise SystemExit(1)
+
 if __name__ == '__main__':
     with app.app_context():
-        db.create_all()
+        upgrade_schema()
+        # The development server (and each reload of it) is the only process
+        # handling uploads, so jobs of a previous run can no longer finish
+        ingestion.recover_interrupted()
     app.run(debug=True, port=5000)
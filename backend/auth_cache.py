@@ -0,0 +1,81 @@
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+from sqlalchemy import event
+
+from models import db, User
+
+# What request handlers get as `current_user`: enough to identify the user, no ORM session
+Principal = namedtuple('Principal', ['id', 'username', 'email'])
+
+
+class PrincipalCache:
+    """
+    In-process cache of authenticated users, keyed by user id.
+
+    `load()` returns a Principal for a user id taken from a verified JWT,
+    hitting the database only on a miss or after `ttl` seconds. Entries are
+    dropped as soon as the user row is updated (e.g. a password change) or
+    deleted through the ORM in this process; other server processes notice
+    within `ttl` seconds. Bulk `query.delete()`/`update()` calls bypass the
+    ORM events, so they rely on the TTL too.
+    """
+
+    def __init__(self, app=None):
+        self.ttl = 60
+        self.max_entries = 10000
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # user id -> (principal, expires)
+        self._lock = threading.Lock()
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.ttl = app.config.get('AUTH_CACHE_TTL', self.ttl)
+        self.max_entries = app.config.get('AUTH_CACHE_MAX_ENTRIES', self.max_entries)
+        app.extensions['principal_cache'] = self
+
+    def load(self, user_id):
+        """Principal for `user_id`, or None if the user does not exist."""
+        now = time.monotonic()
+
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None and entry[1] > now:
+                self._entries.move_to_end(user_id)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+
+        user = db.session.get(User, user_id)
+        if user is None:
+            return None
+
+        principal = Principal(user.id, user.username, user.email)
+        if self.ttl > 0 and self.max_entries > 0:
+            with self._lock:
+                self._entries[user_id] = (principal, now + self.ttl)
+                self._entries.move_to_end(user_id)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        return principal
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._entries), 'hits': self.hits, 'misses': self.misses}
+
+
+principal_cache = PrincipalCache()
+
+
+@event.listens_for(User, 'after_update')
+@event.listens_for(User, 'after_delete')
+def _invalidate_principal(mapper, connection, target):
+    principal_cache.invalidate(target.id)
@@ -0,0 +1 @@
+"""Benchmark corpus, fake Groq server and load scenarios for the backend (see README)."""
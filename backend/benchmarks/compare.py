@@ -0,0 +1,57 @@
+"""
+Compare two benchmark reports.
+
+    python -m benchmarks.compare baseline.json candidate.json
+
+Prints throughput and p50/p95/p99 per scenario with the relative change;
+latency increases and throughput drops beyond --threshold percent are
+flagged, and the exit status is 1 if any were found.
+"""
+import argparse
+import json
+import sys
+
+METRICS = (('throughput_rps', None, 'req/s', True), ('p50', 'latency_ms', 'ms', False),
+           ('p95', 'latency_ms', 'ms', False), ('p99', 'latency_ms', 'ms', False))
+
+
+def value(result, key, section):
+    source = result.get(section) or {} if section else result
+    return source.get(key)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare two benchmark reports.')
+    parser.add_argument('baseline')
+    parser.add_argument('candidate')
+    parser.add_argument('--threshold', type=float, default=10.0, help='Percent change reported as a regression.')
+    args = parser.parse_args()
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.candidate) as f:
+        candidate = json.load(f)
+
+    print(f"baseline {baseline['meta'].get('commit')}  ->  candidate {candidate['meta'].get('commit')}")
+    regressions = 0
+
+    for name, new in candidate['scenarios'].items():
+        old = baseline['scenarios'].get(name)
+        if old is None:
+            continue
+        print(f"\n{name}")
+        for key, section, unit, higher_is_better in METRICS:
+            before, after = value(old, key, section), value(new, key, section)
+            if before is None or after is None:
+                continue
+            change = (after - before) / before * 100 if before else 0.0
+            worse = change < -args.threshold if higher_is_better else change > args.threshold
+            regressions += worse
+            flag = '  REGRESSION' if worse else ''
+            print(f"  {key:<15} {before:>10.2f} -> {after:>10.2f} {unit:<5} ({change:+.1f}%){flag}")
+
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,190 @@
+"""
+Deterministic benchmark corpus: PDF, DOCX, PPTX and TXT files in several sizes.
+
+    python -m benchmarks.corpus --output bench_corpus
+
+The same seed always produces the same files, so runs on different
+commits upload identical documents.
+"""
+import argparse
+import io
+import json
+import os
+import random
+
+from docx import Document as DocxDocument
+from pptx import Presentation
+from pptx.util import Inches
+
+# Approximate words per document for each size
+SIZES = {'small': 2000, 'medium': 20000, 'large': 100000}
+FILE_TYPES = ('pdf', 'docx', 'pptx', 'txt')
+
+# Words per PDF page / PPTX slide
+WORDS_PER_PAGE = 400
+WORDS_PER_SLIDE = 120
+
+SYLLABLES = ('ka', 'lo', 'mi', 'ne', 'ru', 'sa', 'ti', 'vo', 'xe', 'zu', 'an', 'el', 'or', 'un', 'is')
+
+
+def make_vocabulary(rng, size=3000):
+    """Pseudo-words with a realistic length distribution."""
+    return [''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(1, 4))) for _ in range(size)]
+
+
+def make_paragraphs(rng, vocabulary, words):
+    """Paragraphs of Zipf-distributed words totalling about `words` words."""
+    weights = [1 / (rank + 1) for rank in range(len(vocabulary))]
+    paragraphs = []
+    remaining = words
+    while remaining > 0:
+        count = min(remaining, rng.randint(40, 160))
+        sentence_words = rng.choices(vocabulary, weights, k=count)
+        paragraphs.append(' '.join(sentence_words).capitalize() + '.')
+        remaining -= count
+    return paragraphs
+
+
+def group(paragraphs, words_per_group):
+    groups, current, current_words = [], [], 0
+    for paragraph in paragraphs:
+        current.append(paragraph)
+        current_words += paragraph.count(' ') + 1
+        if current_words >= words_per_group:
+            groups.append(current)
+            current, current_words = [], 0
+    if current:
+        groups.append(current)
+    return groups
+
+
+def write_pdf(paragraphs):
+    """Minimal text-only PDF (Helvetica, one content stream per page)."""
+    pages = []
+    for page in group(paragraphs, WORDS_PER_PAGE):
+        lines = []
+        for paragraph in page:
+            words = paragraph.split()
+            lines.extend(' '.join(words[i:i + 14]) for i in range(0, len(words), 14))
+            lines.append('')
+        pages.append(lines)
+
+    objects = [
+        b'<< /Type /Catalog /Pages 2 0 R >>',
+        None,  # page tree, filled in below
+        b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>'
+    ]
+    kids = []
+    for lines in pages:
+        text = ' '.join('(%s) Tj T*' % line.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
+                        for line in lines)
+        stream = f'BT /F1 9 Tf 40 760 Td 11 TL {text} ET'.encode('latin-1')
+        objects.append(b'<< /Length %d >>\nstream\n' % len(stream) + stream + b'\nendstream')
+        content_id = len(objects)
+        objects.append(f'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] '
+                       f'/Resources << /Font << /F1 3 0 R >> >> /Contents {content_id} 0 R >>'.encode())
+        kids.append(f'{len(objects)} 0 R')
+    objects[1] = f'<< /Type /Pages /Kids [{" ".join(kids)}] /Count {len(kids)} >>'.encode()
+
+    out = bytearray(b'%PDF-1.4\n')
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(out))
+        out += b'%d 0 obj\n' % number + body + b'\nendobj\n'
+    xref = len(out)
+    out += b'xref\n0 %d\n0000000000 65535 f \n' % (len(objects) + 1)
+    for offset in offsets:
+        out += b'%010d 00000 n \n' % offset
+    out += b'trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n' % (len(objects) + 1, xref)
+    return bytes(out)
+
+
+def write_docx(paragraphs):
+    document = DocxDocument()
+    for number, section in enumerate(group(paragraphs, WORDS_PER_PAGE), 1):
+        document.add_heading(f'Section {number}', level=1)
+        for paragraph in section:
+            document.add_paragraph(paragraph)
+    buffer = io.BytesIO()
+    document.save(buffer)
+    return buffer.getvalue()
+
+
+def write_pptx(paragraphs):
+    presentation = Presentation()
+    layout = presentation.slide_layouts[6]  # blank
+    for slide_paragraphs in group(paragraphs, WORDS_PER_SLIDE):
+        slide = presentation.slides.add_slide(layout)
+        box = slide.shapes.add_textbox(Inches(0.5), Inches(0.5), Inches(9), Inches(6.5))
+        box.text_frame.text = '\n'.join(slide_paragraphs)
+    buffer = io.BytesIO()
+    presentation.save(buffer)
+    return buffer.getvalue()
+
+
+def write_txt(paragraphs):
+    return '\n\n'.join(paragraphs).encode('utf-8')
+
+
+WRITERS = {'pdf': write_pdf, 'docx': write_docx, 'pptx': write_pptx, 'txt': write_txt}
+
+
+def generate_corpus(output_dir, sizes=tuple(SIZES), file_types=FILE_TYPES, seed=42):
+    """
+    Write the corpus to `output_dir` and return its manifest.
+
+    The manifest lists every file with its type, size class and byte size,
+    plus sample questions built from the corpus vocabulary.
+    """
+    rng = random.Random(seed)
+    vocabulary = make_vocabulary(rng)
+    os.makedirs(output_dir, exist_ok=True)
+
+    files = []
+    for size in sizes:
+        paragraphs = make_paragraphs(rng, vocabulary, SIZES[size])
+        for file_type in file_types:
+            data = WRITERS[file_type](paragraphs)
+            name = f'{size}.{file_type}'
+            with open(os.path.join(output_dir, name), 'wb') as f:
+                f.write(data)
+            files.append({'name': name, 'type': file_type, 'size': size, 'bytes': len(data)})
+
+    questions = [
+        f'What does the document say about {rng.choice(vocabulary)} and {rng.choice(vocabulary)}?'
+        for _ in range(200)
+    ]
+    manifest = {'seed': seed, 'files': files, 'questions': questions}
+    with open(os.path.join(output_dir, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+def load_corpus(output_dir, sizes=tuple(SIZES), file_types=FILE_TYPES, seed=42):
+    """Return the manifest of an existing corpus, generating it if missing or different."""
+    path = os.path.join(output_dir, 'manifest.json')
+    if os.path.exists(path):
+        with open(path) as f:
+            manifest = json.load(f)
+        wanted = {(size, file_type) for size in sizes for file_type in file_types}
+        have = {(entry['size'], entry['type']) for entry in manifest['files']}
+        if manifest.get('seed') == seed and wanted == have:
+            return manifest
+    return generate_corpus(output_dir, sizes, file_types, seed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate the benchmark corpus.')
+    parser.add_argument('--output', default='bench_corpus', help='Directory to write the files to.')
+    parser.add_argument('--sizes', default=','.join(SIZES), help='Comma-separated size classes.')
+    parser.add_argument('--types', default=','.join(FILE_TYPES), help='Comma-separated file types.')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    manifest = generate_corpus(args.output, args.sizes.split(','), args.types.split(','), args.seed)
+    for entry in manifest['files']:
+        print(f"{entry['name']:<14} {entry['bytes'] / 1024:>10.1f} KB")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,195 @@
+"""
+Local stand-in for the Groq chat completions API.
+
+    python -m benchmarks.fake_groq --port 8099 --latency-ms 400
+
+Point the backend at it with GROQ_BASE_URL=http://127.0.0.1:8099. It
+answers every request after a configurable delay, streams answers token by
+token, returns well-formed flashcards/quiz/mind map JSON when JSON output is
+requested, and can inject 429/500 errors to exercise the retry path.
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ANSWER = ('Based on the document, the main idea is explained in the second section, '
+          'where the author compares both approaches and concludes that the first one is simpler.')
+
+STUDY_MATERIAL = {
+    'flashcards': [{'title': f'Concept {i}', 'description': f'Short explanation of concept {i}.'} for i in range(1, 11)],
+    'quiz': [
+        {'question': f'Question {i}?', 'options': ['A', 'B', 'C', 'D'], 'correct_index': i % 4}
+        for i in range(1, 11)
+    ],
+    'mindmap': {'name': 'Document', 'children': [
+        {'name': f'Topic {i}', 'children': [{'name': f'Subtopic {i}.{j}', 'children': []} for j in range(1, 4)]}
+        for i in range(1, 5)
+    ]}
+}
+
+
+class FakeGroqServer:
+    """
+    Threaded HTTP server imitating POST /openai/v1/chat/completions.
+
+    Each response waits `latency_ms` (plus up to `jitter_ms`); streamed
+    responses send one chunk every `token_interval_ms`. A fraction
+    `error_rate` of requests fail with 429 (with Retry-After) or 500.
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, latency_ms=300, jitter_ms=100,
+                 token_interval_ms=20, error_rate=0.0, seed=None):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.token_interval_ms = token_interval_ms
+        self.error_rate = error_rate
+        self.requests = 0
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def serve_forever(self):
+        self._server.serve_forever()
+
+    def _delay(self):
+        with self._lock:
+            self.requests += 1
+            jitter = self._rng.uniform(0, self.jitter_ms)
+            fail = self._rng.random() < self.error_rate
+            status = self._rng.choice((429, 500)) if fail else 200
+        time.sleep((self.latency_ms + jitter) / 1000)
+        return status
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, format, *args):
+                pass
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+                status = server._delay()
+
+                if status != 200:
+                    payload = json.dumps({'error': {'message': 'injected error', 'type': 'fake_groq'}}).encode()
+                    self.send_response(status)
+                    if status == 429:
+                        self.send_header('Retry-After', '0.2')
+                    self._send_json_body(payload)
+                    return
+
+                prompt_tokens = sum(len(str(message.get('content', ''))) for message in body.get('messages', [])) // 4
+                model = body.get('model', 'fake-model')
+
+                if body.get('stream'):
+                    self._stream(model, prompt_tokens)
+                    return
+
+                content = self._content(body)
+                completion_tokens = len(content) // 4
+                payload = json.dumps({
+                    'id': 'chatcmpl-fake',
+                    'object': 'chat.completion',
+                    'created': int(time.time()),
+                    'model': model,
+                    'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': content}, 'finish_reason': 'stop'}],
+                    'usage': {
+                        'prompt_tokens': prompt_tokens,
+                        'completion_tokens': completion_tokens,
+                        'total_tokens': prompt_tokens + completion_tokens
+                    }
+                }).encode()
+                self.send_response(200)
+                self._send_json_body(payload)
+
+            def _content(self, body):
+                if (body.get('response_format') or {}).get('type') != 'json_object':
+                    return ANSWER
+                system_prompt = str(body['messages'][0].get('content', '')).lower()
+                # Study prompts name their output key in the example JSON
+                for tool_type in ('mindmap', 'flashcards', 'quiz'):
+                    if f'"{tool_type}"' in system_prompt:
+                        return json.dumps({tool_type: STUDY_MATERIAL[tool_type]})
+                return json.dumps({'data': []})
+
+            def _stream(self, model, prompt_tokens):
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/event-stream')
+                self.send_header('Connection', 'close')
+                self.end_headers()
+
+                words = ANSWER.split(' ')
+                for i, word in enumerate(words):
+                    chunk = {
+                        'id': 'chatcmpl-fake',
+                        'object': 'chat.completion.chunk',
+                        'created': int(time.time()),
+                        'model': model,
+                        'choices': [{'index': 0, 'delta': {'content': word if i == 0 else ' ' + word}, 'finish_reason': None}]
+                    }
+                    if i == len(words) - 1:
+                        chunk['choices'][0]['finish_reason'] = 'stop'
+                        chunk['x_groq'] = {'id': 'fake', 'usage': {
+                            'prompt_tokens': prompt_tokens,
+                            'completion_tokens': len(words),
+                            'total_tokens': prompt_tokens + len(words)
+                        }}
+                    self.wfile.write(f'data: {json.dumps(chunk)}\n\n'.encode())
+                    self.wfile.flush()
+                    time.sleep(server.token_interval_ms / 1000)
+                self.wfile.write(b'data: [DONE]\n\n')
+                self.wfile.flush()
+                self.close_connection = True
+
+            def _send_json_body(self, payload):
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run a fake Groq API server.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8099)
+    parser.add_argument('--latency-ms', type=float, default=300)
+    parser.add_argument('--jitter-ms', type=float, default=100)
+    parser.add_argument('--token-interval-ms', type=float, default=20)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    args = parser.parse_args()
+
+    server = FakeGroqServer(args.host, args.port, args.latency_ms, args.jitter_ms,
+                            args.token_interval_ms, args.error_rate)
+    print(f"Fake Groq API listening on {server.url} (set GROQ_BASE_URL to this)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
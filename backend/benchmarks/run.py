@@ -0,0 +1,378 @@
+"""
+Load scenarios for the backend, reported as JSON.
+
+    python -m benchmarks.run --output results.json
+    python -m benchmarks.run --scenarios chat_send,chat_list --concurrency 16 --requests 200
+    python -m benchmarks.run --target http://127.0.0.1:5000   # an already running backend
+
+Without --target the app is started in-process on a throwaway SQLite
+database, talking to a local fake Groq server, so results only depend on
+the code being measured. Each scenario runs `--requests` operations from
+`--concurrency` threads and reports throughput and p50/p95/p99 latency.
+Compare two runs with `python -m benchmarks.compare old.json new.json`.
+"""
+import argparse
+import datetime
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+
+from benchmarks.corpus import FILE_TYPES, SIZES, load_corpus
+from benchmarks.fake_groq import FakeGroqServer
+
+SCENARIOS = ('register', 'login', 'upload', 'chat_send', 'chat_stream', 'chat_list', 'study_tools')
+STUDY_TOOL_TYPES = ('flashcards', 'quiz', 'mindmap')
+
+# Give up waiting for an uploaded document after this many seconds
+INGESTION_TIMEOUT = 600
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    rank = max(1, int(-(-fraction * len(sorted_values) // 1)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def summarize(latencies):
+    """min/mean/p50/p95/p99/max of a list of seconds, in milliseconds."""
+    values = sorted(latency * 1000 for latency in latencies)
+    if not values:
+        return None
+    return {
+        'min': round(values[0], 2),
+        'mean': round(sum(values) / len(values), 2),
+        'p50': round(percentile(values, 0.50), 2),
+        'p95': round(percentile(values, 0.95), 2),
+        'p99': round(percentile(values, 0.99), 2),
+        'max': round(values[-1], 2)
+    }
+
+
+def salted(data, file_type, salt):
+    """
+    Make a corpus file unique without changing its text, so every upload is
+    really extracted instead of being served from the extraction cache.
+    """
+    salt = salt.encode()
+    if file_type == 'pdf':
+        return data + b'%' + salt + b'\n'
+    if file_type == 'txt':
+        return data + b'\n' + salt
+    buffer = io.BytesIO(data)
+    with zipfile.ZipFile(buffer, 'a') as archive:
+        archive.comment = salt
+    return buffer.getvalue()
+
+
+class BenchmarkClient:
+    """Thin HTTP client for the backend API; raises on unexpected status codes."""
+
+    def __init__(self, base_url, timeout=300):
+        self.http = httpx.Client(base_url=base_url, timeout=timeout,
+                                 limits=httpx.Limits(max_connections=200, max_keepalive_connections=200))
+
+    def _check(self, response, *expected):
+        if response.status_code not in expected:
+            raise RuntimeError(f'{response.request.method} {response.request.url.path} '
+                               f'returned {response.status_code}: {response.text[:200]}')
+        return response
+
+    def register(self, username):
+        self._check(self.http.post('/api/auth/register', json={
+            'username': username, 'email': f'{username}@bench.local', 'password': 'bench-password'
+        }), 201)
+
+    def login(self, username):
+        response = self._check(self.http.post('/api/auth/login', json={
+            'username': username, 'password': 'bench-password'
+        }), 200)
+        return {'Authorization': f"Bearer {response.json()['token']}"}
+
+    def upload(self, headers, name, data):
+        response = self._check(self.http.post('/api/documents/upload', headers=headers,
+                                              files={'file': (name, data)}), 201, 202)
+        return response.json()
+
+    def wait_until_ready(self, headers, document_id):
+        deadline = time.monotonic() + INGESTION_TIMEOUT
+        while time.monotonic() < deadline:
+            status = self._check(self.http.get(f'/api/documents/{document_id}/status', headers=headers), 200).json()
+            if status['status'] == 'ready':
+                return
+            if status['status'] == 'failed':
+                raise RuntimeError(f"Ingestion failed: {status.get('error')}")
+            time.sleep(0.05)
+        raise RuntimeError(f'Document {document_id} was not ready after {INGESTION_TIMEOUT}s')
+
+    def create_chat(self, headers, document_id):
+        return self._check(self.http.post('/api/chats', headers=headers, json={'document_id': document_id}), 201).json()['id']
+
+    def send_message(self, headers, chat_id, question, no_cache):
+        self._check(self.http.post(f'/api/chats/{chat_id}/messages', headers=headers,
+                                   json={'message': question, 'no_cache': no_cache}), 201)
+
+    def stream_message(self, headers, chat_id, question, no_cache, timings):
+        started = time.perf_counter()
+        with self.http.stream('POST', f'/api/chats/{chat_id}/messages/stream', headers=headers,
+                              json={'message': question, 'no_cache': no_cache}) as response:
+            self._check(response, 200)
+            for line in response.iter_lines():
+                if line.startswith('event: token') and 'first_token' not in timings:
+                    timings['first_token'] = time.perf_counter() - started
+                if line.startswith('event: error'):
+                    raise RuntimeError('Stream reported an error')
+
+    def list_chats(self, headers):
+        self._check(self.http.get('/api/chats', headers=headers, params={'limit': 20}), 200)
+
+    def study_tools(self, headers, document_id, tool_type):
+        self._check(self.http.post(f'/api/documents/{document_id}/study-tools', headers=headers,
+                                   json={'type': tool_type, 'regenerate': True}), 200)
+
+
+class Benchmark:
+    def __init__(self, client, corpus_dir, manifest, concurrency, requests, no_cache, upload_types, upload_sizes):
+        self.client = client
+        self.corpus_dir = corpus_dir
+        self.manifest = manifest
+        self.concurrency = concurrency
+        self.requests = requests
+        self.no_cache = no_cache
+        self.upload_files = [
+            entry for entry in manifest['files']
+            if entry['type'] in upload_types and entry['size'] in upload_sizes
+        ]
+        self.run_id = uuid.uuid4().hex[:8]
+        self.users = []  # (username, headers, document_id, chat_id), one per worker
+        self._file_cache = {}
+
+    def _read(self, name):
+        if name not in self._file_cache:
+            with open(os.path.join(self.corpus_dir, name), 'rb') as f:
+                self._file_cache[name] = f.read()
+        return self._file_cache[name]
+
+    def setup(self):
+        """One user per worker, each with a small ready document and a chat."""
+        small = next(entry for entry in self.manifest['files'] if entry['type'] == 'txt' and entry['size'] == 'small')
+
+        def make_user(worker):
+            username = f'bench_{self.run_id}_{worker}'
+            self.client.register(username)
+            headers = self.client.login(username)
+            data = salted(self._read(small['name']), 'txt', f'{self.run_id}-{worker}')
+            document_id = self.client.upload(headers, small['name'], data)['document']['id']
+            self.client.wait_until_ready(headers, document_id)
+            chat_id = self.client.create_chat(headers, document_id)
+            return username, headers, document_id, chat_id
+
+        with ThreadPoolExecutor(self.concurrency) as executor:
+            self.users = list(executor.map(make_user, range(self.concurrency)))
+
+    # ---------- operations (one call = one measured request) ----------
+
+    def op_register(self, worker, i, timings):
+        self.client.register(f'bench_{self.run_id}_r{i}')
+
+    def op_login(self, worker, i, timings):
+        self.client.login(self.users[worker][0])
+
+    def op_upload(self, worker, i, timings):
+        _, headers, _, _ = self.users[worker]
+        entry = self.upload_files[i % len(self.upload_files)]
+        data = salted(self._read(entry['name']), entry['type'], f'{self.run_id}-{i}')
+        started = time.perf_counter()
+        document_id = self.client.upload(headers, entry['name'], data)['document']['id']
+        timings['accepted'] = time.perf_counter() - started
+        self.client.wait_until_ready(headers, document_id)
+
+    def op_chat_send(self, worker, i, timings):
+        _, headers, _, chat_id = self.users[worker]
+        self.client.send_message(headers, chat_id, self._question(i), self.no_cache)
+
+    def op_chat_stream(self, worker, i, timings):
+        _, headers, _, chat_id = self.users[worker]
+        self.client.stream_message(headers, chat_id, self._question(i), self.no_cache, timings)
+
+    def op_chat_list(self, worker, i, timings):
+        self.client.list_chats(self.users[worker][1])
+
+    def op_study_tools(self, worker, i, timings):
+        _, headers, document_id, _ = self.users[worker]
+        self.client.study_tools(headers, document_id, STUDY_TOOL_TYPES[i % len(STUDY_TOOL_TYPES)])
+
+    def _question(self, i):
+        questions = self.manifest['questions']
+        return questions[i % len(questions)]
+
+    # ---------- runner ----------
+
+    def run_scenario(self, name):
+        operation = getattr(self, f'op_{name}')
+        jobs = iter(range(self.requests))
+        jobs_lock = threading.Lock()
+        latencies = []
+        phases = {}
+        errors = []
+        results_lock = threading.Lock()
+
+        def worker_loop(worker):
+            while True:
+                with jobs_lock:
+                    i = next(jobs, None)
+                if i is None:
+                    return
+                timings = {}
+                started = time.perf_counter()
+                try:
+                    operation(worker, i, timings)
+                except Exception as e:
+                    with results_lock:
+                        errors.append(str(e))
+                    continue
+                elapsed = time.perf_counter() - started
+                with results_lock:
+                    latencies.append(elapsed)
+                    for phase, value in timings.items():
+                        phases.setdefault(phase, []).append(value)
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(self.concurrency) as executor:
+            list(executor.map(worker_loop, range(self.concurrency)))
+        duration = time.perf_counter() - started
+
+        result = {
+            'requests': self.requests,
+            'succeeded': len(latencies),
+            'errors': len(errors),
+            'concurrency': self.concurrency,
+            'duration_s': round(duration, 3),
+            'throughput_rps': round(len(latencies) / duration, 2) if duration else None,
+            'latency_ms': summarize(latencies)
+        }
+        if phases:
+            result['phases_ms'] = {phase: summarize(values) for phase, values in phases.items()}
+        if errors:
+            result['error_samples'] = sorted(set(errors))[:5]
+        return result
+
+
+def start_local_backend(args):
+    """Start a fake Groq server and the app (fresh SQLite database) in this process."""
+    fake_groq = FakeGroqServer(latency_ms=args.groq_latency_ms, jitter_ms=args.groq_jitter_ms,
+                               token_interval_ms=args.groq_token_interval_ms,
+                               error_rate=args.groq_error_rate, seed=args.seed).start()
+
+    workdir = tempfile.mkdtemp(prefix='bench-')
+    os.environ['GROQ_BASE_URL'] = fake_groq.url
+    os.environ['GROQ_API_KEY'] = 'bench'
+    os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(workdir, 'bench.db')
+    os.environ['EXTRACTION_CACHE_DIR'] = os.path.join(workdir, 'extraction_cache')
+    os.environ['UPLOAD_TMP_DIR'] = os.path.join(workdir, 'uploads')
+
+    # Imported here so the settings above are picked up
+    from werkzeug.serving import WSGIRequestHandler, make_server
+    from app import app
+    from migrations import upgrade_schema
+
+    with app.app_context():
+        upgrade_schema()
+
+    class QuietRequestHandler(WSGIRequestHandler):
+        def log_request(self, *args, **kwargs):
+            pass
+
+    server = make_server('127.0.0.1', 0, app, threaded=True, request_handler=QuietRequestHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f'http://127.0.0.1:{server.server_port}', workdir
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run backend load scenarios and report latency as JSON.')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS), help='Comma-separated scenarios to run.')
+    parser.add_argument('--requests', type=int, default=50, help='Operations per scenario.')
+    parser.add_argument('--concurrency', type=int, default=4, help='Concurrent clients (one user each).')
+    parser.add_argument('--target', help='Base URL of a running backend (default: start one in-process).')
+    parser.add_argument('--corpus-dir', default=os.path.join(tempfile.gettempdir(), 'studyai-bench-corpus'))
+    parser.add_argument('--upload-types', default=','.join(FILE_TYPES), help='File types used by the upload scenario.')
+    parser.add_argument('--upload-sizes', default='small,medium', help=f'Size classes used by the upload scenario ({", ".join(SIZES)}).')
+    parser.add_argument('--use-answer-cache', action='store_true', help='Let chat scenarios hit the answer cache.')
+    parser.add_argument('--groq-latency-ms', type=float, default=300)
+    parser.add_argument('--groq-jitter-ms', type=float, default=100)
+    parser.add_argument('--groq-token-interval-ms', type=float, default=20)
+    parser.add_argument('--groq-error-rate', type=float, default=0.0)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help='Write the JSON report to this file (default: stdout).')
+    args = parser.parse_args()
+
+    scenarios = [name.strip() for name in args.scenarios.split(',') if name.strip()]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"Unknown scenarios: {', '.join(sorted(unknown))}")
+
+    upload_sizes = args.upload_sizes.split(',')
+    manifest = load_corpus(args.corpus_dir, sizes=tuple(dict.fromkeys(['small'] + upload_sizes)), seed=args.seed)
+
+    base_url = args.target
+    if not base_url:
+        base_url, workdir = start_local_backend(args)
+        print(f"Benchmarking in-process backend at {base_url} (data in {workdir})", file=sys.stderr)
+
+    benchmark = Benchmark(BenchmarkClient(base_url), args.corpus_dir, manifest, args.concurrency, args.requests,
+                          not args.use_answer_cache, args.upload_types.split(','), upload_sizes)
+    benchmark.setup()
+
+    results = {}
+    for name in scenarios:
+        print(f"Running {name}...", file=sys.stderr)
+        results[name] = benchmark.run_scenario(name)
+        latency = results[name]['latency_ms'] or {}
+        print(f"  {results[name]['throughput_rps']} req/s, p50 {latency.get('p50')}ms, "
+              f"p95 {latency.get('p95')}ms, p99 {latency.get('p99')}ms, {results[name]['errors']} errors",
+              file=sys.stderr)
+
+    report = {
+        'meta': {
+            'timestamp': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            'commit': git_commit(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'target': args.target or 'in-process',
+            'settings': {key: value for key, value in vars(args).items() if key not in ('output', 'target')}
+        },
+        'scenarios': results
+    }
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+        print(f"Wrote {args.output}", file=sys.stderr)
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,221 @@
+import os
+import time
+import zipfile
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from document_extractor import SUPPORTED_TYPES, extract_document, pdf_workers_per_job
+from extraction_cache import extraction_cache, file_hash
+from ingestion import ingestion
+from models import db, Document, ExtractedText
+from retrieval import index_document
+
+# A file ready to be imported; `temporary` files were spooled by us and are deleted afterwards
+StagedFile = namedtuple('StagedFile', ['name', 'file_type', 'path', 'digest', 'temporary'])
+
+
+def _file_type(name):
+    return name.rsplit('.', 1)[1].lower() if '.' in name else ''
+
+
+def _is_hidden(name):
+    parts = name.replace('\\', '/').split('/')
+    return any(part.startswith('.') or part == '__MACOSX' for part in parts if part)
+
+
+def _document_name(name):
+    # Keep the path inside the folder/archive, which usually carries the course structure
+    return name.replace('\\', '/')[-255:]
+
+
+def stage_directory(directory):
+    """
+    Collect the supported files below `directory` (in name order).
+
+    Returns (staged, skipped, errors); files are used in place.
+    """
+    staged, skipped, errors = [], [], []
+
+    for root, dirs, files in os.walk(directory):
+        dirs[:] = sorted(d for d in dirs if not _is_hidden(d))
+        for filename in sorted(files):
+            path = os.path.join(root, filename)
+            name = os.path.relpath(path, directory)
+            if _is_hidden(filename) or _file_type(filename) not in SUPPORTED_TYPES:
+                skipped.append(name)
+                continue
+            try:
+                staged.append(StagedFile(_document_name(name), _file_type(filename), path, file_hash(path), False))
+            except OSError as e:
+                errors.append({'name': name, 'error': str(e)})
+
+    return staged, skipped, errors
+
+
+def stage_zip(path, max_files, max_bytes):
+    """
+    Spool the supported members of the zip archive at `path` to temporary files.
+
+    Raises ValueError if the archive is invalid or exceeds `max_files` files
+    or `max_bytes` uncompressed; otherwise returns (staged, skipped, errors).
+    """
+    try:
+        archive = zipfile.ZipFile(path)
+    except zipfile.BadZipFile:
+        raise ValueError('The uploaded file is not a valid zip archive!')
+
+    staged, skipped, errors = [], [], []
+
+    with archive:
+        members = []
+        for info in archive.infolist():
+            if info.is_dir() or _is_hidden(info.filename):
+                continue
+            if _file_type(info.filename) not in SUPPORTED_TYPES:
+                skipped.append(info.filename)
+                continue
+            members.append(info)
+
+        if len(members) > max_files:
+            raise ValueError(f'The archive contains {len(members)} documents; the limit is {max_files}.')
+        if sum(info.file_size for info in members) > max_bytes:
+            raise ValueError(f'The archive is larger than {max_bytes // (1024 * 1024)}MB uncompressed.')
+
+        try:
+            for info in members:
+                file_type = _file_type(info.filename)
+                try:
+                    with archive.open(info) as member:
+                        member_path, digest = ingestion.spool(member, suffix=f'.{file_type}')
+                except (zipfile.BadZipFile, OSError, RuntimeError) as e:
+                    errors.append({'name': info.filename, 'error': str(e)})
+                    continue
+                staged.append(StagedFile(_document_name(info.filename), file_type, member_path, digest, True))
+        except BaseException:
+            cleanup(staged)
+            raise
+
+    return staged, skipped, errors
+
+
+def cleanup(staged):
+    """Delete the temporary copies of staged files."""
+    for staged_file in staged:
+        if staged_file.temporary:
+            try:
+                os.unlink(staged_file.path)
+            except OSError:
+                pass
+
+
+def queue_import(user_id, staged, batch_size):
+    """
+    Create pending documents for staged temporary files and queue their extraction.
+
+    Rows are inserted `batch_size` per transaction and each batch is handed
+    to the ingestion queue as soon as it is committed. Returns the documents.
+    """
+    documents = []
+
+    for start in range(0, len(staged), batch_size):
+        batch = staged[start:start + batch_size]
+        rows = [
+            Document(user_id=user_id, filename=staged_file.name, extracted_text='', status=Document.STATUS_PENDING)
+            for staged_file in batch
+        ]
+        db.session.add_all(rows)
+        db.session.commit()
+
+        for staged_file, document in zip(batch, rows):
+            ingestion.submit(document.id, staged_file.path, staged_file.file_type, staged_file.digest)
+        documents.extend(rows)
+
+    return documents
+
+
+def import_files(user_id, staged, workers=None, batch_size=20, progress=print):
+    """
+    Extract staged files in parallel and store them as ready documents.
+
+    Files whose hash is already in the database or the extraction cache are
+    not parsed again, and identical files are parsed once. The others run
+    through `extract_document` in a pool of `workers` processes; as
+    results arrive, documents (with their chunks) are committed `batch_size`
+    at a time. `progress` is called with one line per file.
+
+    Returns (imported documents, errors).
+    """
+    by_digest = {}
+    for staged_file in staged:
+        by_digest.setdefault(staged_file.digest, []).append(staged_file)
+
+    known = {
+        row.sha256: row
+        for row in ExtractedText.query.filter(ExtractedText.sha256.in_(list(by_digest))).all()
+    } if by_digest else {}
+
+    imported, errors = [], []
+    pending_batch = 0
+    done = 0
+    started = time.perf_counter()
+
+    def store(digest, extraction, error):
+        nonlocal pending_batch, done
+        content = known.get(digest)
+        if content is None and error is None:
+            if not extraction.text.strip():
+                error = 'No text could be extracted from the document!'
+            else:
+                content = known[digest] = ingestion.store_content(digest, extraction)
+
+        for staged_file in by_digest[digest]:
+            done += 1
+            if error is not None:
+                errors.append({'name': staged_file.name, 'error': error})
+                progress(f"[{done}/{len(staged)}] {staged_file.name}: failed ({error})")
+                continue
+
+            document = Document(user_id=user_id, filename=staged_file.name, extracted_text='',
+                                status=Document.STATUS_READY)
+            document.content = content
+            index_document(document)
+            db.session.add(document)
+            imported.append(document)
+            pending_batch += 1
+            progress(f"[{done}/{len(staged)}] {staged_file.name}: imported ({time.perf_counter() - started:.1f}s)")
+
+        if pending_batch >= batch_size:
+            db.session.commit()
+            pending_batch = 0
+
+    to_extract = []
+    for digest in by_digest:
+        if digest in known:
+            store(digest, None, None)
+            continue
+        cached = extraction_cache.get(digest)
+        if cached is not None:
+            store(digest, cached, None)
+        else:
+            to_extract.append(digest)
+
+    if to_extract:
+        workers = workers or ingestion.workers
+        pdf_workers = pdf_workers_per_job(workers)
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = {
+                pool.submit(extract_document, by_digest[digest][0].path, by_digest[digest][0].file_type, pdf_workers): digest
+                for digest in to_extract
+            }
+            for future in as_completed(futures):
+                digest = futures[future]
+                try:
+                    extraction = future.result()
+                except Exception as e:
+                    store(digest, None, f'Error processing document: {str(e)}')
+                    continue
+                extraction_cache.put(digest, extraction)
+                store(digest, extraction, None)
+
+    db.session.commit()
+    return imported, errors
@@ -0,0 +1,90 @@
+import hashlib
+from functools import wraps
+from itertools import chain
+
+from flask import current_app, request
+from sqlalchemy import event, select
+from sqlalchemy.orm import Session
+
+from compression import representation_etags
+from models import db, Chat, Document, Message, User
+
+
+# ---------- per-user change counter ----------
+
+def touch_users(connection, user_ids):
+    """Increment the change counter of `user_ids`, in the transaction of `connection`."""
+    if user_ids:
+        connection.execute(
+            User.__table__.update()
+            .where(User.__table__.c.id.in_(sorted(user_ids)))
+            .values(change_counter=User.__table__.c.change_counter + 1)
+        )
+
+
+def touch_user(user_id):
+    """
+    Mark the user's documents and chats as changed. Only needed after bulk
+    `query.delete()`/`update()` calls, which bypass the flush hook below.
+    """
+    touch_users(db.session.connection(), {user_id})
+
+
+@event.listens_for(Session, 'after_flush')
+def _touch_changed_users(session, flush_context):
+    # Every flush that writes documents, chats or messages bumps their
+    # owners' counters in the same transaction, so a counter never lags
+    # behind committed data
+    user_ids = set()
+    chat_ids = set()
+    for obj in chain(session.new, session.deleted, (obj for obj in session.dirty if session.is_modified(obj))):
+        if isinstance(obj, (Document, Chat)):
+            user_ids.add(obj.user_id)
+        elif isinstance(obj, Message):
+            chat_ids.add(obj.chat_id)
+
+    if not user_ids and not chat_ids:
+        return
+
+    connection = session.connection()
+    if chat_ids:
+        chats = Chat.__table__
+        user_ids.update(connection.execute(select(chats.c.user_id).where(chats.c.id.in_(chat_ids))).scalars())
+    touch_users(connection, user_ids)
+
+
+# ---------- conditional GET ----------
+
+def conditional_get(view):
+    """
+    Answer `If-None-Match` polls of a user's data with `304 Not Modified`.
+
+    The strong ETag is derived from the user's change counter and the
+    request URL, so an unchanged poll costs one primary-key lookup and the
+    view (with its queries and JSON) does not run. Apply below
+    `token_required`.
+    """
+    @wraps(view)
+    def decorated(current_user, *args, **kwargs):
+        counter = db.session.execute(
+            select(User.change_counter).where(User.id == current_user.id)
+        ).scalar()
+        etag = hashlib.sha256(f'{current_user.id}:{counter}:{request.full_path}'.encode()).hexdigest()[:32]
+
+        # The client may hold the ETag of a compressed variant; a 304 repeats it
+        matched = next((tag for tag in representation_etags(etag) if request.if_none_match.contains_weak(tag)), None)
+        if matched:
+            response = current_app.response_class(status=304)
+            response.set_etag(matched)
+            response.vary.add('Accept-Encoding')
+        else:
+            response = current_app.make_response(view(current_user, *args, **kwargs))
+            if response.status_code != 200:
+                return response
+            response.set_etag(etag)
+
+        # Browsers revalidate on every request instead of reusing the body blindly
+        response.headers['Cache-Control'] = 'private, no-cache'
+        return response
+
+    return decorated
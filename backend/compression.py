@@ -0,0 +1,80 @@
+import gzip
+
+from flask import request
+
+try:
+    import brotli
+except ImportError:  # optional; responses are only gzip-compressed without it
+    brotli = None
+
+# Only text formats are worth compressing (uploads and downloads are already compressed files)
+COMPRESSIBLE_TYPES = ('application/json', 'text/plain', 'text/html', 'text/css', 'application/javascript')
+
+# Appended to the ETag of a compressed response, so every encoding has its own strong ETag
+ETAG_SUFFIXES = {'br': '-br', 'gzip': '-gzip'}
+
+
+def representation_etags(etag):
+    """The ETag of a response body and of its compressed variants."""
+    return [etag] + [etag + suffix for suffix in ETAG_SUFFIXES.values()]
+
+
+class ResponseCompressor:
+    """
+    Compress JSON and text responses for clients that accept it.
+
+    Brotli is preferred when the `brotli` package is installed and the
+    client accepts it, gzip otherwise. Bodies smaller than `min_bytes`,
+    streamed responses (Server-Sent Events) and files are sent as they are.
+    """
+
+    def __init__(self, app=None):
+        self.min_bytes = 1024
+        self.level = 6
+        self.brotli_quality = 5
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.min_bytes = app.config.get('COMPRESS_MIN_BYTES', self.min_bytes)
+        self.level = app.config.get('COMPRESS_LEVEL', self.level)
+        self.brotli_quality = app.config.get('COMPRESS_BROTLI_QUALITY', self.brotli_quality)
+        app.after_request(self.compress)
+        app.extensions['compressor'] = self
+
+    def _encoding(self):
+        offered = ['br', 'gzip'] if brotli is not None else ['gzip']
+        return request.accept_encodings.best_match(offered)
+
+    def compress(self, response):
+        if (self.min_bytes <= 0
+                or response.status_code != 200
+                or response.direct_passthrough
+                or response.is_streamed
+                or 'Content-Encoding' in response.headers
+                or response.mimetype not in COMPRESSIBLE_TYPES):
+            return response
+
+        # Caches must keep the compressed and the plain body apart
+        response.vary.add('Accept-Encoding')
+
+        encoding = self._encoding()
+        data = response.get_data()
+        if encoding is None or len(data) < self.min_bytes:
+            return response
+
+        if encoding == 'br':
+            compressed = brotli.compress(data, quality=self.brotli_quality)
+        else:
+            compressed = gzip.compress(data, compresslevel=self.level, mtime=0)
+
+        response.set_data(compressed)
+        response.headers['Content-Encoding'] = encoding
+        etag, weak = response.get_etag()
+        if etag:
+            response.set_etag(etag + ETAG_SUFFIXES[encoding], weak)
+        return response
+
+
+compressor = ResponseCompressor()
@@ -1,22 +1,63 @@
 import pdfplumber
+from pdfminer.pdftypes import resolve1
 from docx import Document as DocxDocument
+from docx.table import Table as DocxTable
 from pptx import Presentation
-import io
+import codecs
+import hashlib
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
 
-def extract_text_from_file(file, file_type):
+from document_structure import Extraction, Page, StructureBuilder
+
+try:
+    from charset_normalizer import from_bytes as detect_charset
+except ImportError:  # optional; UTF-8 with a Latin-1 fallback is used without it
+    detect_charset = None
+
+# File types extract_document understands (by extension)
+SUPPORTED_TYPES = ('pdf', 'docx', 'pptx', 'txt')
+
+# File types made of pages/slides, which new versions can re-extract page by page
+PAGED_TYPES = ('pdf', 'pptx')
+
+# Size of the blocks read from disk when streaming files
+READ_BLOCK_SIZE = 1024 * 1024
+
+# Bytes of a text file sampled for encoding detection
+ENCODING_SAMPLE_SIZE = 64 * 1024
+
+# PDF extraction limits (0 disables the page limit / parallel mode)
+PDF_MAX_PAGES = int(os.environ.get('PDF_MAX_PAGES', 0))
+PDF_EXTRACTION_TIMEOUT = float(os.environ.get('PDF_EXTRACTION_TIMEOUT', 300))
+PDF_PARALLEL_WORKERS = int(os.environ.get('PDF_PARALLEL_WORKERS', min(4, os.cpu_count() or 1)))
+PDF_PARALLEL_MIN_PAGES = int(os.environ.get('PDF_PARALLEL_MIN_PAGES', 16))
+
+class ExtractionTimeout(Exception):
+    """Raised when extracting a document takes longer than the configured timeout."""
+
+def pdf_workers_per_job(concurrent_jobs):
     """
-    Extract text from uploaded files based on file type.
-    
-    Args:
-        file: FileStorage object from Flask request
-        file_type: String indicating file extension (pdf, docx, pptx, txt)
-    
-    Returns:
-        String containing extracted text
+    Processes one PDF may use when `concurrent_jobs` extractions run at once,
+    so that all of them together stay within the CPU count.
+    """
+    return max(1, min(PDF_PARALLEL_WORKERS, (os.cpu_count() or 1) // max(1, concurrent_jobs)))
+
+def extract_document(file, file_type, pdf_workers=None):
     """
+    Extract the text and structure of an uploaded file.
     
+    Returns an Extraction: the text (blocks joined by blank lines), its
+    sections (pages, slides, headings, paragraphs and tables with offsets
+    into the text) and, for PAGED_TYPES, a fingerprint of every page.
+    Plain text files have no sections. `pdf_workers` caps the processes
+    used for one PDF (see pdf_workers_per_job).
+    """
     if file_type == 'pdf':
-        return extract_from_pdf(file)
+        return extract_from_pdf(file, workers=pdf_workers)
     elif file_type == 'docx':
         return extract_from_docx(file)
     elif file_type == 'pptx':
@@ -26,73 +67,301 @@ def extract_text_from_file(file, file_type):
     else:
         raise ValueError(f"Unsupported file type: {file_type}")
 
-def extract_from_pdf(file):
-    """Extract text from PDF using pdfplumber."""
-    text = []
+def extract_from_pdf(file, workers=None, max_pages=None, timeout=None):
+    """
+    Extract text from PDF using pdfplumber, one section per page.
+    
+    Large PDFs are split into contiguous page ranges that are extracted in
+    a process pool (`workers` processes). Every worker opens the PDF itself,
+    so page objects are never pickled; results are joined in page order.
+    
+    Args:
+        file: Path of the PDF, or a seekable file-like object
+        workers: Number of worker processes (defaults to PDF_PARALLEL_WORKERS, 1 = sequential)
+        max_pages: Only extract the first N pages (defaults to PDF_MAX_PAGES, 0 = no limit)
+        timeout: Seconds before extraction is aborted (defaults to PDF_EXTRACTION_TIMEOUT)
+    """
+    workers = PDF_PARALLEL_WORKERS if workers is None else workers
+    max_pages = PDF_MAX_PAGES if max_pages is None else max_pages
+    timeout = PDF_EXTRACTION_TIMEOUT if timeout is None else timeout
     
     try:
-        # Seek to beginning to ensure we read from start
-        file.seek(0)
-        file_bytes = file.read()
+        # pdfplumber reads pages from the file on demand, so the PDF is never held in memory
+        source = _rewind(file)
         
-        if not file_bytes:
+        if _is_empty(source):
             print("Error: PDF file is empty or could not be read")
-            return ""
-            
-        with pdfplumber.open(io.BytesIO(file_bytes)) as pdf:
-            for page in pdf.pages:
-                page_text = page.extract_text()
-                if page_text:
-                    text.append(page_text)
+            return Extraction('', [])
+        
+        with pdfplumber.open(source) as pdf:
+            page_count = len(pdf.pages)
+        
+        if max_pages and page_count > max_pages:
+            print(f"Warning: PDF has {page_count} pages, only the first {max_pages} will be extracted.")
+            page_count = max_pages
+        
+        if workers > 1 and page_count >= PDF_PARALLEL_MIN_PAGES:
+            pages = _extract_pdf_parallel(source, page_count, workers, timeout)
+        else:
+            # Only checked between pages; a page that never finishes is stopped
+            # by the caller's hard timeout (see IngestionQueue)
+            deadline = time.monotonic() + timeout
+            pages = []
+            with pdfplumber.open(_rewind(source)) as pdf:
+                for page in pdf.pages[:page_count]:
+                    if time.monotonic() > deadline:
+                        raise ExtractionTimeout(f"PDF extraction exceeded {timeout:g}s")
+                    pages.append((_pdf_page_hash(page), page.extract_text()))
+                    page.close()
         
-        extracted = '\n\n'.join(text)
-        if not extracted.strip():
+        builder = StructureBuilder()
+        for number, (_, page_text) in enumerate(pages, start=1):
+            builder.add_page(_pdf_page(number, page_text))
+        
+        extracted = builder.build(page_hashes=[page_hash for page_hash, _ in pages])
+        if not extracted.text.strip():
             print("Warning: No text extracted from PDF. It might be an image-only PDF.")
             
         return extracted
+    except ExtractionTimeout:
+        raise
     except Exception as e:
         print(f"PDF extraction error: {str(e)}")
-        # If it fails, return empty string so the caller can handle it
-        return ""
+        # If it fails, return empty text so the caller can handle it
+        return Extraction('', [])
+
+def _extract_pdf_parallel(source, page_count, workers, timeout):
+    """Extract pages [0, page_count) across a process pool; returns (fingerprint, text) per page in order."""
+    # A few ranges per worker keeps the pool balanced when some pages are slow
+    batches = min(page_count, workers * 4)
+    size = -(-page_count // batches)
+    ranges = [(start, min(start + size, page_count)) for start in range(0, page_count, size)]
+    
+    # Workers open the PDF from disk rather than receiving a copy of it
+    if _is_path(source):
+        path, owned = source, False
+    else:
+        with tempfile.NamedTemporaryFile(suffix='.pdf', delete=False) as tmp:
+            shutil.copyfileobj(_rewind(source), tmp, READ_BLOCK_SIZE)
+            path, owned = tmp.name, True
+    
+    pool = multiprocessing.Pool(min(workers, len(ranges)))
+    try:
+        result = pool.starmap_async(_extract_pdf_pages, [(path, start, stop) for start, stop in ranges])
+        try:
+            pages = result.get(timeout=timeout)
+        except multiprocessing.TimeoutError:
+            raise ExtractionTimeout(f"PDF extraction exceeded {timeout:g}s")
+        pool.close()
+    finally:
+        # terminate() also stops workers stuck on a pathological page
+        pool.terminate()
+        pool.join()
+        if owned:
+            os.unlink(path)
+    
+    return [page_text for batch in pages for page_text in batch]
+
+def _extract_pdf_pages(path, start, stop):
+    """Worker: fingerprint and extract the text of pages [start, stop) of the PDF at `path`."""
+    with pdfplumber.open(path, pages=list(range(start + 1, stop + 1))) as pdf:
+        pages = []
+        for page in pdf.pages:
+            pages.append((_pdf_page_hash(page), page.extract_text()))
+            page.close()
+        return pages
+
+def _pdf_page(number, page_text):
+    return Page('page', number, None, [('paragraph', page_text or '', None, None)])
+
+def _pdf_page_hash(page):
+    """Fingerprint of a PDF page: its content streams, without laying out any text."""
+    digest = hashlib.sha256()
+    for stream in page.page_obj.contents:
+        digest.update(resolve1(stream).get_data())
+    return digest.hexdigest()[:32]
 
 def extract_from_docx(file):
-    """Extract text from DOCX using python-docx."""
-    doc = DocxDocument(io.BytesIO(file.read()))
-    text = []
+    """
+    Extract text from DOCX using python-docx.
     
-    for paragraph in doc.paragraphs:
-        if paragraph.text.strip():
-            text.append(paragraph.text)
+    Paragraphs and tables are read in document order; paragraphs styled as
+    Title or Heading N become headings.
+    """
+    doc = DocxDocument(_rewind(file))
+    builder = StructureBuilder()
     
-    # Also extract text from tables
-    for table in doc.tables:
-        for row in table.rows:
-            for cell in row.cells:
-                if cell.text.strip():
-                    text.append(cell.text)
+    for block in doc.iter_inner_content():
+        if isinstance(block, DocxTable):
+            builder.add('table', _table_text(block.rows))
+            continue
+        
+        level = _heading_level(block)
+        if level is None:
+            builder.add('paragraph', block.text)
+        else:
+            builder.add('heading', block.text, title=block.text.strip(), level=level)
     
-    return '\n\n'.join(text)
+    return builder.build()
+
+def _heading_level(paragraph):
+    style = paragraph.style.name if paragraph.style is not None else ''
+    if style == 'Title':
+        return 0
+    if style.startswith('Heading'):
+        level = style[len('Heading'):].strip()
+        return int(level) if level.isdigit() else 1
+    return None
+
+def _table_text(rows):
+    """One line per row, cells separated by " | " (merged cells only once)."""
+    lines = []
+    for row in rows:
+        cells = []
+        previous = None
+        for cell in row.cells:
+            # python-docx repeats a merged cell for every grid column it spans
+            if previous is not None and getattr(cell, '_tc', None) is getattr(previous, '_tc', object()):
+                continue
+            previous = cell
+            cells.append(' '.join(cell.text.split()))
+        if any(cells):
+            lines.append(' | '.join(cells))
+    return '\n'.join(lines)
 
 def extract_from_pptx(file):
-    """Extract text from PPTX using python-pptx."""
-    prs = Presentation(io.BytesIO(file.read()))
-    text = []
+    """Extract text from PPTX using python-pptx, one section per slide."""
+    prs = Presentation(_rewind(file))
+    builder = StructureBuilder()
     
-    for slide in prs.slides:
-        for shape in slide.shapes:
-            if hasattr(shape, "text") and shape.text.strip():
-                text.append(shape.text)
+    for number, slide in enumerate(prs.slides, start=1):
+        builder.add_page(_slide_page(number, slide))
     
-    return '\n\n'.join(text)
+    return builder.build(page_hashes=[_slide_hash(slide) for slide in prs.slides])
+
+def _slide_page(number, slide):
+    title_shape = slide.shapes.title
+    title = title_shape.text.strip() if title_shape is not None and title_shape.has_text_frame else None
+    
+    blocks = []
+    for shape in slide.shapes:
+        if getattr(shape, 'has_table', False):
+            blocks.append(('table', _table_text(shape.table.rows), None, None))
+        elif title_shape is not None and shape.shape_id == title_shape.shape_id:
+            blocks.append(('heading', shape.text, title, 1))
+        elif hasattr(shape, "text"):
+            blocks.append(('paragraph', shape.text, None, None))
+    return Page('slide', number, title or None, blocks)
+
+def _slide_hash(slide):
+    """Fingerprint of a slide: its XML, which holds all of its text."""
+    return hashlib.sha256(slide.part.blob).hexdigest()[:32]
+
+def extract_changed_pages(file, file_type, known_hashes, timeout=None):
+    """
+    Extract a new version of a PDF or PPTX, skipping unchanged pages.
+    
+    Every page/slide is fingerprinted, and only those whose fingerprint is
+    not in `known_hashes` (the pages of the previous version) are extracted.
+    Returns one (fingerprint, page) pair per page in order, where `page` is
+    None for known pages; their text is taken from the previous version.
+    """
+    known = set(known_hashes or ())
+    
+    if file_type == 'pptx':
+        prs = Presentation(_rewind(file))
+        pages = []
+        for number, slide in enumerate(prs.slides, start=1):
+            fingerprint = _slide_hash(slide)
+            pages.append((fingerprint, None if fingerprint in known else _slide_page(number, slide)))
+        return pages
+    
+    if file_type != 'pdf':
+        raise ValueError(f"File type has no pages: {file_type}")
+    
+    timeout = PDF_EXTRACTION_TIMEOUT if timeout is None else timeout
+    deadline = time.monotonic() + timeout
+    pages = []
+    with pdfplumber.open(_rewind(file)) as pdf:
+        for number, page in enumerate(pdf.pages[:PDF_MAX_PAGES or None], start=1):
+            if time.monotonic() > deadline:
+                raise ExtractionTimeout(f"PDF extraction exceeded {timeout:g}s")
+            fingerprint = _pdf_page_hash(page)
+            pages.append((fingerprint, None if fingerprint in known else _pdf_page(number, page.extract_text())))
+            page.close()
+    return pages
 
 def extract_from_txt(file):
-    """Extract text from TXT file."""
+    """
+    Extract text from TXT file.
+    
+    The file is decoded block by block with an incremental decoder, so it is
+    never held in memory as raw bytes. The encoding comes from a byte order
+    mark, otherwise UTF-8 is assumed; if the file turns out not to be UTF-8,
+    it is decoded once more with the encoding detected from its first bytes
+    (Latin-1 when charset-normalizer is not installed or the guess is wrong).
+    """
+    if _is_path(file):
+        with open(file, 'rb') as f:
+            return Extraction(_decode_text(f), [])
+    return Extraction(_decode_text(_rewind(file)), [])
+
+def _decode_text(f):
+    sample = f.read(ENCODING_SAMPLE_SIZE)
+    encoding = _bom_encoding(sample)
+    
+    if encoding is None:
+        try:
+            return _decode_stream(f, 'utf-8')
+        except UnicodeDecodeError:
+            encoding = _detect_encoding(sample)
+    
     try:
-        # Try UTF-8 first
-        content = file.read().decode('utf-8')
-    except UnicodeDecodeError:
-        # Fallback to latin-1 if UTF-8 fails
+        return _decode_stream(f, encoding)
+    except (UnicodeDecodeError, LookupError):
+        # The sample was not representative; Latin-1 decodes any byte
+        return _decode_stream(f, 'latin-1')
+
+def _decode_stream(f, encoding):
+    f.seek(0)
+    decoder = codecs.getincrementaldecoder(encoding)()
+    text = []
+    while True:
+        block = f.read(READ_BLOCK_SIZE)
+        if not block:
+            break
+        text.append(decoder.decode(block))
+    text.append(decoder.decode(b'', final=True))
+    return ''.join(text)
+
+def _bom_encoding(sample):
+    if sample.startswith(codecs.BOM_UTF8):
+        return 'utf-8-sig'
+    if sample.startswith((codecs.BOM_UTF32_LE, codecs.BOM_UTF32_BE)):
+        return 'utf-32'
+    if sample.startswith((codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE)):
+        return 'utf-16'
+    return None
+
+def _detect_encoding(sample):
+    if detect_charset is not None:
+        match = detect_charset(sample).best()
+        if match is not None:
+            return match.encoding
+    return 'latin-1'
+
+def _is_path(file):
+    return isinstance(file, (str, os.PathLike))
+
+def _rewind(file):
+    """Seek file-like objects back to the start; paths are returned unchanged."""
+    if not _is_path(file):
         file.seek(0)
-        content = file.read().decode('latin-1')
-    
-    return content
+    return file
+
+def _is_empty(source):
+    if _is_path(source):
+        return os.path.getsize(source) == 0
+    empty = not source.read(1)
+    source.seek(0)
+    return empty
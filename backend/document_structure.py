@@ -0,0 +1,134 @@
+import json
+from collections import namedtuple
+
+# One element of a document's structure. `start`/`end` are character offsets
+# into the extracted text. Pages and slides (`number` is 1-based) contain
+# the headings, paragraphs and tables found on them; headings have a
+# `level` (0 for the document title, 1.. for Heading 1..) and `title`.
+Section = namedtuple('Section', ['kind', 'number', 'title', 'level', 'start', 'end'])
+
+# Result of extracting a file: the flat text, its structure and, for PDFs
+# and PPTX decks, a fingerprint of every page/slide (used to diff versions)
+Extraction = namedtuple('Extraction', ['text', 'sections', 'page_hashes'], defaults=(None,))
+
+# One page or slide before it is added to the text; `blocks` are
+# (kind, text, title, level) tuples
+Page = namedtuple('Page', ['kind', 'number', 'title', 'blocks'])
+
+PAGE_KINDS = ('page', 'slide')
+BLOCK_KINDS = ('heading', 'paragraph', 'table')
+
+# Separator between blocks in the extracted text
+BLOCK_SEPARATOR = '\n\n'
+
+
+class StructureBuilder:
+    """
+    Assemble extracted text block by block while recording offsets.
+
+    Blocks are joined with BLOCK_SEPARATOR, so the text is the same as
+    joining the non-empty blocks; `begin()`/`end()` wrap the blocks of a
+    page or slide.
+    """
+
+    def __init__(self):
+        self.parts = []
+        self.sections = []
+        self.length = 0
+        self._container = None
+
+    def begin(self, kind, number, title=None):
+        self._container = (len(self.sections), kind, number, title)
+        self.sections.append(None)
+
+    def end(self):
+        index, kind, number, title = self._container
+        self._container = None
+        blocks = self.sections[index + 1:]
+        if not blocks:
+            # Nothing on this page/slide made it into the text
+            del self.sections[index]
+            return
+        self.sections[index] = Section(kind, number, title, None, blocks[0].start, blocks[-1].end)
+
+    def add(self, kind, text, title=None, level=None):
+        text = text.strip()
+        if not text:
+            return
+        if self.parts:
+            self.parts.append(BLOCK_SEPARATOR)
+            self.length += len(BLOCK_SEPARATOR)
+        self.parts.append(text)
+        self.sections.append(Section(kind, None, title, level, self.length, self.length + len(text)))
+        self.length += len(text)
+
+    def add_page(self, page):
+        self.begin(page.kind, page.number, page.title)
+        for kind, text, title, level in page.blocks:
+            self.add(kind, text, title, level)
+        self.end()
+
+    def build(self, page_hashes=None):
+        return Extraction(''.join(self.parts), self.sections, page_hashes)
+
+
+def dump_sections(sections):
+    """Compact JSON form stored alongside the extracted text (lists instead of objects)."""
+    return json.dumps([list(section) for section in sections], separators=(',', ':'))
+
+
+def load_sections(data):
+    """Inverse of dump_sections; None or empty data means the text has no recorded structure."""
+    if not data:
+        return []
+    return [Section(*section) for section in json.loads(data)]
+
+
+def outline(sections):
+    """
+    The addressable sections of a document: its pages/slides, or its headings
+    when it has no pages (DOCX). A heading section runs until the next
+    heading of the same or a higher level.
+    """
+    pages = [section for section in sections if section.kind in PAGE_KINDS]
+    if pages:
+        return pages
+
+    headings = [section for section in sections if section.kind == 'heading']
+    result = []
+    for i, heading in enumerate(headings):
+        boundary = next((later.start for later in headings[i + 1:] if later.level <= heading.level), None)
+        end = max(
+            section.end for section in sections
+            if section.start >= heading.start and (boundary is None or section.start < boundary)
+        )
+        result.append(heading._replace(end=end))
+    return result
+
+
+def blocks_within(sections, start, end):
+    """Headings, paragraphs and tables inside [start, end), offsets made relative to `start`."""
+    return [
+        section._replace(start=section.start - start, end=section.end - start)
+        for section in sections
+        if section.kind in BLOCK_KINDS and section.start >= start and section.end <= end
+    ]
+
+
+def stored_page(text, sections, page):
+    """Rebuild the Page for a page/slide section of already extracted text."""
+    return Page(page.kind, page.number, page.title, [
+        (block.kind, text[block.start:block.end], block.title, block.level)
+        for block in sections
+        if block.kind in BLOCK_KINDS and block.start >= page.start and block.end <= page.end
+    ])
+
+
+def page_label(filename, page_start, page_end):
+    """Citation label for a chunk, e.g. "Page 3", "Pages 3-4" or "Slide 2"; None without pages."""
+    if page_start is None:
+        return None
+    unit = 'Slide' if filename.lower().endswith('.pptx') else 'Page'
+    if page_end is None or page_end == page_start:
+        return f'{unit} {page_start}'
+    return f'{unit}s {page_start}-{page_end}'
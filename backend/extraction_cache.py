@@ -0,0 +1,129 @@
+import hashlib
+import json
+import os
+import threading
+import uuid
+import zlib
+
+from document_structure import Extraction, Section
+
+# Size of the blocks read when hashing files
+HASH_BLOCK_SIZE = 1024 * 1024
+
+
+def file_hash(path):
+    """SHA-256 hex digest of a file, read in blocks."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class ExtractionCache:
+    """
+    Content-addressed on-disk store of extracted text and structure.
+    
+    Entries are zlib-compressed JSON files named after the SHA-256 of the
+    original upload. Reads refresh the file's modification time, and once the store
+    grows past `max_bytes` the least recently used entries are evicted.
+    """
+    
+    def __init__(self, app=None):
+        self.directory = None
+        self.max_bytes = 0
+        self._lock = threading.Lock()
+        
+        if app is not None:
+            self.init_app(app)
+    
+    def init_app(self, app):
+        self.directory = app.config.get('EXTRACTION_CACHE_DIR') or os.path.join(app.instance_path, 'extraction_cache')
+        self.max_bytes = app.config.get('EXTRACTION_CACHE_MAX_BYTES', 512 * 1024 * 1024)
+        app.extensions['extraction_cache'] = self
+    
+    @property
+    def enabled(self):
+        return bool(self.directory) and self.max_bytes > 0
+    
+    def _path(self, digest):
+        # Entries written before the structure was cached (plain text, '.z')
+        # are never read again and age out of the store
+        return os.path.join(self.directory, digest[:2], digest + '.json.z')
+    
+    def get(self, digest):
+        """Return the cached Extraction for a file hash, or None."""
+        if not self.enabled:
+            return None
+        
+        path = self._path(digest)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            os.utime(path)
+        except OSError:
+            return None
+        
+        try:
+            entry = json.loads(zlib.decompress(data))
+            return Extraction(entry['text'], [Section(*section) for section in entry['sections']], entry.get('page_hashes'))
+        except (zlib.error, ValueError, KeyError, TypeError):
+            # Corrupt entry; drop it and extract again
+            self._remove(path)
+            return None
+    
+    def put(self, digest, extraction):
+        """Store an Extraction for a file hash and evict old entries if needed."""
+        if not self.enabled:
+            return
+        
+        path = self._path(digest)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        
+        # Write to a temporary name first so readers never see a partial file
+        tmp_path = f'{path}.{uuid.uuid4().hex}.tmp'
+        with open(tmp_path, 'wb') as f:
+            entry = {
+                'text': extraction.text,
+                'sections': [list(section) for section in extraction.sections],
+                'page_hashes': extraction.page_hashes
+            }
+            f.write(zlib.compress(json.dumps(entry, separators=(',', ':')).encode('utf-8')))
+        os.replace(tmp_path, path)
+        
+        self._evict()
+    
+    def _evict(self):
+        with self._lock:
+            entries = []
+            total = 0
+            for root, _, files in os.walk(self.directory):
+                for name in files:
+                    if not name.endswith('.z'):
+                        continue
+                    path = os.path.join(root, name)
+                    try:
+                        stat = os.stat(path)
+                    except OSError:
+                        continue
+                    entries.append((stat.st_mtime, stat.st_size, path))
+                    total += stat.st_size
+            
+            if total <= self.max_bytes:
+                return
+            
+            entries.sort()
+            for _, size, path in entries:
+                if total <= self.max_bytes:
+                    break
+                self._remove(path)
+                total -= size
+    
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+extraction_cache = ExtractionCache()
@@ -1,26 +1,74 @@
+import contextvars
+import hashlib
+import json
+import logging
 import os
-from groq import Groq
+import re
+from concurrent.futures import ThreadPoolExecutor
+from itertools import zip_longest
 from dotenv import load_dotenv
+from llm_gateway import gateway
+from retrieval import split_into_chunks
+from tokens import count_message_tokens, count_tokens, truncate_to_tokens
 
 # Load environment variables from .env file
 load_dotenv()
 
-# Initialize Groq client
-client = Groq(api_key=os.environ.get("GROQ_API_KEY"))
+logger = logging.getLogger(__name__)
 
-def get_groq_response(document_context, user_question, no_context=False):
+# Largest prompt (estimated tokens) sent in a single call. Prompts are
+# trimmed to fit before they are sent; PromptTooLarge is raised when they
+# cannot be (e.g. the question alone is longer).
+LLM_MAX_INPUT_TOKENS = int(os.environ.get('LLM_MAX_INPUT_TOKENS', 8000))
+
+class PromptTooLarge(Exception):
+    """A prompt does not fit LLM_MAX_INPUT_TOKENS even after trimming."""
+    
+    def __init__(self, message, tokens, limit):
+        super().__init__(message)
+        self.tokens = tokens
+        self.limit = limit
+
+def get_groq_response(document_context, user_question, no_context=False, stream=False, history=None):
     """
     Get AI response from Groq API.
     
     Args:
-        document_context: Extracted text from the document
+        document_context: Relevant excerpts of the document's extracted text
         user_question: User's question
         no_context: If True, ignore document context and provide a general AI answer
+        stream: If True, return a generator that yields the response as it is generated
+        history: Earlier conversation as chat messages ({'role', 'content'}), oldest first
     
     Returns:
-        AI response string
+        AI response string, or a generator of response text fragments when streaming
+    
+    Raises:
+        PromptTooLarge: if the question does not fit LLM_MAX_INPUT_TOKENS
     """
+    messages = _fit_question(document_context, user_question, no_context, list(history or []))
+    
+    request_options = dict(
+        messages=messages,
+        model="llama-3.3-70b-versatile",  # Using Groq's fast model
+        temperature=0.1,  # Low temperature for more deterministic responses
+        max_tokens=1024,
+        top_p=0.9
+    )
     
+    if stream:
+        return _stream_response(request_options)
+
+    try:
+        chat_completion = gateway.complete(**request_options)
+        
+        return chat_completion.choices[0].message.content
+    
+    except Exception as e:
+        raise Exception(f"Groq API error: {str(e)}")
+
+def _question_messages(document_context, user_question, no_context, history):
+    """Chat messages for a question: system prompt, conversation history, then the question."""
     # Strict prompt to prevent hallucination
     # If no_context is True, we don't pass the document content and change the prompt
     if no_context:
@@ -45,6 +93,7 @@ DOCUMENT-BASED QUESTIONS:
 - If a question is specifically about the document content:
   a. Provide the answer using ONLY the document context.
   b. If the answer is NOT in the document at all, politely state: "I couldn't find information about that in the document, but based on general knowledge..." (and provide a brief general answer if applicable, or ask for clarification).
+- Excerpts may start with a marker such as [Page 3] or [Slide 2]; mention the page or slide when it helps the user find the answer in the document.
 - Keep answers professional and accurate."""
 
         user_prompt = f"""DOCUMENT CONTEXT:
@@ -55,64 +104,291 @@ USER QUESTION:
 
 Answer the question using ONLY the information from the document context above."""
 
+    return [
+        {
+            "role": "system",
+            "content": system_prompt
+        },
+        *history,
+        {
+            "role": "user",
+            "content": user_prompt
+        }
+    ]
+
+def check_question(user_question):
+    """Raise PromptTooLarge if a question cannot fit a prompt even without context or history."""
+    tokens = count_message_tokens(_question_messages('', user_question, False, []))
+    if tokens > LLM_MAX_INPUT_TOKENS:
+        question_tokens = count_tokens(user_question)
+        limit = LLM_MAX_INPUT_TOKENS - (tokens - question_tokens)
+        raise PromptTooLarge(
+            f"The question is too long: about {question_tokens} tokens, the limit is {max(0, limit)}.",
+            question_tokens, max(0, limit)
+        )
+
+def context_token_limit(user_question, history=None):
+    """Tokens left for document excerpts in a question's prompt (0 if there is no room)."""
+    used = count_message_tokens(_question_messages('', user_question, False, list(history or [])))
+    return max(0, LLM_MAX_INPUT_TOKENS - used)
+
+def _fit_question(document_context, user_question, no_context, history):
+    """
+    Messages for a question, trimmed to LLM_MAX_INPUT_TOKENS.
+    
+    The oldest history goes first (the conversation summary is kept longest),
+    then the document context is cut. Raises PromptTooLarge if the question
+    alone is too long.
+    """
+    check_question(user_question)
+    
+    messages = _question_messages(document_context, user_question, no_context, history)
+    tokens = count_message_tokens(messages)
+    if tokens <= LLM_MAX_INPUT_TOKENS:
+        return messages
+    
+    dropped = 0
+    while history and tokens > LLM_MAX_INPUT_TOKENS:
+        oldest = 1 if history[0]['role'] == 'system' and len(history) > 1 else 0
+        message = history.pop(oldest)
+        tokens -= count_message_tokens([message]) - count_message_tokens([])
+        dropped += 1
+    
+    shortened = not no_context and bool(document_context) and tokens > LLM_MAX_INPUT_TOKENS
+    if shortened:
+        context_tokens = count_tokens(document_context)
+        document_context = truncate_to_tokens(document_context, context_tokens - (tokens - LLM_MAX_INPUT_TOKENS))
+    
+    logger.info("Prompt over %d tokens: dropped %d history messages%s", LLM_MAX_INPUT_TOKENS, dropped,
+                ", shortened the document context" if shortened else "")
+    return _question_messages(document_context, user_question, no_context, history)
+
+def _stream_response(request_options):
+    """Yield response text fragments from a streaming chat completion."""
     try:
-        chat_completion = client.chat.completions.create(
+        for chunk in gateway.stream(**request_options):
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+    
+    except Exception as e:
+        raise Exception(f"Groq API error: {str(e)}")
+
+def summarize_conversation(previous_summary, messages):
+    """
+    Fold chat messages into a running conversation summary.
+    
+    Args:
+        previous_summary: Summary of the conversation so far (may be None)
+        messages: Chat messages ({'role', 'content'}) that happened after that summary
+    
+    Returns:
+        Updated summary string
+    """
+    system_prompt = """You maintain a running summary of a conversation between a student and an AI assistant about a document.
+Update the summary with the new messages. Keep the facts, questions and answers that later questions may refer to.
+Write at most 200 words in plain prose. Output only the summary."""
+    
+    # Very long messages are shortened so that every message gets a share of the prompt
+    available = LLM_MAX_INPUT_TOKENS - count_message_tokens([
+        {"content": system_prompt}, {"content": previous_summary or ''}
+    ])
+    per_message = max(1, available // max(1, len(messages)) - 2)
+    transcript = '\n'.join(
+        f"{m['role'].upper()}: {truncate_to_tokens(m['content'], per_message)}" for m in messages
+    )
+    
+    user_prompt = f"""CURRENT SUMMARY:
+{previous_summary or '(none)'}
+
+NEW MESSAGES:
+{transcript}"""
+    
+    try:
+        chat_completion = gateway.complete(
             messages=[
-                {
-                    "role": "system",
-                    "content": system_prompt
-                },
-                {
-                    "role": "user",
-                    "content": user_prompt
-                }
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": user_prompt}
             ],
-            model="llama-3.3-70b-versatile",  # Using Groq's fast model
-            temperature=0.1,  # Low temperature for more deterministic responses
-            max_tokens=1024,
-            top_p=0.9
+            model="llama-3.3-70b-versatile",
+            temperature=0.2,
+            max_tokens=400
         )
         
-        return chat_completion.choices[0].message.content
+        return chat_completion.choices[0].message.content.strip()
     
     except Exception as e:
         raise Exception(f"Groq API error: {str(e)}")
 
-def generate_study_material(document_context, tool_type):
-    """
-    Generate study material (flashcards, quiz, or mindmap) based on document context.
-    """
-    
-    prompts = {
-        "flashcards": """Extract 8-12 of the most important points, key concepts, or takeaways from the document. 
+STUDY_PROMPTS = {
+    "flashcards": """Extract 8-12 of the most important points, key concepts, or takeaways from the document. 
         Each point should have a concise title (2-6 words) and a brief description (1-2 sentences).
         Output ONLY a JSON array of objects with 'title' and 'description' fields.
         Example: {"flashcards": [{"title": "Main Concept", "description": "This explains the core idea in simple terms."}]}""",
-        
-        "quiz": """Create a 10-question multiple-choice quiz based on the document.
+    
+    "quiz": """Create a 10-question multiple-choice quiz based on the document.
         Output ONLY a JSON array of objects with 'question', 'options' (array of 4 strings), and 'correct_index' (0-3).
         Example: {"quiz": [{"question": "X?", "options": ["A", "B", "C", "D"], "correct_index": 1}]}""",
-        
-        "mindmap": """Create a hierarchical mind map structure of the main topics in the document.
+    
+    "mindmap": """Create a hierarchical mind map structure of the main topics in the document.
         Output ONLY a JSON object representing a tree with 'name' and 'children' (array of objects).
         Keep it to 2-3 levels deep.
         Example: {"mindmap": {"name": "Root", "children": [{"name": "Subtopic", "children": []}]}}"""
-    }
+}
+
+# Added to the prompt when a long document is processed part by part
+STUDY_PART_PROMPT = ("This is part {number} of {total} of a longer document. Only cover this part. "
+                     "For flashcards or a quiz produce at most {items} items; for a mind map only the topics of this part.")
+
+# Used for documents that have more than STUDY_MAX_PARTS parts: every part is
+# condensed into notes first, and the study material is made from the notes
+STUDY_NOTES_PROMPT = """Condense this part of a longer document into study notes.
+Keep every definition, key concept, fact, name, number and relationship a student could be asked about.
+Use short bullet points, at most {words} words. Output only the notes."""
+
+# Documents above this size (estimated tokens) are split into parts of STUDY_PART_TOKENS
+STUDY_SINGLE_PASS_TOKENS = int(os.environ.get('STUDY_SINGLE_PASS_TOKENS', 6000))
+STUDY_PART_TOKENS = int(os.environ.get('STUDY_PART_TOKENS', 4000))
+STUDY_MAX_PARTS = int(os.environ.get('STUDY_MAX_PARTS', 16))
+STUDY_NOTES_TOKENS = int(os.environ.get('STUDY_NOTES_TOKENS', 600))
+STUDY_MAP_WORKERS = int(os.environ.get('STUDY_MAP_WORKERS', 4))
+STUDY_MAX_ITEMS = {'flashcards': 12, 'quiz': 10}
+
+# Changes whenever the study prompts change, so cached study material is regenerated
+STUDY_PROMPT_VERSION = hashlib.sha256(
+    json.dumps([STUDY_PROMPTS, STUDY_PART_PROMPT, STUDY_NOTES_PROMPT], sort_keys=True).encode()
+).hexdigest()[:12]
+
+def generate_study_material(document_context, tool_type, token_count=None):
+    """
+    Generate study material (flashcards, quiz, or mindmap) based on document context.
+    
+    Documents longer than STUDY_SINGLE_PASS_TOKENS are processed map-reduce
+    style: partial material is generated for each part concurrently and then
+    merged into the same shape a single call would return. Documents too
+    long for STUDY_MAX_PARTS parts are condensed into notes part by part
+    first (repeatedly if needed), so the whole document is always covered.
+    `token_count` is the document's stored token estimate, counted here when
+    not given. Both sizes are capped so that every call fits
+    LLM_MAX_INPUT_TOKENS.
+    """
+    if token_count is None:
+        token_count = count_tokens(document_context)
+    
+    # Room for the document once the longest system prompt is counted
+    room = LLM_MAX_INPUT_TOKENS - count_message_tokens([
+        {"content": _study_system_prompt(tool_type, STUDY_MAX_PARTS, STUDY_MAX_PARTS, 99)},
+        {"content": "DOCUMENT CONTENT:\n"}
+    ])
+    if room <= 0:
+        raise PromptTooLarge(
+            f"The study prompts alone exceed LLM_MAX_INPUT_TOKENS ({LLM_MAX_INPUT_TOKENS}).",
+            LLM_MAX_INPUT_TOKENS - room, LLM_MAX_INPUT_TOKENS
+        )
+    
+    if token_count <= min(STUDY_SINGLE_PASS_TOKENS, room):
+        system_prompt = f"You are an educational AI assistant. {STUDY_PROMPTS.get(tool_type, '')} Return valid JSON only."
+        return _request_study_material(system_prompt, document_context, tool_type)
+    
+    parts = split_into_chunks(document_context, min(STUDY_PART_TOKENS, room))
+    if len(parts) > STUDY_MAX_PARTS:
+        # Fewer, larger parts while they still fit a prompt
+        parts = split_into_chunks(document_context, room)
+    if len(parts) > STUDY_MAX_PARTS:
+        logger.info("Study material: document has %d parts, condensing them into notes first.", len(parts))
+        notes = _condense_parts(parts)
+        return generate_study_material(notes, tool_type)
+    
+    per_part = -(-STUDY_MAX_ITEMS.get(tool_type, 10) // len(parts)) + 1
+    
+    def generate_part(numbered_part):
+        number, part = numbered_part
+        system_prompt = _study_system_prompt(tool_type, number, len(parts), per_part)
+        try:
+            return _request_study_material(system_prompt, part, tool_type)
+        except Exception as e:
+            logger.warning("Study material: part %d/%d failed: %s", number, len(parts), e)
+            return None
+    
+    # Each part runs in a copy of the caller's context, so its calls are attributed to the caller's request
+    with ThreadPoolExecutor(max_workers=min(STUDY_MAP_WORKERS, len(parts))) as executor:
+        futures = [
+            executor.submit(contextvars.copy_context().run, generate_part, numbered_part)
+            for numbered_part in enumerate(parts, 1)
+        ]
+        results = [result for result in (future.result() for future in futures) if result is not None]
+    
+    if not results:
+        raise Exception("Error generating study material: every part of the document failed")
+    
+    if tool_type == 'flashcards':
+        return _merge_items(results, 'title', STUDY_MAX_ITEMS['flashcards'])
+    elif tool_type == 'quiz':
+        return _merge_items(results, 'question', STUDY_MAX_ITEMS['quiz'])
+    else:
+        return _merge_mindmaps(results)
+
+def _condense_parts(parts):
+    """Study notes of every part, concurrently, joined in document order."""
+    notes_tokens = max(50, min(STUDY_NOTES_TOKENS, LLM_MAX_INPUT_TOKENS // 8))
+    system_prompt = STUDY_NOTES_PROMPT.format(words=notes_tokens * 3 // 4)
+    
+    def condense(numbered_part):
+        number, part = numbered_part
+        messages = [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": f"DOCUMENT PART:\n{part}"}
+        ]
+        excess = count_message_tokens(messages) - LLM_MAX_INPUT_TOKENS
+        if excess > 0:
+            messages[1]["content"] = f"DOCUMENT PART:\n{truncate_to_tokens(part, count_tokens(part) - excess)}"
+        try:
+            chat_completion = gateway.complete(
+                messages=messages,
+                model="llama-3.3-70b-versatile",
+                temperature=0.2,
+                max_tokens=notes_tokens
+            )
+            return chat_completion.choices[0].message.content.strip()
+        except Exception as e:
+            # The beginning of the part stands in for its notes rather than losing it entirely
+            logger.warning("Study material: notes for part %d/%d failed, using its beginning: %s", number, len(parts), e)
+            return truncate_to_tokens(part, notes_tokens)
+    
+    with ThreadPoolExecutor(max_workers=min(STUDY_MAP_WORKERS, len(parts))) as executor:
+        futures = [
+            executor.submit(contextvars.copy_context().run, condense, numbered_part)
+            for numbered_part in enumerate(parts, 1)
+        ]
+        return '\n\n'.join(future.result() for future in futures)
+
+def _study_system_prompt(tool_type, number, total, items):
+    """System prompt for part `number` of `total` of a long document."""
+    return (
+        f"You are an educational AI assistant. {STUDY_PROMPTS.get(tool_type, '')} "
+        + STUDY_PART_PROMPT.format(number=number, total=total, items=items)
+        + " Return valid JSON only."
+    )
 
-    system_prompt = f"You are an educational AI assistant. {prompts.get(tool_type, '')} Return valid JSON only."
+def _request_study_material(system_prompt, document_context, tool_type):
+    """Single study-material completion, unwrapped to the list/tree for `tool_type`."""
+    messages = [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": f"DOCUMENT CONTENT:\n{document_context}"}
+    ]
+    excess = count_message_tokens(messages) - LLM_MAX_INPUT_TOKENS
+    if excess > 0:
+        # Parts are sized to fit, but the estimate of a part can be a little off
+        document_context = truncate_to_tokens(document_context, count_tokens(document_context) - excess)
+        messages[1]["content"] = f"DOCUMENT CONTENT:\n{document_context}"
     
     try:
-        chat_completion = client.chat.completions.create(
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": f"DOCUMENT CONTENT:\n{document_context}"}
-            ],
+        chat_completion = gateway.complete(
+            messages=messages,
             model="llama-3.3-70b-versatile",
             temperature=0.3,
             response_format={"type": "json_object"}
         )
         
-        import json
         content = chat_completion.choices[0].message.content
         parsed = json.loads(content)
         
@@ -133,3 +409,49 @@ def generate_study_material(document_context, tool_type):
     
     except Exception as e:
         raise Exception(f"Error generating study material: {str(e)}")
+
+def _normalize_key(value):
+    return ' '.join(re.findall(r'[a-z0-9]+', str(value).lower()))
+
+def _merge_items(results, key_field, limit):
+    """Merge per-part flashcards/quiz lists: drop duplicates, take items round-robin so every part is covered."""
+    parts = [[item for item in result if isinstance(item, dict) and item.get(key_field)]
+             for result in results if isinstance(result, list)]
+    
+    merged = []
+    seen = set()
+    for round_items in zip_longest(*parts):
+        for item in round_items:
+            if item is None or len(merged) >= limit:
+                continue
+            key = _normalize_key(item[key_field])
+            if key in seen:
+                continue
+            seen.add(key)
+            merged.append(item)
+    return merged
+
+def _merge_mindmap_children(target, children, depth):
+    by_name = {_normalize_key(child.get('name')): child for child in target}
+    for child in children:
+        if not isinstance(child, dict) or not child.get('name'):
+            continue
+        key = _normalize_key(child['name'])
+        if key in by_name:
+            if depth > 1:
+                existing = by_name[key]
+                existing['children'] = existing.get('children') or []
+                _merge_mindmap_children(existing['children'], child.get('children') or [], depth - 1)
+        else:
+            by_name[key] = child
+            target.append(child)
+
+def _merge_mindmaps(results):
+    """Merge per-part mind maps under one root, combining branches with the same name."""
+    trees = [result for result in results if isinstance(result, dict)]
+    names = [tree.get('name') for tree in trees if tree.get('name')]
+    root = {'name': max(set(names), key=names.count) if names else 'Main Topics', 'children': []}
+    
+    for tree in trees:
+        _merge_mindmap_children(root['children'], tree.get('children') or [], depth=2)
+    return root
@@ -0,0 +1,420 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, TimeoutError as FutureTimeout
+from concurrent.futures.process import BrokenProcessPool
+
+from sqlalchemy.exc import IntegrityError
+
+from answer_cache import answer_cache, document_answer_key
+from document_extractor import (
+    PAGED_TYPES, PDF_EXTRACTION_TIMEOUT, ExtractionTimeout,
+    extract_changed_pages, extract_document, pdf_workers_per_job,
+)
+from document_structure import PAGE_KINDS, StructureBuilder, dump_sections, stored_page
+from extraction_cache import extraction_cache, HASH_BLOCK_SIZE
+from metrics import metrics
+from models import db, Document, ExtractedText, StudyMaterial
+from retrieval import index_document, reindex_document
+
+
+# Extra time a job gets on top of PDF_EXTRACTION_TIMEOUT before its worker is
+# killed, so that a PDF extracted in parallel can stop its own pool first
+EXTRACTION_TIMEOUT_GRACE = 30
+
+
+def _extract(path, file_ext, pdf_workers):
+    """Run text extraction in a worker process."""
+    return extract_document(path, file_ext, pdf_workers=pdf_workers)
+
+
+class IngestionQueue:
+    """
+    Background document ingestion backed by a process pool.
+    
+    Uploads are spooled to a temporary file with `spool()` and queued with
+    `submit()`; each job is driven by a coordinator
+    thread that updates the document status, runs the CPU-bound extraction
+    in a worker process and stores the text and chunks when it finishes.
+    Workers read the file from disk, so uploads are never held in memory.
+    
+    Files whose SHA-256 is already known (in the database or the on-disk
+    extraction cache) are not parsed again.
+    
+    An extraction that runs longer than `timeout` seconds fails and the
+    worker running it is killed. Large PDFs are split over at most
+    `pdf_workers` processes per job, so concurrent jobs together never use
+    more processes than there are CPUs.
+    """
+    
+    def __init__(self, app=None):
+        self.app = None
+        self.workers = 1
+        self.pdf_workers = 1
+        self.timeout = PDF_EXTRACTION_TIMEOUT + EXTRACTION_TIMEOUT_GRACE
+        self.upload_dir = None
+        self._processes = None
+        self._threads = None
+        self._pid = None
+        self._lock = threading.Lock()
+        
+        if app is not None:
+            self.init_app(app)
+    
+    def init_app(self, app):
+        self.app = app
+        self.workers = max(1, app.config.get('INGESTION_WORKERS') or min(4, os.cpu_count() or 1))
+        self.pdf_workers = pdf_workers_per_job(self.workers)
+        self.timeout = app.config.get('EXTRACTION_TIMEOUT') or self.timeout
+        self.upload_dir = app.config.get('UPLOAD_TMP_DIR') or None
+        app.extensions['ingestion'] = self
+    
+    def _get_pools(self):
+        # Pools are created lazily so that every (forked) server worker gets its own
+        with self._lock:
+            if self._pid != os.getpid():
+                self._processes = ProcessPoolExecutor(max_workers=self.workers)
+                self._threads = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='ingestion')
+                self._pid = os.getpid()
+            return self._processes, self._threads
+    
+    def _extract_in_pool(self, fn, *args):
+        """Run `fn(*args)` in a worker process, waiting at most `timeout` seconds."""
+        for attempt in range(2):
+            processes, _ = self._get_pools()
+            future = processes.submit(fn, *args)
+            try:
+                return future.result(timeout=self.timeout)
+            except FutureTimeout:
+                self._recycle(processes)
+                raise ExtractionTimeout(f"Extraction exceeded {self.timeout:g}s")
+            except BrokenProcessPool:
+                # The pool was recycled (or a worker crashed) while this job
+                # waited in it; run the job once more on a fresh pool
+                self._recycle(processes)
+                if attempt:
+                    raise
+    
+    def _recycle(self, processes):
+        # A job stuck inside one page cannot be cancelled, only killed: replace
+        # the pool, then terminate the old pool's workers
+        with self._lock:
+            if self._processes is processes and self._pid == os.getpid():
+                self._processes = ProcessPoolExecutor(max_workers=self.workers)
+        # ProcessPoolExecutor has no public way to kill its workers
+        for process in list((processes._processes or {}).values()):
+            process.terminate()
+        processes.shutdown(wait=False, cancel_futures=True)
+    
+    def spool(self, stream, suffix=''):
+        """
+        Copy an upload stream to a temporary file in blocks.
+        
+        Returns the file's path and SHA-256, which is computed while copying.
+        """
+        if self.upload_dir:
+            os.makedirs(self.upload_dir, exist_ok=True)
+        
+        digest = hashlib.sha256()
+        with tempfile.NamedTemporaryFile(dir=self.upload_dir, prefix='upload-', suffix=suffix, delete=False) as tmp:
+            try:
+                for block in iter(lambda: stream.read(HASH_BLOCK_SIZE), b''):
+                    digest.update(block)
+                    tmp.write(block)
+            except BaseException:
+                tmp.close()
+                os.unlink(tmp.name)
+                raise
+        return tmp.name, digest.hexdigest()
+    
+    def submit(self, document_id, path, file_ext, digest):
+        """Queue extraction for a pending document; the spooled file is removed afterwards."""
+        _, threads = self._get_pools()
+        return threads.submit(self._run, document_id, path, file_ext, digest)
+    
+    def _run(self, document_id, path, file_ext, digest):
+        with self.app.app_context():
+            try:
+                document = db.session.get(Document, document_id)
+                if document is None:
+                    return
+                
+                document.status = Document.STATUS_EXTRACTING
+                db.session.commit()
+                
+                started = time.perf_counter()
+                source = 'database'
+                extraction = None
+                
+                if db.session.get(ExtractedText, digest) is None:
+                    source = 'cache'
+                    extraction = extraction_cache.get(digest)
+                    
+                    if extraction is None:
+                        source = 'extracted'
+                        try:
+                            extraction = self._extract_in_pool(_extract, path, file_ext, self.pdf_workers)
+                        except Exception as e:
+                            self._observe(file_ext, source, 'error', started, path)
+                            print(f"Error processing document {document.filename}: {str(e)}")
+                            self._fail(document, f'Error processing document: {str(e)}')
+                            return
+                        extraction_cache.put(digest, extraction)
+                    
+                    if not extraction.text.strip():
+                        self._observe(file_ext, source, 'empty', started, path)
+                        self._fail(document, 'No text could be extracted from the document!')
+                        return
+                
+                self._observe(file_ext, source, 'ok', started, path)
+                document, content = self._attach(document_id, digest, extraction)
+                if document is None:
+                    print(f"Document {document_id} was deleted while it was processed")
+                    return
+                document.content = content
+                index_document(document)
+                document.status = Document.STATUS_READY
+                document.error_message = None
+                db.session.commit()
+            except Exception as e:
+                import traceback
+                print(f"Ingestion job for document {document_id} failed: {str(e)}")
+                print(f"Details: {traceback.format_exc()}")
+                db.session.rollback()
+                document = db.session.get(Document, document_id)
+                if document is not None:
+                    self._fail(document, f'Error processing document: {str(e)}')
+            finally:
+                db.session.remove()
+                try:
+                    os.unlink(path)
+                except OSError:
+                    pass
+    
+    def _attach(self, document_id, digest, extraction):
+        """
+        Begin the transaction that attaches content to a document.
+        
+        The document's row is locked first, so a concurrent delete either
+        finished before (the document is gone and (None, None) is returned)
+        or waits for this transaction. Returns the document and the
+        ExtractedText for `digest`, stored again from `extraction` (or the
+        extraction cache) if a delete dropped it after the job looked it up.
+        """
+        # End the read transaction, so the lock is taken on current data
+        db.session.commit()
+        documents = Document.__table__
+        locked = db.session.execute(
+            documents.update().where(documents.c.id == document_id).values(status=documents.c.status)
+        ).rowcount
+        if not locked:
+            db.session.rollback()
+            return None, None
+        
+        document = db.session.get(Document, document_id)
+        content = db.session.get(ExtractedText, digest, populate_existing=True)
+        if content is None:
+            extraction = extraction or extraction_cache.get(digest)
+            if extraction is None:
+                raise Exception('its extracted text was deleted while it was processed, please upload it again')
+            content = self.store_content(digest, extraction)
+        return document, content
+    
+    def store_content(self, digest, extraction):
+        """Add the ExtractedText for a file hash, or return the existing row if another job added it."""
+        content = ExtractedText(
+            sha256=digest,
+            text=extraction.text,
+            structure=dump_sections(extraction.sections),
+            page_hashes=json.dumps(extraction.page_hashes) if extraction.page_hashes is not None else None
+        )
+        try:
+            with db.session.begin_nested():
+                db.session.add(content)
+        except IntegrityError:
+            # The same file finished extracting in another job first
+            content = db.session.get(ExtractedText, digest)
+        return content
+    
+    def submit_version(self, document_id, path, file_ext, digest, filename):
+        """Queue a new version of an existing document; the spooled file is removed afterwards."""
+        _, threads = self._get_pools()
+        return threads.submit(self._run_version, document_id, path, file_ext, digest, filename)
+    
+    def _run_version(self, document_id, path, file_ext, digest, filename):
+        """
+        Replace a document's content with a new version of its file.
+        
+        For PDFs and decks whose previous version recorded page fingerprints,
+        only new or changed pages are extracted; the others are copied from
+        the previous text. Chunks are re-indexed incrementally, cached study
+        tools are dropped if the text changed, and chats stay attached. If
+        the new version fails, the document keeps serving the previous one.
+        """
+        with self.app.app_context():
+            try:
+                document = db.session.get(Document, document_id)
+                if document is None:
+                    return
+                
+                # The document stays `updating` (and keeps serving the previous
+                # version) until the new content is committed below
+                started = time.perf_counter()
+                source = 'database'
+                extraction = None
+                
+                if db.session.get(ExtractedText, digest) is None:
+                    source = 'cache'
+                    extraction = extraction_cache.get(digest)
+                    
+                    if extraction is None:
+                        source = 'extracted'
+                        try:
+                            extraction = self._extract_version(document, path, file_ext)
+                        except Exception as e:
+                            self._observe(file_ext, source, 'error', started, path)
+                            print(f"Error processing new version of document {document.filename}: {str(e)}")
+                            self._keep_previous(document, f'Error processing the new version: {str(e)}')
+                            return
+                        extraction_cache.put(digest, extraction)
+                    
+                    if not extraction.text.strip():
+                        self._observe(file_ext, source, 'empty', started, path)
+                        self._keep_previous(document, 'No text could be extracted from the new version!')
+                        return
+                
+                self._observe(file_ext, source, 'ok', started, path)
+                document, content = self._attach(document_id, digest, extraction)
+                if document is None:
+                    print(f"Document {document_id} was deleted while its new version was processed")
+                    return
+                previous_sha256 = document.content_sha256
+                # Compared by file hash, so the previous text is never loaded
+                # (documents from before content hashing count as changed)
+                text_changed = previous_sha256 != digest
+                # A document whose earlier upload failed gets its first version now
+                had_version = document.status == Document.STATUS_UPDATING
+                
+                document.content = content
+                document.extracted_text = ''
+                document.filename = filename
+                if had_version:
+                    document.version += 1
+                kept, added, removed = reindex_document(document)
+                if text_changed:
+                    StudyMaterial.query.filter_by(document_id=document.id).delete()
+                document.status = Document.STATUS_READY
+                document.error_message = None
+                db.session.flush()
+                
+                # Drop the previous extracted text once no document references it
+                if previous_sha256 and previous_sha256 != digest:
+                    if ExtractedText.delete_unreferenced(previous_sha256):
+                        answer_cache.invalidate(document_answer_key(document.id, previous_sha256))
+                elif not previous_sha256:
+                    answer_cache.invalidate(document_answer_key(document.id, None))
+                
+                db.session.commit()
+                print(f"Document {document.id} updated to version {document.version}: "
+                      f"{kept} chunks kept, {added} added, {removed} removed")
+            except Exception as e:
+                import traceback
+                print(f"Version job for document {document_id} failed: {str(e)}")
+                print(f"Details: {traceback.format_exc()}")
+                db.session.rollback()
+                document = db.session.get(Document, document_id)
+                if document is not None:
+                    self._keep_previous(document, f'Error processing the new version: {str(e)}')
+            finally:
+                db.session.remove()
+                try:
+                    os.unlink(path)
+                except OSError:
+                    pass
+    
+    def _extract_version(self, document, path, file_ext):
+        """Extract a new version, reusing the pages it shares with the document's current content."""
+        previous = document.content
+        previous_hashes = json.loads(previous.page_hashes) if previous is not None and previous.page_hashes else None
+        
+        if file_ext not in PAGED_TYPES or previous_hashes is None:
+            return self._extract_in_pool(_extract, path, file_ext, self.pdf_workers)
+        
+        pages = self._extract_in_pool(extract_changed_pages, path, file_ext, previous_hashes)
+        
+        # Pages of the previous version by fingerprint (pages without text have no section)
+        previous_text, previous_sections = previous.text, previous.sections
+        previous_pages = {page.number: page for page in previous_sections if page.kind in PAGE_KINDS}
+        by_hash = {}
+        for number, page_hash in enumerate(previous_hashes, start=1):
+            by_hash.setdefault(page_hash, previous_pages.get(number))
+        
+        builder = StructureBuilder()
+        reused = 0
+        for number, (page_hash, page) in enumerate(pages, start=1):
+            if page is None:
+                reused += 1
+                section = by_hash[page_hash]
+                if section is None:
+                    continue
+                page = stored_page(previous_text, previous_sections, section)._replace(number=number)
+            builder.add_page(page)
+        
+        print(f"New version of document {document.id}: {reused} of {len(pages)} pages unchanged")
+        return builder.build(page_hashes=[page_hash for page_hash, _ in pages])
+    
+    def _keep_previous(self, document, message):
+        # Only `updating` documents have a previous version; one whose first
+        # upload failed (queued as `pending`) has nothing to go back to
+        document.status = Document.STATUS_READY if document.status == Document.STATUS_UPDATING \
+            else Document.STATUS_FAILED
+        document.error_message = message
+        db.session.commit()
+    
+    def recover_interrupted(self):
+        """
+        Settle documents whose job was lost because the server stopped.
+        
+        Jobs only live in this process, so pending/extracting uploads are
+        marked failed (their spooled file cannot be trusted) and interrupted
+        new versions go back to the previous version. Leftover spooled files
+        in UPLOAD_TMP_DIR are removed. Only run this while no server is
+        processing uploads, e.g. before starting it. Returns the documents.
+        """
+        documents = Document.query.filter(Document.status.in_([
+            Document.STATUS_PENDING, Document.STATUS_EXTRACTING, Document.STATUS_UPDATING
+        ])).all()
+        
+        for document in documents:
+            if document.status == Document.STATUS_UPDATING:
+                document.status = Document.STATUS_READY
+                document.error_message = 'Processing of the new version was interrupted. Please upload it again.'
+            else:
+                document.status = Document.STATUS_FAILED
+                document.error_message = 'Processing was interrupted by a server restart. Please upload the file again.'
+        db.session.commit()
+        
+        if self.upload_dir and os.path.isdir(self.upload_dir):
+            for name in os.listdir(self.upload_dir):
+                if name.startswith('upload-'):
+                    try:
+                        os.unlink(os.path.join(self.upload_dir, name))
+                    except OSError:
+                        pass
+        
+        return documents
+    
+    def _observe(self, file_ext, source, status, started, path):
+        size = os.path.getsize(path) if source == 'extracted' else None
+        metrics.observe_extraction(file_ext, source, status, time.perf_counter() - started, size)
+    
+    def _fail(self, document, message):
+        document.status = Document.STATUS_FAILED
+        document.error_message = message
+        db.session.commit()
+
+
+ingestion = IngestionQueue()
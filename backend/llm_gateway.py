@@ -0,0 +1,266 @@
+import asyncio
+import os
+import random
+import threading
+import time
+
+import groq
+import httpx
+from groq import AsyncGroq, Groq
+from dotenv import load_dotenv
+
+from metrics import metrics
+from tokens import count_message_tokens
+
+load_dotenv()
+
+# Errors worth retrying: rate limits, server errors, timeouts and dropped connections
+RETRYABLE_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504}
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket: allows `rate` requests per second on average,
+    with bursts of up to `capacity` requests.
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _reserve(self):
+        """Take a token, returning how long the caller must wait before using it."""
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            if self.tokens >= 0:
+                return 0.0
+            return -self.tokens / self.rate
+
+    def acquire(self):
+        if self.rate <= 0:
+            return
+        delay = self._reserve()
+        if delay:
+            time.sleep(delay)
+
+    async def acquire_async(self):
+        if self.rate <= 0:
+            return
+        delay = self._reserve()
+        if delay:
+            await asyncio.sleep(delay)
+
+
+class LLMGateway:
+    """
+    Shared entry point for all Groq calls.
+
+    Wraps pooled sync and async Groq clients with request timeouts,
+    exponential backoff with jitter on 429/5xx and connection errors
+    (honouring Retry-After), a global concurrency limit and a token-bucket
+    rate limiter. `base_url` can point at a local stub server for testing.
+    """
+
+    def __init__(self, api_key=None, base_url=None, timeout=60.0, connect_timeout=5.0,
+                 max_retries=3, backoff_base=0.5, backoff_max=20.0,
+                 max_concurrency=8, rate_per_second=0.0, burst=10, max_connections=20):
+        self.api_key = api_key
+        self.base_url = base_url
+        self.timeout = httpx.Timeout(timeout, connect=connect_timeout)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.max_concurrency = max_concurrency
+        self.limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+        self.rate_limiter = TokenBucket(rate_per_second, burst)
+
+        self._semaphore = threading.BoundedSemaphore(max_concurrency)
+        self._async_semaphores = {}
+        self._client = None
+        self._async_client = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            api_key=os.environ.get('GROQ_API_KEY'),
+            base_url=os.environ.get('GROQ_BASE_URL') or None,
+            timeout=float(os.environ.get('LLM_TIMEOUT', 60)),
+            connect_timeout=float(os.environ.get('LLM_CONNECT_TIMEOUT', 5)),
+            max_retries=int(os.environ.get('LLM_MAX_RETRIES', 3)),
+            backoff_base=float(os.environ.get('LLM_BACKOFF_BASE', 0.5)),
+            backoff_max=float(os.environ.get('LLM_BACKOFF_MAX', 20)),
+            max_concurrency=int(os.environ.get('LLM_MAX_CONCURRENCY', 8)),
+            rate_per_second=float(os.environ.get('LLM_RATE_LIMIT_RPS', 0)),
+            burst=int(os.environ.get('LLM_RATE_LIMIT_BURST', 10)),
+            max_connections=int(os.environ.get('LLM_MAX_CONNECTIONS', 20))
+        )
+
+    # Clients are created on first use so importing this module never needs an API key
+
+    @property
+    def client(self):
+        with self._lock:
+            if self._client is None:
+                self._client = Groq(
+                    api_key=self.api_key,
+                    base_url=self.base_url,
+                    timeout=self.timeout,
+                    max_retries=0,  # retries are handled here
+                    http_client=httpx.Client(timeout=self.timeout, limits=self.limits)
+                )
+            return self._client
+
+    @client.setter
+    def client(self, value):
+        self._client = value
+
+    @property
+    def async_client(self):
+        with self._lock:
+            if self._async_client is None:
+                self._async_client = AsyncGroq(
+                    api_key=self.api_key,
+                    base_url=self.base_url,
+                    timeout=self.timeout,
+                    max_retries=0,
+                    http_client=httpx.AsyncClient(timeout=self.timeout, limits=self.limits)
+                )
+            return self._async_client
+
+    @async_client.setter
+    def async_client(self, value):
+        self._async_client = value
+
+    def _async_semaphore(self):
+        # asyncio primitives belong to one event loop
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            semaphore = self._async_semaphores.get(loop)
+            if semaphore is None:
+                semaphore = asyncio.Semaphore(self.max_concurrency)
+                self._async_semaphores[loop] = semaphore
+            return semaphore
+
+    # ---------- retry policy ----------
+
+    def _is_retryable(self, error):
+        if isinstance(error, (groq.APITimeoutError, groq.APIConnectionError)):
+            return True
+        if isinstance(error, groq.APIStatusError):
+            return error.status_code in RETRYABLE_STATUS_CODES or error.status_code >= 500
+        return False
+
+    def _retry_delay(self, error, attempt):
+        response = getattr(error, 'response', None)
+        if response is not None:
+            retry_after = response.headers.get('retry-after')
+            if retry_after:
+                try:
+                    return min(self.backoff_max, float(retry_after))
+                except ValueError:
+                    pass
+        delay = min(self.backoff_max, self.backoff_base * (2 ** attempt))
+        return delay * random.uniform(0.5, 1.0)
+
+    def _call(self, create, request_options):
+        for attempt in range(self.max_retries + 1):
+            self.rate_limiter.acquire()
+            try:
+                return create(**request_options)
+            except Exception as e:
+                if attempt >= self.max_retries or not self._is_retryable(e):
+                    raise
+                delay = self._retry_delay(e, attempt)
+                print(f"LLM request failed ({type(e).__name__}), retrying in {delay:.1f}s")
+                time.sleep(delay)
+
+    async def _acall(self, create, request_options):
+        for attempt in range(self.max_retries + 1):
+            await self.rate_limiter.acquire_async()
+            try:
+                return await create(**request_options)
+            except Exception as e:
+                if attempt >= self.max_retries or not self._is_retryable(e):
+                    raise
+                delay = self._retry_delay(e, attempt)
+                print(f"LLM request failed ({type(e).__name__}), retrying in {delay:.1f}s")
+                await asyncio.sleep(delay)
+
+    # ---------- public API ----------
+
+    def complete(self, **request_options):
+        """Blocking chat completion (same arguments as `client.chat.completions.create`)."""
+        with self._semaphore:
+            started = time.perf_counter()
+            try:
+                response = self._call(self.client.chat.completions.create, request_options)
+            except Exception:
+                self._observe(request_options, 'error', started)
+                raise
+            self._observe(request_options, 'ok', started, getattr(response, 'usage', None))
+            return response
+
+    def stream(self, **request_options):
+        """
+        Streaming chat completion, yielding chunks.
+
+        Opening the stream is retried; once chunks arrive, errors are raised
+        to the caller. The concurrency slot is held until the stream ends.
+        """
+        with self._semaphore:
+            started = time.perf_counter()
+            status = 'error'
+            usage = None
+            try:
+                chunks = self._call(self.client.chat.completions.create, dict(request_options, stream=True))
+                try:
+                    for chunk in chunks:
+                        usage = _chunk_usage(chunk) or usage
+                        yield chunk
+                    status = 'ok'
+                finally:
+                    close = getattr(chunks, 'close', None)
+                    if close:
+                        close()
+            except GeneratorExit:
+                status = 'cancelled'
+                raise
+            finally:
+                self._observe(request_options, status, started, usage)
+
+    async def acomplete(self, **request_options):
+        """Async chat completion for use from asyncio code."""
+        async with self._async_semaphore():
+            started = time.perf_counter()
+            try:
+                response = await self._acall(self.async_client.chat.completions.create, request_options)
+            except Exception:
+                self._observe(request_options, 'error', started)
+                raise
+            self._observe(request_options, 'ok', started, getattr(response, 'usage', None))
+            return response
+    
+    def _observe(self, request_options, status, started, usage=None):
+        duration = time.perf_counter() - started
+        # The estimate is only compared with usage the API reported
+        estimated = count_message_tokens(request_options.get('messages') or []) if usage is not None else None
+        metrics.observe_llm(request_options.get('model', ''), status, duration, usage, estimated)
+
+
+def _chunk_usage(chunk):
+    """Token usage reported with a streamed chunk (Groq sends it with the last one)."""
+    usage = getattr(chunk, 'usage', None)
+    if usage is None:
+        x_groq = getattr(chunk, 'x_groq', None)
+        usage = getattr(x_groq, 'usage', None)
+    return usage
+
+
+gateway = LLMGateway.from_env()
@@ -0,0 +1,98 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from groq_service import summarize_conversation
+from models import db, Chat, Message
+from tokens import count_tokens
+
+# Raw messages always kept verbatim in the prompt
+MEMORY_RECENT_MESSAGES = 6
+
+# Older messages are folded into the summary once this many more have accumulated
+MEMORY_SUMMARIZE_EVERY = 6
+
+# Upper bound for summary + raw messages sent with each question
+MEMORY_TOKEN_BUDGET = 1500
+
+ROLES = {'user': 'user', 'ai': 'assistant'}
+
+_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='memory')
+_in_progress = set()
+_in_progress_lock = threading.Lock()
+
+
+def _unsummarized_messages(chat, before_id=None):
+    query = Message.query.options(db.undefer(Message.message)).filter(Message.chat_id == chat.id)
+    if chat.summarized_until_id:
+        query = query.filter(Message.id > chat.summarized_until_id)
+    if before_id:
+        query = query.filter(Message.id < before_id)
+    return query
+
+
+def build_history(chat, before_id=None, token_budget=MEMORY_TOKEN_BUDGET):
+    """
+    Conversation history to send with a new question.
+    
+    Returns the chat summary (as a system message) followed by the messages
+    that are not summarized yet, dropping the oldest ones if the total would
+    exceed `token_budget`. `before_id` excludes the question being answered.
+    """
+    history = []
+    used_tokens = 0
+    
+    if chat.summary:
+        history.append({'role': 'system', 'content': f"Summary of the earlier conversation:\n{chat.summary}"})
+        used_tokens += count_tokens(chat.summary)
+    
+    # Newest first, so only the window is loaded even if summarizing keeps failing
+    window = MEMORY_RECENT_MESSAGES + MEMORY_SUMMARIZE_EVERY
+    messages = _unsummarized_messages(chat, before_id).order_by(Message.id.desc()).limit(window).all()
+    
+    recent = []
+    for message in messages:
+        tokens = count_tokens(message.message)
+        if used_tokens + tokens > token_budget:
+            break
+        recent.append({'role': ROLES.get(message.sender, 'user'), 'content': message.message})
+        used_tokens += tokens
+    
+    return history + list(reversed(recent))
+
+
+def schedule_summary_update(app, chat_id):
+    """Fold old messages into the chat summary in the background, if enough have accumulated."""
+    with _in_progress_lock:
+        if chat_id in _in_progress:
+            return
+        _in_progress.add(chat_id)
+    
+    _executor.submit(_update_summary, app, chat_id)
+
+
+def _update_summary(app, chat_id):
+    with app.app_context():
+        try:
+            chat = db.session.get(Chat, chat_id)
+            if chat is None:
+                return
+            
+            messages = _unsummarized_messages(chat).order_by(Message.id.asc()).all()
+            if len(messages) < MEMORY_RECENT_MESSAGES + MEMORY_SUMMARIZE_EVERY:
+                return
+            
+            to_fold = messages[:-MEMORY_RECENT_MESSAGES]
+            chat.summary = summarize_conversation(chat.summary, [
+                {'role': ROLES.get(message.sender, 'user'), 'content': message.message}
+                for message in to_fold
+            ])
+            chat.summarized_until_id = to_fold[-1].id
+            db.session.commit()
+        except Exception as e:
+            # The raw messages stay in the window; summarizing is retried on the next turn
+            print(f"Error updating summary for chat {chat_id}: {str(e)}")
+            db.session.rollback()
+        finally:
+            db.session.remove()
+            with _in_progress_lock:
+                _in_progress.discard(chat_id)
@@ -0,0 +1,281 @@
+import threading
+import time
+
+from flask import g, has_app_context, request
+from sqlalchemy import event
+
+from models import db
+
+# Histogram buckets: seconds for latencies, bytes for payload sizes
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+SIZE_BUCKETS = tuple(256 * 4 ** i for i in range(10))  # 256B .. 64MB
+COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+RATIO_BUCKETS = (0.5, 0.75, 0.9, 1, 1.1, 1.25, 1.5, 2)
+
+# Estimates further off than this (actual / estimated) are logged
+TOKEN_ESTIMATE_TOLERANCE = 0.25
+
+# Label used for work outside a request (ingestion jobs, background summaries)
+BACKGROUND = 'background'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+class Counter:
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(name, '') for name in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} counter']
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f'{self.name}{_format_labels(self.labels, key)} {value:g}')
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._values = {}  # label values -> [bucket counts..., count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(name, '') for name in self.labels)
+        with self._lock:
+            series = self._values.get(key)
+            if series is None:
+                series = self._values[key] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += 1
+            series[-1] += value
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            for key, series in sorted(self._values.items()):
+                for bound, count in zip(self.buckets, series):
+                    lines.append(f'{self.name}_bucket{_format_labels(self.labels, key, [("le", f"{bound:g}")])} {count}')
+                lines.append(f'{self.name}_bucket{_format_labels(self.labels, key, [("le", "+Inf")])} {series[-2]}')
+                lines.append(f'{self.name}_count{_format_labels(self.labels, key)} {series[-2]}')
+                lines.append(f'{self.name}_sum{_format_labels(self.labels, key)} {series[-1]:g}')
+        return lines
+
+
+class Metrics:
+    """
+    Process-wide performance metrics in the Prometheus text format.
+
+    `init_app` times every request and every SQL statement; ingestion and
+    the LLM gateway report extraction and Groq calls through the
+    `observe_*` methods. Work done while handling a request is also added
+    to a per-request breakdown, which is logged for requests slower than
+    SLOW_REQUEST_MS (0 disables the log).
+
+    Each server process keeps its own metrics, so with several Gunicorn
+    workers every scrape sees one worker.
+    """
+
+    def __init__(self, app=None):
+        self.slow_request_ms = 0
+        self._metrics = []
+
+        self.request_duration = self._add(Histogram(
+            'http_request_duration_seconds', 'Time spent handling requests.',
+            ('endpoint', 'method', 'status')))
+        self.request_size = self._add(Histogram(
+            'http_request_size_bytes', 'Size of request bodies.', ('endpoint',), SIZE_BUCKETS))
+        self.response_size = self._add(Histogram(
+            'http_response_size_bytes', 'Size of response bodies (streamed responses are not counted).',
+            ('endpoint',), SIZE_BUCKETS))
+        self.db_duration = self._add(Histogram(
+            'db_query_duration_seconds', 'Time spent executing SQL statements.', ('endpoint',)))
+        self.db_queries_per_request = self._add(Histogram(
+            'db_queries_per_request', 'SQL statements executed per request.', ('endpoint',), COUNT_BUCKETS))
+        self.extraction_duration = self._add(Histogram(
+            'extraction_duration_seconds', 'Time spent extracting text from uploaded files.',
+            ('file_type', 'source', 'status')))
+        self.extraction_size = self._add(Histogram(
+            'extraction_input_bytes', 'Size of files sent to text extraction.', ('file_type',), SIZE_BUCKETS))
+        self.llm_duration = self._add(Histogram(
+            'llm_request_duration_seconds', 'Time spent on Groq calls, including retries and streaming.',
+            ('endpoint', 'model', 'status')))
+        self.llm_tokens = self._add(Counter(
+            'llm_tokens_total', 'Tokens used by Groq calls as reported by the API.',
+            ('endpoint', 'model', 'kind')))
+        self.llm_estimated_tokens = self._add(Counter(
+            'llm_estimated_prompt_tokens_total',
+            'Prompt tokens of Groq calls as estimated before sending them, for calls that reported usage.',
+            ('endpoint', 'model')))
+        self.llm_estimate_ratio = self._add(Histogram(
+            'llm_prompt_token_estimate_ratio', 'Actual prompt tokens divided by the estimate, per Groq call.',
+            ('model',), RATIO_BUCKETS))
+
+        if app is not None:
+            self.init_app(app)
+
+    def _add(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def init_app(self, app):
+        self.slow_request_ms = app.config.get('SLOW_REQUEST_MS', self.slow_request_ms)
+
+        app.before_request(self._start_request)
+        app.after_request(self._finish_request)
+
+        with app.app_context():
+            event.listen(db.engine, 'before_cursor_execute', self._before_cursor_execute)
+            event.listen(db.engine, 'after_cursor_execute', self._after_cursor_execute)
+            event.listen(db.engine, 'handle_error', self._handle_error)
+
+        app.extensions['metrics'] = self
+
+    # ---------- per-request breakdown ----------
+
+    def _current(self):
+        """Breakdown of the request being handled, or None outside a request."""
+        if has_app_context():
+            return g.get('_metrics')
+        return None
+
+    def _endpoint(self):
+        state = self._current()
+        return state['endpoint'] if state is not None else BACKGROUND
+
+    def _start_request(self):
+        g._metrics = {
+            'endpoint': request.endpoint or 'unmatched',
+            'started': time.perf_counter(),
+            'db_seconds': 0.0,
+            'db_queries': 0,
+            'llm_seconds': 0.0,
+            'llm_calls': 0,
+            'prompt_tokens': 0,
+            'completion_tokens': 0
+        }
+
+    def _finish_request(self, response):
+        state = g.get('_metrics')
+        if state is None:
+            return response
+
+        endpoint = state['endpoint']
+        method = request.method
+        if request.content_length:
+            self.request_size.observe(request.content_length, endpoint=endpoint)
+
+        def finish():
+            duration = time.perf_counter() - state['started']
+            self.request_duration.observe(duration, endpoint=endpoint, method=method, status=response.status_code)
+            self.db_queries_per_request.observe(state['db_queries'], endpoint=endpoint)
+            if self.slow_request_ms and duration * 1000 >= self.slow_request_ms:
+                self._log_slow_request(method, response.status_code, duration, state)
+
+        if response.is_streamed:
+            # Streamed bodies are produced after this hook; time them until the response is closed
+            response.call_on_close(finish)
+        else:
+            self.response_size.observe(response.calculate_content_length() or 0, endpoint=endpoint)
+            finish()
+        return response
+
+    def _log_slow_request(self, method, status, duration, state):
+        total_ms = duration * 1000
+        db_ms = state['db_seconds'] * 1000
+        llm_ms = state['llm_seconds'] * 1000
+        print(
+            f"Slow request: {method} {state['endpoint']} {status} in {total_ms:.0f}ms "
+            f"(db {db_ms:.0f}ms / {state['db_queries']} queries, "
+            f"llm {llm_ms:.0f}ms / {state['llm_calls']} calls, "
+            f"{state['prompt_tokens']} prompt + {state['completion_tokens']} completion tokens, "
+            f"other {max(0.0, total_ms - db_ms - llm_ms):.0f}ms)"
+        )
+
+    # ---------- SQLAlchemy ----------
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('_metrics_started', []).append(time.perf_counter())
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        started = conn.info['_metrics_started'].pop()
+        duration = time.perf_counter() - started
+        state = self._current()
+        self.db_duration.observe(duration, endpoint=state['endpoint'] if state is not None else BACKGROUND)
+        if state is not None:
+            state['db_seconds'] += duration
+            state['db_queries'] += 1
+
+    def _handle_error(self, exception_context):
+        # Failed statements never reach after_cursor_execute
+        connection = exception_context.connection
+        if connection is not None and connection.info.get('_metrics_started'):
+            connection.info['_metrics_started'].pop()
+
+    # ---------- extraction and LLM calls ----------
+
+    def observe_extraction(self, file_type, source, status, duration, size=None):
+        """Record one extraction job; `source` is where the text came from (database, cache, extracted)."""
+        self.extraction_duration.observe(duration, file_type=file_type, source=source, status=status)
+        if size is not None:
+            self.extraction_size.observe(size, file_type=file_type)
+
+    def observe_llm(self, model, status, duration, usage=None, estimated_tokens=None):
+        """
+        Record one Groq call; `usage` is the API's usage object, when it
+        reported one, and `estimated_tokens` our estimate of its prompt.
+        """
+        endpoint = self._endpoint()
+        self.llm_duration.observe(duration, endpoint=endpoint, model=model, status=status)
+
+        prompt_tokens = getattr(usage, 'prompt_tokens', 0) or 0
+        completion_tokens = getattr(usage, 'completion_tokens', 0) or 0
+        if usage is not None:
+            self.llm_tokens.inc(prompt_tokens, endpoint=endpoint, model=model, kind='prompt')
+            self.llm_tokens.inc(completion_tokens, endpoint=endpoint, model=model, kind='completion')
+
+            if estimated_tokens and prompt_tokens:
+                self.llm_estimated_tokens.inc(estimated_tokens, endpoint=endpoint, model=model)
+                ratio = prompt_tokens / estimated_tokens
+                self.llm_estimate_ratio.observe(ratio, model=model)
+                if abs(ratio - 1) > TOKEN_ESTIMATE_TOLERANCE:
+                    print(f"LLM tokens on {endpoint}: estimated {estimated_tokens} prompt tokens, "
+                          f"the API counted {prompt_tokens} ({ratio:.2f}x)")
+
+        state = self._current()
+        if state is not None:
+            state['llm_seconds'] += duration
+            state['llm_calls'] += 1
+            state['prompt_tokens'] += prompt_tokens
+            state['completion_tokens'] += completion_tokens
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+metrics = Metrics()
@@ -0,0 +1,187 @@
+import time
+
+from sqlalchemy import func, inspect, select, text, update
+from models import db, CompressedText, Document, DocumentChunk, register_sql_functions
+from retrieval import index_document
+from search import create_search_index, fts_enabled
+
+# SQL run right after a column is added, to fill it in for existing rows
+BACKFILLS = {
+    ('chats', 'preview'): """
+        UPDATE chats SET preview = (
+            SELECT CASE WHEN length(m.message) > 50 THEN substr(m.message, 1, 50) || '...' ELSE m.message END
+            FROM messages m
+            WHERE m.chat_id = chats.id AND m.sender = 'user'
+            ORDER BY m.id
+            LIMIT 1
+        )
+    """,
+    ('chats', 'last_message_at'): """
+        UPDATE chats SET last_message_at = (SELECT max(m.timestamp) FROM messages m WHERE m.chat_id = chats.id)
+    """,
+}
+
+# Indexes no longer declared on the models, dropped from existing databases
+OBSOLETE_INDEXES = {
+    # Superseded by ix_messages_chat_id: messages are read in id order
+    'messages': ['ix_messages_chat_timestamp'],
+}
+
+def upgrade_schema():
+    """
+    Bring an existing database up to date with the models.
+    
+    New tables are created by `db.create_all()`. Columns added to existing
+    tables are applied with `ALTER TABLE ... ADD COLUMN`, using the column's
+    server default so existing rows get a sensible value, and then
+    backfilled from existing data where BACKFILLS says how. Indexes missing
+    from existing tables are created next and OBSOLETE_INDEXES dropped.
+    Ready documents without chunks (uploaded before chunking) are chunked,
+    and on SQLite the full-text search index is created last, so it covers
+    them.
+    """
+    db.create_all()
+    
+    inspector = inspect(db.engine)
+    dialect = db.engine.dialect
+    
+    with db.engine.begin() as connection:
+        for table in db.metadata.sorted_tables:
+            existing = {column['name'] for column in inspector.get_columns(table.name)}
+            
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                
+                ddl = f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column.type.compile(dialect=dialect)}'
+                if column.server_default is not None:
+                    default = column.server_default.arg
+                    ddl += f" NOT NULL DEFAULT '{default}'" if not column.nullable else f" DEFAULT '{default}'"
+                
+                print(f"Migrating: adding column {table.name}.{column.name}")
+                connection.execute(text(ddl))
+                
+                backfill = BACKFILLS.get((table.name, column.name))
+                if backfill:
+                    connection.execute(text(backfill))
+            
+            existing_indexes = {index['name'] for index in inspector.get_indexes(table.name)}
+            for index in table.indexes:
+                if index.name not in existing_indexes:
+                    print(f"Migrating: creating index {index.name}")
+                    index.create(connection)
+            
+            for name in OBSOLETE_INDEXES.get(table.name, []):
+                if name in existing_indexes:
+                    print(f"Migrating: dropping index {name}")
+                    connection.execute(text(f'DROP INDEX {name}'))
+    
+    chunk_unindexed_documents()
+    
+    with db.engine.begin() as connection:
+        if fts_enabled():
+            # The engine may not be the app's (e.g. a migration tool's), whose
+            # connections lack the function the search triggers call
+            register_sql_functions(connection.connection.driver_connection)
+            create_search_index(connection)
+
+
+def chunk_unindexed_documents(batch_size=100):
+    """
+    Chunk ready documents that have no chunks, `batch_size` per transaction.
+    
+    Documents uploaded before chunked retrieval were otherwise only chunked
+    when first asked about, and could not be found by search until then.
+    Returns the number of documents chunked.
+    """
+    has_chunks = db.session.query(DocumentChunk.id).filter(DocumentChunk.document_id == Document.id).exists()
+    # Documents without any text have no chunks to add
+    has_text = db.or_(Document.content_sha256.isnot(None), Document._extracted_text != '')
+    document_ids = db.session.execute(
+        select(Document.id).where(Document.status == Document.STATUS_READY, has_text, ~has_chunks).order_by(Document.id)
+    ).scalars().all()
+    
+    if document_ids:
+        print(f"Migrating: chunking {len(document_ids)} documents")
+    for start in range(0, len(document_ids), batch_size):
+        for document in Document.query.filter(Document.id.in_(document_ids[start:start + batch_size])).all():
+            index_document(document)
+        db.session.commit()
+    db.session.remove()
+    return len(document_ids)
+
+def compressed_columns():
+    """(table, column) pairs whose type is CompressedText."""
+    return [
+        (table, column)
+        for table in db.metadata.sorted_tables
+        for column in table.columns
+        if isinstance(column.type, CompressedText)
+    ]
+
+def compress_existing_text(batch_size=500):
+    """
+    Compress rows written before their column used CompressedText.
+    
+    SQLite only. Rows still stored as text are read in primary key order,
+    `batch_size` at a time, and written back through the column type, which
+    compresses them; each batch is committed on its own so the command can
+    be interrupted and resumed. Returns the number of rows rewritten per
+    column.
+    """
+    if db.engine.dialect.name != 'sqlite':
+        return {}
+    
+    rewritten = {}
+    for table, column in compressed_columns():
+        primary_key = table.primary_key.columns.values()[0]
+        count = 0
+        last_key = None
+        
+        while True:
+            query = select(primary_key, column) \
+                .where(func.typeof(column) == 'text') \
+                .where(func.length(column) >= column.type.min_bytes) \
+                .order_by(primary_key).limit(batch_size)
+            if last_key is not None:
+                query = query.where(primary_key > last_key)
+            
+            rows = db.session.execute(query).all()
+            if not rows:
+                break
+            
+            for key, value in rows:
+                db.session.execute(update(table).where(primary_key == key).values({column.name: value}))
+            db.session.commit()
+            
+            count += len(rows)
+            last_key = rows[-1][0]
+            print(f"Compressed {count} rows of {table.name}.{column.name}")
+        
+        rewritten[f'{table.name}.{column.name}'] = count
+    
+    return rewritten
+
+def database_size():
+    """Size of the SQLite database in bytes (pages in use and free pages)."""
+    page_size = db.session.execute(text('PRAGMA page_size')).scalar()
+    page_count = db.session.execute(text('PRAGMA page_count')).scalar()
+    return page_size * page_count
+
+def measure_read_latency(samples=200):
+    """Average milliseconds to read one value from each compressed column (first `samples` rows)."""
+    latency = {}
+    for table, column in compressed_columns():
+        primary_key = table.primary_key.columns.values()[0]
+        keys = db.session.execute(select(primary_key).order_by(primary_key).limit(samples)).scalars().all()
+        if not keys:
+            continue
+        
+        # A fresh connection per measurement keeps SQLAlchemy's caches out of it
+        db.session.remove()
+        started = time.perf_counter()
+        for key in keys:
+            db.session.execute(select(column).where(primary_key == key)).scalar()
+        latency[f'{table.name}.{column.name}'] = (time.perf_counter() - started) * 1000 / len(keys)
+    db.session.remove()
+    return latency
@@ -1,8 +1,97 @@
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
+from sqlalchemy.types import Text, TypeDecorator
 from datetime import datetime
+import zlib
+
+from document_structure import load_sections
 
 db = SQLAlchemy()
 
+class CompressedText(TypeDecorator):
+    """
+    Text column stored zlib-compressed on SQLite.
+    
+    Values of at least `min_bytes` UTF-8 bytes are written as a BLOB made of
+    COMPRESSED_PREFIX followed by the zlib stream, when that is smaller than
+    the text. Rows without the prefix (short values and rows written before
+    compression) are read back unchanged, so both kinds can live in the same
+    column. Other databases get plain text: PostgreSQL already compresses
+    large values itself (TOAST).
+    """
+    impl = Text
+    cache_ok = True
+    
+    # Marks a compressed value; text never starts with a NUL byte
+    COMPRESSED_PREFIX = b'\x00z1'
+    
+    def __init__(self, min_bytes=512, level=6, **kwargs):
+        super().__init__(**kwargs)
+        self.min_bytes = min_bytes
+        self.level = level
+    
+    def process_bind_param(self, value, dialect):
+        if value is None or dialect.name != 'sqlite':
+            return value
+        
+        raw = value.encode('utf-8')
+        if len(raw) < self.min_bytes:
+            return value
+        
+        compressed = self.COMPRESSED_PREFIX + zlib.compress(raw, self.level)
+        return compressed if len(compressed) < len(raw) else value
+    
+    def process_result_value(self, value, dialect):
+        return self.decompress(value)
+    
+    @classmethod
+    def decompress(cls, value):
+        """Stored value -> text; also registered as the SQL function decompress_text() on SQLite."""
+        if isinstance(value, bytes):
+            if value.startswith(cls.COMPRESSED_PREFIX):
+                value = zlib.decompress(value[len(cls.COMPRESSED_PREFIX):])
+            return value.decode('utf-8')
+        return value
+
+def register_sql_functions(dbapi_connection):
+    """
+    Add the decompress_text() SQL function to a raw SQLite connection.
+    
+    The full-text search triggers call it on every insert, update and delete
+    of document_chunks and messages, so any connection that writes those
+    tables needs it, not only the app's (see migrations.upgrade_schema).
+    """
+    dbapi_connection.create_function('decompress_text', 1, CompressedText.decompress, deterministic=True)
+
+def init_db(app):
+    """
+    Bind the database to the app.
+    
+    SQLite connections are switched to WAL journaling so readers do not block
+    the writer, and wait up to SQLITE_BUSY_TIMEOUT_MS for locks instead of
+    failing with "database is locked". They also get a decompress_text() SQL
+    function, which the full-text search triggers use to read compressed text.
+    """
+    db.init_app(app)
+    
+    with app.app_context():
+        if db.engine.dialect.name != 'sqlite':
+            return
+        
+        busy_timeout = int(app.config.get('SQLITE_BUSY_TIMEOUT_MS', 5000))
+        synchronous = app.config.get('SQLITE_SYNCHRONOUS', 'NORMAL').upper()
+        if synchronous not in ('OFF', 'NORMAL', 'FULL', 'EXTRA'):
+            raise ValueError(f"Invalid SQLITE_SYNCHRONOUS setting: {synchronous}")
+        
+        @event.listens_for(db.engine, 'connect')
+        def set_sqlite_pragmas(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+            cursor.execute('PRAGMA journal_mode=WAL')
+            cursor.execute(f'PRAGMA busy_timeout={busy_timeout}')
+            cursor.execute(f'PRAGMA synchronous={synchronous}')
+            cursor.close()
+            register_sql_functions(dbapi_connection)
+
 class User(db.Model):
     __tablename__ = 'users'
     
@@ -12,6 +101,8 @@ class User(db.Model):
     phone_number = db.Column(db.String(20), nullable=True)
     password_hash = db.Column(db.String(200), nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # Incremented whenever the user's documents, chats or messages change (see change_tracking)
+    change_counter = db.Column(db.Integer, nullable=False, default=0, server_default='0')
     
     # Relationships
     documents = db.relationship('Document', backref='user', lazy=True, cascade='all, delete-orphan')
@@ -22,26 +113,139 @@ class User(db.Model):
 
 class Document(db.Model):
     __tablename__ = 'documents'
+    __table_args__ = (
+        # Document list: filter by user, newest first
+        db.Index('ix_documents_user_uploaded', 'user_id', 'uploaded_at'),
+    )
+    
+    # Ingestion status values
+    STATUS_PENDING = 'pending'
+    STATUS_EXTRACTING = 'extracting'
+    STATUS_READY = 'ready'
+    # A new version is being processed; the current one is still served
+    STATUS_UPDATING = 'updating'
+    STATUS_FAILED = 'failed'
     
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     filename = db.Column(db.String(255), nullable=False)
-    extracted_text = db.Column(db.Text, nullable=False)
+    # Text of documents uploaded before content-addressed storage; new
+    # documents keep it empty and reference a shared ExtractedText instead
+    _extracted_text = db.deferred(db.Column('extracted_text', CompressedText, nullable=False, default=''))
+    content_sha256 = db.Column(db.String(64), db.ForeignKey('extracted_texts.sha256'), nullable=True, index=True)
     uploaded_at = db.Column(db.DateTime, default=datetime.utcnow)
+    status = db.Column(db.String(20), nullable=False, default=STATUS_READY, server_default=STATUS_READY)
+    error_message = db.Column(db.Text, nullable=True)
+    # Incremented every time a new version of the file is uploaded
+    version = db.Column(db.Integer, nullable=False, default=1, server_default='1')
+    # Estimated tokens of the extracted text, counted when it is chunked
+    # (None for documents that have not been chunked since token counting was added)
+    token_count = db.Column(db.Integer, nullable=True)
     
     # Relationships
+    content = db.relationship('ExtractedText', lazy=True)
     chats = db.relationship('Chat', backref='document', lazy=True, cascade='all, delete-orphan')
+    chunks = db.relationship('DocumentChunk', backref='document', lazy=True, cascade='all, delete-orphan',
+                             order_by='DocumentChunk.position')
+    study_materials = db.relationship('StudyMaterial', backref='document', lazy=True, cascade='all, delete-orphan')
+    
+    @property
+    def extracted_text(self):
+        if self.content is not None:
+            return self.content.text
+        return self._extracted_text
+    
+    @extracted_text.setter
+    def extracted_text(self, value):
+        self._extracted_text = value
     
     def __repr__(self):
         return f'<Document {self.filename}>'
 
+class ExtractedText(db.Model):
+    """Extracted text shared by every document uploaded with the same file contents."""
+    __tablename__ = 'extracted_texts'
+    
+    sha256 = db.Column(db.String(64), primary_key=True)  # hash of the raw uploaded file
+    text = db.Column(CompressedText, nullable=False)
+    # Pages, slides, headings, paragraphs and tables with offsets into `text`
+    # (compact JSON, see document_structure); NULL for text extracted before
+    structure = db.deferred(db.Column(CompressedText, nullable=True))
+    # JSON list of page/slide fingerprints (PDF/PPTX), to diff new versions against
+    page_hashes = db.deferred(db.Column(db.Text, nullable=True))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    @property
+    def sections(self):
+        return load_sections(self.structure)
+    
+    @classmethod
+    def delete_unreferenced(cls, sha256):
+        """
+        Delete the text for `sha256` if no document references it; True if it was deleted.
+        
+        The check is part of the DELETE itself, so a document that attaches
+        the text in a concurrent transaction is never left pointing at nothing.
+        """
+        referenced = db.session.query(Document.id).filter(Document.content_sha256 == sha256).exists()
+        return cls.query.filter(cls.sha256 == sha256, ~referenced).delete(synchronize_session=False) > 0
+    
+    def __repr__(self):
+        return f'<ExtractedText {self.sha256[:12]}>'
+
+class DocumentChunk(db.Model):
+    __tablename__ = 'document_chunks'
+    __table_args__ = (
+        db.Index('ix_document_chunks_document_position', 'document_id', 'position'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    document_id = db.Column(db.Integer, db.ForeignKey('documents.id'), nullable=False)
+    position = db.Column(db.Integer, nullable=False)  # order of the chunk within the document
+    content = db.Column(CompressedText, nullable=False)
+    token_count = db.Column(db.Integer, nullable=False)
+    # Pages (or slides) the chunk spans; NULL when the document has no pages
+    page_start = db.Column(db.Integer, nullable=True)
+    page_end = db.Column(db.Integer, nullable=True)
+    
+    def __repr__(self):
+        return f'<DocumentChunk {self.document_id}:{self.position}>'
+
+class StudyMaterial(db.Model):
+    """Generated flashcards/quiz/mindmap for a document, cached per prompt version."""
+    __tablename__ = 'study_materials'
+    __table_args__ = (
+        db.UniqueConstraint('document_id', 'tool_type', 'prompt_version', name='uq_study_material'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    document_id = db.Column(db.Integer, db.ForeignKey('documents.id'), nullable=False)
+    tool_type = db.Column(db.String(20), nullable=False)  # 'flashcards', 'quiz' or 'mindmap'
+    prompt_version = db.Column(db.String(20), nullable=False)
+    content = db.Column(db.Text, nullable=False)  # JSON returned to the frontend
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<StudyMaterial {self.document_id}:{self.tool_type}>'
+
 class Chat(db.Model):
     __tablename__ = 'chats'
+    __table_args__ = (
+        # Chat list: filter by user, newest first (id breaks ties for keyset pagination)
+        db.Index('ix_chats_user_created', 'user_id', 'created_at', 'id'),
+        db.Index('ix_chats_document_id', 'document_id'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     document_id = db.Column(db.Integer, db.ForeignKey('documents.id'), nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # Denormalized for the chat list; kept up to date when messages are saved
+    preview = db.Column(db.String(60), nullable=True)  # first user message, truncated
+    last_message_at = db.Column(db.DateTime, nullable=True)
+    # Conversation memory: rolling summary of all messages up to summarized_until_id
+    summary = db.deferred(db.Column(db.Text, nullable=True))
+    summarized_until_id = db.Column(db.Integer, nullable=True)
     
     # Relationships
     messages = db.relationship('Message', backref='chat', lazy=True, cascade='all, delete-orphan')
@@ -51,11 +255,16 @@ class Chat(db.Model):
 
 class Message(db.Model):
     __tablename__ = 'messages'
+    __table_args__ = (
+        # Chat history, oldest first, and its keyset pagination on message id
+        db.Index('ix_messages_chat_id', 'chat_id', 'id'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     chat_id = db.Column(db.Integer, db.ForeignKey('chats.id'), nullable=False)
     sender = db.Column(db.String(10), nullable=False)  # 'user' or 'ai'
-    message = db.Column(db.Text, nullable=False)
+    # Deferred: only loaded when a message body is actually read
+    message = db.deferred(db.Column(CompressedText, nullable=False))
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
     
     def __repr__(self):
@@ -0,0 +1,302 @@
+import math
+import re
+import threading
+from collections import Counter, OrderedDict
+
+from document_structure import PAGE_KINDS, page_label
+from models import db, DocumentChunk
+from tokens import count_tokens
+
+# Target size of a single chunk, in estimated tokens
+CHUNK_TOKENS = 300
+
+# Maximum number of per-document indexes kept in memory
+INDEX_CACHE_SIZE = 64
+
+# BM25 tuning parameters
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+
+STOPWORDS = frozenset("""
+a an and are as at be but by can did do does for from had has have how i if in
+into is it its me my of on or our so than that the their them then there these
+they this to was we were what when where which who why will with would you your
+""".split())
+
+
+def tokenize(text):
+    """Lowercase word tokens with common stopwords removed."""
+    return [t for t in TOKEN_PATTERN.findall(text.lower()) if t not in STOPWORDS]
+
+
+def split_into_chunks(text, chunk_tokens=CHUNK_TOKENS):
+    """
+    Split text into chunks of roughly `chunk_tokens` tokens.
+
+    Paragraphs are packed together until the chunk is full; paragraphs that
+    are larger than a chunk on their own are split on word boundaries.
+    """
+    chunks = []
+    current = []
+    current_tokens = 0
+
+    for paragraph in re.split(r'\n\s*\n', text):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+
+        paragraph_tokens = count_tokens(paragraph)
+
+        if paragraph_tokens > chunk_tokens:
+            if current:
+                chunks.append('\n\n'.join(current))
+                current, current_tokens = [], 0
+            words = paragraph.split()
+            piece = []
+            piece_tokens = 0
+            for word in words:
+                word_tokens = count_tokens(' ' + word)
+                if piece and piece_tokens + word_tokens > chunk_tokens:
+                    chunks.append(' '.join(piece))
+                    piece, piece_tokens = [], 0
+                piece.append(word)
+                piece_tokens += word_tokens
+            if piece:
+                chunks.append(' '.join(piece))
+            continue
+
+        if current and current_tokens + paragraph_tokens > chunk_tokens:
+            chunks.append('\n\n'.join(current))
+            current, current_tokens = [], 0
+
+        current.append(paragraph)
+        current_tokens += paragraph_tokens
+
+    if current:
+        chunks.append('\n\n'.join(current))
+
+    return chunks
+
+
+class BM25Index:
+    """In-memory BM25 ranker over an inverted index of chunk terms."""
+
+    def __init__(self, chunk_ids, chunk_texts):
+        self.chunk_ids = list(chunk_ids)
+        self.lengths = []
+        self.postings = {}
+
+        for position, text in enumerate(chunk_texts):
+            terms = Counter(tokenize(text))
+            self.lengths.append(sum(terms.values()))
+            for term, freq in terms.items():
+                self.postings.setdefault(term, []).append((position, freq))
+
+        count = len(self.lengths)
+        self.avg_length = (sum(self.lengths) / count) if count else 0.0
+        self.idf = {
+            term: math.log(1 + (count - len(entries) + 0.5) / (len(entries) + 0.5))
+            for term, entries in self.postings.items()
+        }
+
+    def search(self, query, top_k):
+        """Return up to `top_k` (chunk_id, score) pairs, best first."""
+        scores = {}
+
+        for term in set(tokenize(query)):
+            entries = self.postings.get(term)
+            if not entries:
+                continue
+            idf = self.idf[term]
+            for position, freq in entries:
+                norm = 1 - BM25_B + BM25_B * self.lengths[position] / (self.avg_length or 1)
+                score = idf * freq * (BM25_K1 + 1) / (freq + BM25_K1 * norm)
+                scores[position] = scores.get(position, 0.0) + score
+
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:top_k]
+        return [(self.chunk_ids[position], score) for position, score in ranked]
+
+
+# Indexes are cached per process under _index_key(), so a new version (or
+# a new document reusing a deleted one's id) never hits an index built
+# for other chunks, even in processes that did not run invalidate_index()
+_index_cache = OrderedDict()
+_index_lock = threading.Lock()
+
+
+def _index_key(document):
+    return (document.id, document.version, document.uploaded_at)
+
+
+def invalidate_index(document_id):
+    """Drop the cached indexes of a document whose chunks changed (in this process)."""
+    with _index_lock:
+        for key in [key for key in _index_cache if key[0] == document_id]:
+            del _index_cache[key]
+
+
+def document_chunks(document):
+    """
+    Chunk a document's text into (content, page) pairs.
+
+    Documents with pages or slides are chunked page by page, so a chunk
+    never spans two pages and editing one page only changes its own chunks.
+    """
+    text = document.extracted_text
+    sections = document.content.sections if document.content is not None else []
+    pages = [section for section in sections if section.kind in PAGE_KINDS]
+
+    if not pages:
+        return [(content, None) for content in split_into_chunks(text)]
+    return [
+        (content, page.number)
+        for page in pages
+        for content in split_into_chunks(text[page.start:page.end])
+    ]
+
+
+def _new_chunk(position, content, page):
+    return DocumentChunk(
+        position=position,
+        content=content,
+        token_count=count_tokens(content),
+        page_start=page,
+        page_end=page
+    )
+
+
+def index_document(document):
+    """Split a document's text into chunks and attach them to the document (and count its tokens)."""
+    document.chunks = [
+        _new_chunk(position, content, page)
+        for position, (content, page) in enumerate(document_chunks(document))
+    ]
+    document.token_count = sum(chunk.token_count for chunk in document.chunks)
+    if document.id is not None:
+        invalidate_index(document.id)
+
+
+def reindex_document(document):
+    """
+    Re-chunk a document whose text changed, e.g. after a new version.
+
+    Existing chunks with the same text are kept (only their position and
+    page are updated), so only new or changed text is written and indexed.
+    Returns the number of chunks (kept, added, removed).
+    """
+    existing = {}
+    for chunk in DocumentChunk.query.filter_by(document_id=document.id).order_by(DocumentChunk.position).all():
+        existing.setdefault(chunk.content, []).append(chunk)
+
+    kept = added = 0
+    token_count = 0
+    for position, (content, page) in enumerate(document_chunks(document)):
+        matches = existing.get(content)
+        if matches:
+            chunk = matches.pop(0)
+            chunk.position = position
+            chunk.page_start = chunk.page_end = page
+            kept += 1
+        else:
+            chunk = _new_chunk(position, content, page)
+            chunk.document_id = document.id
+            db.session.add(chunk)
+            added += 1
+        token_count += chunk.token_count
+
+    removed = 0
+    for chunks in existing.values():
+        for chunk in chunks:
+            db.session.delete(chunk)
+            removed += 1
+
+    document.token_count = token_count
+    invalidate_index(document.id)
+    return kept, added, removed
+
+
+def document_token_count(document):
+    """Estimated tokens of a document's text, counted (and stored) now for documents chunked before."""
+    if document.token_count is None:
+        total = db.session.query(db.func.sum(DocumentChunk.token_count)) \
+            .filter_by(document_id=document.id).scalar()
+        document.token_count = total if total is not None else count_tokens(document.extracted_text)
+        db.session.commit()
+    return document.token_count
+
+
+def get_index(document):
+    """Return the BM25 index for a document, building it on first use."""
+    key = _index_key(document)
+    with _index_lock:
+        index = _index_cache.get(key)
+        if index is not None:
+            _index_cache.move_to_end(key)
+            return index
+
+    rows = db.session.query(DocumentChunk.id, DocumentChunk.content) \
+        .filter_by(document_id=document.id) \
+        .order_by(DocumentChunk.position.asc()).all()
+
+    if not rows:
+        # Documents uploaded before chunking existed are indexed lazily
+        index_document(document)
+        db.session.commit()
+        rows = [(chunk.id, chunk.content) for chunk in document.chunks]
+
+    index = BM25Index([row[0] for row in rows], [row[1] for row in rows])
+
+    with _index_lock:
+        _index_cache[key] = index
+        _index_cache.move_to_end(key)
+        while len(_index_cache) > INDEX_CACHE_SIZE:
+            _index_cache.popitem(last=False)
+
+    return index
+
+
+def select_context(document, question, top_k, token_budget):
+    """
+    Build the document context for a question from the best-matching chunks.
+
+    The top `top_k` chunks are taken in score order until `token_budget` is
+    reached, then returned in document order so the excerpts read naturally.
+    If nothing matches (e.g. greetings), the opening chunks are used instead.
+    """
+    index = get_index(document)
+    ranked_ids = [chunk_id for chunk_id, _ in index.search(question, top_k)]
+
+    if not ranked_ids:
+        ranked_ids = index.chunk_ids[:top_k]
+
+    if not ranked_ids:
+        return ''
+
+    chunks = {
+        chunk.id: chunk
+        for chunk in DocumentChunk.query.filter(
+            DocumentChunk.document_id == document.id, DocumentChunk.id.in_(ranked_ids)
+        ).all()
+    }
+
+    selected = []
+    used_tokens = 0
+    for chunk_id in ranked_ids:
+        chunk = chunks.get(chunk_id)
+        if chunk is None:
+            continue
+        if selected and used_tokens + chunk.token_count > token_budget:
+            continue
+        selected.append(chunk)
+        used_tokens += chunk.token_count
+
+    selected.sort(key=lambda chunk: chunk.position)
+    return '\n\n[...]\n\n'.join(_cite(document, chunk) for chunk in selected)
+
+
+def _cite(document, chunk):
+    """Chunk text, prefixed with the pages it comes from when known."""
+    label = page_label(document.filename, chunk.page_start, chunk.page_end)
+    return f'[{label}]\n{chunk.content}' if label else chunk.content
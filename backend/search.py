@@ -0,0 +1,250 @@
+import html
+import re
+
+from sqlalchemy import inspect, text
+
+from models import db, Chat, Document, DocumentChunk, Message
+
+# Terms of a search query (letters and digits); everything else is ignored
+QUERY_TERM = re.compile(r'\w+', re.UNICODE)
+
+# Words of context on each side of a match in snippets
+SNIPPET_TOKENS = 16
+
+# Placeholders around highlighted terms, replaced after HTML-escaping the snippet
+_MARK_START, _MARK_END = '\x02', '\x03'
+
+# SQLite full-text index. The FTS5 tables are external-content tables over
+# views that decompress the text, so the text itself is not stored twice;
+# triggers keep them in sync with every write to document_chunks and messages.
+SEARCH_INDEXES = {
+    'document_chunks_fts': ('document_chunks', 'content'),
+    'messages_fts': ('messages', 'message'),
+}
+
+FTS_DDL = (
+    """CREATE VIEW IF NOT EXISTS {source}_text AS
+        SELECT id, decompress_text({column}) AS {column} FROM {source}""",
+
+    """CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5(
+        {column}, content='{source}_text', content_rowid='id',
+        tokenize='porter unicode61 remove_diacritics 2'
+    )""",
+
+    """CREATE TRIGGER IF NOT EXISTS {fts}_insert AFTER INSERT ON {source} BEGIN
+        INSERT INTO {fts}(rowid, {column}) VALUES (new.id, decompress_text(new.{column}));
+    END""",
+
+    """CREATE TRIGGER IF NOT EXISTS {fts}_delete AFTER DELETE ON {source} BEGIN
+        INSERT INTO {fts}({fts}, rowid, {column}) VALUES ('delete', old.id, decompress_text(old.{column}));
+    END""",
+
+    """CREATE TRIGGER IF NOT EXISTS {fts}_update AFTER UPDATE OF {column} ON {source} BEGIN
+        INSERT INTO {fts}({fts}, rowid, {column}) VALUES ('delete', old.id, decompress_text(old.{column}));
+        INSERT INTO {fts}(rowid, {column}) VALUES (new.id, decompress_text(new.{column}));
+    END""",
+)
+
+
+def fts_enabled():
+    return db.engine.dialect.name == 'sqlite'
+
+
+def create_search_index(connection):
+    """Create the FTS5 tables, views and triggers that are missing, indexing existing rows."""
+    existing = set(inspect(connection).get_table_names())
+
+    for fts, (source, column) in SEARCH_INDEXES.items():
+        for statement in FTS_DDL:
+            connection.exec_driver_sql(statement.format(fts=fts, source=source, column=column))
+
+        if fts not in existing:
+            print(f"Migrating: building full-text index {fts}")
+            connection.exec_driver_sql(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')")
+
+
+def to_fts_query(query):
+    """
+    Turn user input into an FTS5 query: every term must match, and the last
+    one also matches as a prefix (for search-as-you-type). Returns None if
+    the input has no searchable terms.
+    """
+    terms = QUERY_TERM.findall(query.lower())
+    if not terms:
+        return None
+    quoted = [f'"{term}"' for term in terms]
+    quoted[-1] += '*'
+    return ' '.join(quoted)
+
+
+def _render_snippet(snippet):
+    """HTML-escape a snippet and turn the match placeholders into <mark> tags."""
+    return html.escape(snippet or '').replace(_MARK_START, '<mark>').replace(_MARK_END, '</mark>')
+
+
+def search_documents(user_id, query, limit, offset):
+    """
+    Rank the user's documents by their best-matching chunk (BM25).
+
+    Returns up to `limit` results and whether there are more.
+    """
+    match = to_fts_query(query)
+    if match is None:
+        return [], False
+
+    if not fts_enabled():
+        return _search_documents_like(user_id, query, limit, offset)
+
+    rows = db.session.execute(text("""
+        WITH hits AS (
+            SELECT c.document_id, f.rowid AS chunk_id, f.rank AS score
+            FROM document_chunks_fts f
+            JOIN document_chunks c ON c.id = f.rowid
+            JOIN documents d ON d.id = c.document_id
+            WHERE document_chunks_fts MATCH :match AND d.user_id = :user_id
+        ), ranked AS (
+            SELECT document_id, chunk_id, score,
+                   ROW_NUMBER() OVER (PARTITION BY document_id ORDER BY score) AS position,
+                   COUNT(*) OVER (PARTITION BY document_id) AS matches
+            FROM hits
+        )
+        SELECT document_id, chunk_id, score, matches FROM ranked
+        WHERE position = 1
+        ORDER BY score
+        LIMIT :limit OFFSET :offset
+    """), {'match': match, 'user_id': user_id, 'limit': limit + 1, 'offset': offset}).all()
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if not rows:
+        return [], has_more
+
+    # Snippets are only built for the page being returned
+    snippets = _snippets('document_chunks_fts', match, [row.chunk_id for row in rows])
+    documents = {
+        document.id: document
+        for document in Document.query.filter(Document.id.in_([row.document_id for row in rows])).all()
+    }
+
+    results = [{
+        'document_id': row.document_id,
+        'filename': documents[row.document_id].filename,
+        'uploaded_at': documents[row.document_id].uploaded_at.isoformat(),
+        'score': round(-row.score, 6),
+        'matches': row.matches,
+        'snippet': snippets.get(row.chunk_id, '')
+    } for row in rows]
+    return results, has_more
+
+
+def search_messages(user_id, query, limit, offset):
+    """Rank the user's chat messages (BM25). Returns up to `limit` results and whether there are more."""
+    match = to_fts_query(query)
+    if match is None:
+        return [], False
+
+    if not fts_enabled():
+        return _search_messages_like(user_id, query, limit, offset)
+
+    rows = db.session.execute(text("""
+        SELECT m.id, ch.document_id, f.rank AS score
+        FROM messages_fts f
+        JOIN messages m ON m.id = f.rowid
+        JOIN chats ch ON ch.id = m.chat_id
+        WHERE messages_fts MATCH :match AND ch.user_id = :user_id
+        ORDER BY f.rank
+        LIMIT :limit OFFSET :offset
+    """), {'match': match, 'user_id': user_id, 'limit': limit + 1, 'offset': offset}).all()
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if not rows:
+        return [], has_more
+
+    snippets = _snippets('messages_fts', match, [row.id for row in rows])
+    messages = {message.id: message for message in Message.query.filter(Message.id.in_([row.id for row in rows])).all()}
+
+    results = [{
+        'message_id': row.id,
+        'chat_id': messages[row.id].chat_id,
+        'document_id': row.document_id,
+        'sender': messages[row.id].sender,
+        'timestamp': messages[row.id].timestamp.isoformat(),
+        'score': round(-row.score, 6),
+        'snippet': snippets.get(row.id, '')
+    } for row in rows]
+    return results, has_more
+
+
+def _snippets(fts, match, rowids):
+    placeholders = ', '.join(f':id{i}' for i in range(len(rowids)))
+    params = {f'id{i}': rowid for i, rowid in enumerate(rowids)}
+    params.update({'match': match, 'start': _MARK_START, 'end': _MARK_END, 'tokens': SNIPPET_TOKENS})
+    rows = db.session.execute(text(f"""
+        SELECT rowid, snippet({fts}, 0, :start, :end, '…', :tokens)
+        FROM {fts}
+        WHERE {fts} MATCH :match AND rowid IN ({placeholders})
+    """), params).all()
+    return {rowid: _render_snippet(snippet) for rowid, snippet in rows}
+
+
+# ---------- fallback for databases without FTS5 (e.g. PostgreSQL) ----------
+
+def _like_snippet(content, terms):
+    """Snippet around the first occurrence of any term, built in Python."""
+    lowered = content.lower()
+    positions = [lowered.find(term) for term in terms if lowered.find(term) >= 0]
+    start = max(0, min(positions) - 80) if positions else 0
+    excerpt = content[start:start + 200]
+    rendered = html.escape(excerpt)
+    for term in terms:
+        rendered = re.sub(f'({re.escape(html.escape(term))})', r'<mark>\1</mark>', rendered, flags=re.IGNORECASE)
+    return ('…' if start else '') + rendered + ('…' if start + 200 < len(content) else '')
+
+
+def _search_documents_like(user_id, query, limit, offset):
+    terms = QUERY_TERM.findall(query.lower())
+    chunk_query = db.session.query(DocumentChunk.document_id, db.func.min(DocumentChunk.id)) \
+        .join(Document, Document.id == DocumentChunk.document_id) \
+        .filter(Document.user_id == user_id)
+    for term in terms:
+        chunk_query = chunk_query.filter(DocumentChunk.content.ilike(f'%{term}%'))
+    rows = chunk_query.group_by(DocumentChunk.document_id) \
+        .order_by(DocumentChunk.document_id.desc()) \
+        .limit(limit + 1).offset(offset).all()
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    chunks = {chunk.id: chunk for chunk in DocumentChunk.query.filter(DocumentChunk.id.in_([row[1] for row in rows])).all()}
+    documents = {document.id: document for document in Document.query.filter(Document.id.in_([row[0] for row in rows])).all()}
+
+    return [{
+        'document_id': document_id,
+        'filename': documents[document_id].filename,
+        'uploaded_at': documents[document_id].uploaded_at.isoformat(),
+        'score': None,
+        'matches': None,
+        'snippet': _like_snippet(chunks[chunk_id].content, terms)
+    } for document_id, chunk_id in rows], has_more
+
+
+def _search_messages_like(user_id, query, limit, offset):
+    terms = QUERY_TERM.findall(query.lower())
+    message_query = db.session.query(Message, Chat.document_id) \
+        .options(db.undefer(Message.message)) \
+        .join(Chat, Chat.id == Message.chat_id) \
+        .filter(Chat.user_id == user_id)
+    for term in terms:
+        message_query = message_query.filter(Message.message.ilike(f'%{term}%'))
+    rows = message_query.order_by(Message.id.desc()).limit(limit + 1).offset(offset).all()
+
+    has_more = len(rows) > limit
+    return [{
+        'message_id': message.id,
+        'chat_id': message.chat_id,
+        'document_id': document_id,
+        'sender': message.sender,
+        'timestamp': message.timestamp.isoformat(),
+        'score': None,
+        'snippet': _like_snippet(message.message, terms)
+    } for message, document_id in rows[:limit]], has_more
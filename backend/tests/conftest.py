@@ -0,0 +1,155 @@
+import itertools
+import json
+import os
+import sqlite3
+import sys
+import time
+from types import SimpleNamespace
+
+import jwt
+import pytest
+
+# Tests import the backend modules the way app.py does (flat, from backend/)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Database of the first release (schema and a little data), before any
+# migration; the app fixture upgrades it with `flask upgrade-db`
+BASELINE_DATABASE = """
+CREATE TABLE users (
+    id INTEGER NOT NULL PRIMARY KEY,
+    username VARCHAR(80) NOT NULL UNIQUE,
+    email VARCHAR(120) NOT NULL UNIQUE,
+    phone_number VARCHAR(20),
+    password_hash VARCHAR(200) NOT NULL,
+    created_at DATETIME
+);
+CREATE TABLE documents (
+    id INTEGER NOT NULL PRIMARY KEY,
+    user_id INTEGER NOT NULL REFERENCES users (id),
+    filename VARCHAR(255) NOT NULL,
+    extracted_text TEXT NOT NULL,
+    uploaded_at DATETIME
+);
+CREATE TABLE chats (
+    id INTEGER NOT NULL PRIMARY KEY,
+    user_id INTEGER NOT NULL REFERENCES users (id),
+    document_id INTEGER NOT NULL REFERENCES documents (id),
+    created_at DATETIME
+);
+CREATE TABLE messages (
+    id INTEGER NOT NULL PRIMARY KEY,
+    chat_id INTEGER NOT NULL REFERENCES chats (id),
+    sender VARCHAR(10) NOT NULL,
+    message TEXT NOT NULL,
+    timestamp DATETIME
+);
+
+INSERT INTO users VALUES (1, 'legacy', 'legacy@example.com', NULL, 'x', '2024-01-01 09:00:00');
+INSERT INTO documents VALUES (1, 1, 'notes.txt', 'Photosynthesis turns light into chemical energy.', '2024-01-01 09:05:00');
+INSERT INTO chats VALUES (1, 1, 1, '2024-01-01 09:10:00');
+INSERT INTO messages VALUES (1, 1, 'user', 'What does photosynthesis produce?', '2024-01-01 09:11:00');
+INSERT INTO messages VALUES (2, 1, 'ai', 'Chemical energy, stored as glucose.', '2024-01-01 09:12:00');
+"""
+
+
+@pytest.fixture(scope='session')
+def app(tmp_path_factory):
+    """The backend app, on a baseline database brought up to date by `flask upgrade-db`."""
+    directory = tmp_path_factory.mktemp('backend')
+    database = directory / 'answerxtractor.db'
+    connection = sqlite3.connect(database)
+    connection.executescript(BASELINE_DATABASE)
+    connection.close()
+
+    # app.py reads its configuration when it is imported
+    with pytest.MonkeyPatch.context() as patch:
+        patch.setenv('DATABASE_URL', f'sqlite:///{database}')
+        patch.setenv('EXTRACTION_CACHE_DIR', str(directory / 'cache'))
+        patch.setenv('GROQ_API_KEY', os.environ.get('GROQ_API_KEY', 'test'))
+        from app import app
+
+    result = app.test_cli_runner().invoke(args=['upgrade-db'])
+    assert result.exit_code == 0, result.output
+    return app
+
+
+_user_numbers = itertools.count(1)
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def auth_headers(client):
+    """Authorization headers of a newly registered user."""
+    number = next(_user_numbers)
+    credentials = {'username': f'user{number}', 'email': f'user{number}@example.com', 'password': 'secret'}
+    assert client.post('/api/auth/register', json=credentials).status_code == 201
+    token = client.post('/api/auth/login', json=credentials).get_json()['token']
+    return {'Authorization': f'Bearer {token}'}
+
+
+@pytest.fixture
+def user_id(app, auth_headers):
+    """Id of the user of `auth_headers`."""
+    token = auth_headers['Authorization'].split(' ', 1)[1]
+    return jwt.decode(token, app.config['SECRET_KEY'], algorithms=['HS256'])['user_id']
+
+
+@pytest.fixture
+def wait_for_document(client):
+    """Poll a document's status until its background job has finished."""
+    def wait(headers, document_id, timeout=30):
+        deadline = time.monotonic() + timeout
+        while True:
+            status = client.get(f'/api/documents/{document_id}/status', headers=headers).get_json()
+            if status['status'] in ('ready', 'failed') or time.monotonic() > deadline:
+                return status
+            time.sleep(0.05)
+    return wait
+
+
+class FakeCompletions:
+    """
+    Stands in for `Groq().chat.completions`: records each request and
+    answers with `reply` (streamed word by word when asked to), or raises
+    `error`. Study-tool requests get `study_material` as their JSON.
+    """
+
+    def __init__(self):
+        self.requests = []
+        self.reply = 'Plants make glucose.'
+        self.study_material = {
+            'flashcards': [{'title': 'Photosynthesis', 'description': 'Plants make glucose from light.'}],
+            'quiz': [{'question': 'What do plants make?', 'options': ['Glucose', 'Salt', 'Iron', 'Oil'],
+                      'correct_index': 0}],
+            'mindmap': {'name': 'Plants', 'children': [{'name': 'Photosynthesis', 'children': []}]}
+        }
+        self.error = None
+
+    def create(self, **request):
+        self.requests.append(request)
+        if self.error:
+            raise self.error
+        if request.get('stream'):
+            words = self.reply.split(' ')
+            tokens = [f'{word} ' for word in words[:-1]] + words[-1:]
+            return iter([
+                SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=token))], usage=None, x_groq=None)
+                for token in tokens
+            ])
+        content = json.dumps(self.study_material) if 'response_format' in request else self.reply
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))], usage=None)
+
+
+@pytest.fixture
+def fake_groq(monkeypatch):
+    """Replace the Groq client of the LLM gateway; returns the FakeCompletions."""
+    from llm_gateway import gateway
+
+    completions = FakeCompletions()
+    # Set the lazily created client itself, so no real client is built to be restored
+    monkeypatch.setattr(gateway, '_client', SimpleNamespace(chat=SimpleNamespace(completions=completions)))
+    return completions
@@ -0,0 +1,87 @@
+import time
+
+import pytest
+
+from answer_cache import AnswerCache, document_answer_key, is_cacheable, normalize_question
+
+
+@pytest.fixture
+def cache():
+    return AnswerCache()
+
+
+def test_normalize_keeps_question_words_and_negations():
+    assert normalize_question('Why did the Roman empire fall?') == 'why did roman empire fall'
+    assert normalize_question("Why didn't the Roman empire fall?") == 'why did not roman empire fall'
+    assert normalize_question('Can you explain why the Roman empire fell?') == 'why roman empire fell'
+
+
+def test_exact_hit_ignores_case_punctuation_and_filler(cache):
+    cache.put('sha:1', 'Why did the Roman empire fall?', 'why answer')
+    assert cache.get('sha:1', 'why did the roman empire fall') == 'why answer'
+    assert cache.get('sha:1', 'Please explain: why did the Roman empire fall?') == 'why answer'
+
+
+@pytest.mark.parametrize('question', [
+    'When did the Roman empire fall?',
+    'Where did the Roman empire fall?',
+    'How did the Roman empire fall?',
+    'Did the Roman empire fall?',
+    'Who made the Roman empire fall?',
+    "Why didn't the Roman empire fall?",
+])
+def test_different_questions_about_the_same_subject_do_not_collide(cache, question):
+    cache.put('sha:1', 'Why did the Roman empire fall?', 'why answer')
+    assert cache.get('sha:1', question) is None
+
+
+def test_long_questions_with_different_question_words_do_not_collide(cache):
+    cache.put('sha:1', 'Why did the western Roman empire fall so quickly in the fifth century?', 'why answer')
+    assert cache.get('sha:1', 'When did the western Roman empire fall so quickly in the fifth century?') is None
+
+
+def test_near_duplicate_hit(cache):
+    cache.put('sha:1', 'What are the main causes of the fall of the western Roman empire?', 'causes')
+    assert cache.get('sha:1', 'What were the main causes of the fall of the western Roman empire?') == 'causes'
+
+
+def test_answers_are_per_document(cache):
+    cache.put('sha:1', 'What is BM25?', 'answer')
+    assert cache.get('sha:2', 'What is BM25?') is None
+
+
+def test_invalidate(cache):
+    cache.put('sha:1', 'What is BM25?', 'answer')
+    cache.put('sha:2', 'What is BM25?', 'other answer')
+    cache.invalidate('sha:1')
+    assert cache.get('sha:1', 'What is BM25?') is None
+    assert cache.get('sha:2', 'What is BM25?') == 'other answer'
+
+
+def test_expired_entries_miss(cache):
+    cache.ttl = 0.0001
+    cache.put('sha:1', 'What is BM25?', 'answer')
+    time.sleep(0.01)
+    assert cache.get('sha:1', 'What is BM25?') is None
+
+
+def test_lru_eviction(cache):
+    cache.max_entries = 2
+    cache.put('sha:1', 'What is BM25?', 'a')
+    cache.put('sha:1', 'What is TF-IDF?', 'b')
+    cache.get('sha:1', 'What is BM25?')
+    cache.put('sha:1', 'What is a vector database?', 'c')
+    assert cache.get('sha:1', 'What is BM25?') == 'a'
+    assert cache.get('sha:1', 'What is TF-IDF?') is None
+    assert cache.stats()['evictions'] == 1
+
+
+def test_follow_up_questions_are_not_cacheable():
+    assert is_cacheable('What is BM25?', has_history=True)
+    assert not is_cacheable('Explain that again', has_history=True)
+    assert is_cacheable('Explain that again', has_history=False)
+
+
+def test_document_answer_key():
+    assert document_answer_key(5, 'abc') == 'sha:abc'
+    assert document_answer_key(5, None) == 'doc:5'
@@ -0,0 +1,113 @@
+import io
+import uuid
+import zipfile
+
+from models import db, Document, DocumentChunk, User
+
+
+def zip_archive(files):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w') as archive:
+        for name, text in files.items():
+            archive.writestr(name, text)
+    buffer.seek(0)
+    return buffer
+
+
+def bulk_upload(client, headers, data):
+    return client.post('/api/documents/bulk', headers=headers, data=data, content_type='multipart/form-data')
+
+
+def test_zip_archive_is_imported_in_the_background(client, auth_headers, wait_for_document):
+    archive = zip_archive({
+        'biology/cells.txt': f'Cells are the unit of life. {uuid.uuid4()}',
+        'biology/genes.txt': f'Genes are made of DNA. {uuid.uuid4()}',
+        'biology/diagram.png': 'not a document',
+        '__MACOSX/biology/._cells.txt': 'resource fork',
+    })
+
+    response = bulk_upload(client, auth_headers, {'file': (archive, 'course.zip')})
+
+    assert response.status_code == 202
+    result = response.get_json()
+    assert result['message'] == '2 documents accepted!'
+    assert [document['filename'] for document in result['documents']] == ['biology/cells.txt', 'biology/genes.txt']
+    assert result['skipped'] == ['biology/diagram.png']
+    assert result['errors'] == []
+    for document in result['documents']:
+        assert wait_for_document(auth_headers, document['id'])['status'] == 'ready'
+
+
+def test_several_files_can_be_uploaded_at_once(client, auth_headers, wait_for_document):
+    data = {'files': [
+        (io.BytesIO(f'Atoms have a nucleus. {uuid.uuid4()}'.encode('utf-8')), 'atoms.txt'),
+        (io.BytesIO(b'<svg/>'), 'figure.svg'),
+    ]}
+
+    response = bulk_upload(client, auth_headers, data)
+
+    assert response.status_code == 202
+    document, = response.get_json()['documents']
+    assert response.get_json()['skipped'] == ['figure.svg']
+    assert wait_for_document(auth_headers, document['id'])['status'] == 'ready'
+
+
+def test_invalid_or_oversized_archives_are_rejected(app, client, auth_headers, monkeypatch):
+    response = bulk_upload(client, auth_headers, {'file': (io.BytesIO(b'not a zip'), 'course.zip')})
+    assert response.status_code == 400
+    assert response.get_json()['message'] == 'The uploaded file is not a valid zip archive!'
+
+    monkeypatch.setitem(app.config, 'BULK_IMPORT_MAX_FILES', 1)
+    archive = zip_archive({'a.txt': 'First.', 'b.txt': 'Second.'})
+    response = bulk_upload(client, auth_headers, {'file': (archive, 'course.zip')})
+    assert response.status_code == 400
+    assert response.get_json()['message'] == 'The archive contains 2 documents; the limit is 1.'
+
+
+def test_archive_without_documents_is_rejected(client, auth_headers):
+    archive = zip_archive({'photo.jpg': 'not a document'})
+
+    response = bulk_upload(client, auth_headers, {'file': (archive, 'photos.zip')})
+
+    assert response.status_code == 400
+    assert response.get_json() == {'message': 'No supported documents found!', 'skipped': ['photo.jpg'], 'errors': []}
+
+
+def test_import_command_imports_a_directory(app, user_id, tmp_path):
+    text = f'Enzymes speed up reactions. {uuid.uuid4()}'
+    (tmp_path / 'unit1').mkdir()
+    (tmp_path / 'unit1' / 'enzymes.txt').write_text(text)
+    (tmp_path / 'unit1' / 'enzymes-copy.txt').write_text(text)
+    (tmp_path / 'unit2.txt').write_text(f'Proteins fold. {uuid.uuid4()}')
+    (tmp_path / 'empty.txt').write_text('\n')
+    (tmp_path / 'notes.md').write_text('# Not supported')
+    (tmp_path / '.hidden.txt').write_text('Hidden.')
+    with app.app_context():
+        username = db.session.get(User, user_id).username
+        db.session.remove()
+
+    result = app.test_cli_runner().invoke(args=['import-documents', str(tmp_path), '--user', username, '--workers', '1'])
+
+    # The empty file fails, which makes the command exit with an error
+    assert result.exit_code == 1, result.output
+    assert 'Importing 4 documents' in result.output
+    assert 'Imported 3 documents, 1 failed.' in result.output
+    assert 'empty.txt: No text could be extracted from the document!' in result.output
+    with app.app_context():
+        documents = {document.filename: document for document in Document.query.filter_by(user_id=user_id)}
+        assert set(documents) == {'unit1/enzymes.txt', 'unit1/enzymes-copy.txt', 'unit2.txt'}
+        assert {document.status for document in documents.values()} == {'ready'}
+        # Identical files share one extracted text
+        assert documents['unit1/enzymes.txt'].content_sha256 == documents['unit1/enzymes-copy.txt'].content_sha256
+        assert documents['unit1/enzymes.txt'].extracted_text == text
+        assert DocumentChunk.query.filter(DocumentChunk.document_id.in_(
+            [document.id for document in documents.values()]
+        )).count() == 3
+        db.session.remove()
+
+
+def test_import_command_needs_a_known_user(app, tmp_path):
+    result = app.test_cli_runner().invoke(args=['import-documents', str(tmp_path), '--user', 'nobody'])
+
+    assert result.exit_code != 0
+    assert 'User not found: nobody' in result.output
@@ -0,0 +1,99 @@
+import gzip
+
+from compression import compressor
+from models import db, Chat, Document, Message
+
+
+def add_document(app, user_id, filename='notes.txt'):
+    with app.app_context():
+        document = Document(user_id=user_id, filename=filename, extracted_text='Some text.')
+        db.session.add(document)
+        db.session.commit()
+        document_id = document.id
+        db.session.remove()
+    return document_id
+
+
+def test_unchanged_poll_is_answered_with_304(client, auth_headers):
+    first = client.get('/api/documents', headers=auth_headers)
+    assert first.status_code == 200
+    assert first.headers['Cache-Control'] == 'private, no-cache'
+    etag = first.headers['ETag']
+
+    second = client.get('/api/documents', headers={**auth_headers, 'If-None-Match': etag})
+    assert second.status_code == 304
+    assert second.headers['ETag'] == etag
+    assert second.data == b''
+
+
+def test_adding_a_document_changes_the_etag(app, client, auth_headers, user_id):
+    etag = client.get('/api/documents', headers=auth_headers).headers['ETag']
+
+    add_document(app, user_id)
+
+    response = client.get('/api/documents', headers={**auth_headers, 'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
+    assert [document['filename'] for document in response.get_json()] == ['notes.txt']
+
+
+def test_bulk_delete_changes_the_etag(app, client, auth_headers, user_id):
+    document_id = add_document(app, user_id)
+    etag = client.get('/api/documents', headers=auth_headers).headers['ETag']
+
+    assert client.delete(f'/api/documents/{document_id}', headers=auth_headers).status_code == 200
+
+    response = client.get('/api/documents', headers={**auth_headers, 'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.get_json() == []
+
+
+def test_new_message_changes_the_chat_etag(app, client, auth_headers, user_id):
+    document_id = add_document(app, user_id)
+    with app.app_context():
+        chat = Chat(user_id=user_id, document_id=document_id)
+        db.session.add(chat)
+        db.session.commit()
+        chat_id = chat.id
+        db.session.remove()
+    etag = client.get(f'/api/chats/{chat_id}', headers=auth_headers).headers['ETag']
+
+    with app.app_context():
+        db.session.add(Message(chat_id=chat_id, sender='user', message='Hello?'))
+        db.session.commit()
+        db.session.remove()
+
+    response = client.get(f'/api/chats/{chat_id}', headers={**auth_headers, 'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
+
+
+def test_other_users_changes_keep_the_etag(app, client, auth_headers):
+    etag = client.get('/api/documents', headers=auth_headers).headers['ETag']
+
+    add_document(app, user_id=1)  # the baseline database's user
+
+    assert client.get('/api/documents', headers={**auth_headers, 'If-None-Match': etag}).status_code == 304
+
+
+def test_etag_depends_on_the_url(client, auth_headers):
+    plain = client.get('/api/chats', headers=auth_headers).headers['ETag']
+    paged = client.get('/api/chats?limit=1', headers=auth_headers).headers['ETag']
+
+    assert plain != paged
+    assert client.get('/api/chats?limit=1', headers={**auth_headers, 'If-None-Match': plain}).status_code == 200
+
+
+def test_compressed_variant_etag_is_revalidated(app, client, auth_headers, user_id, monkeypatch):
+    monkeypatch.setattr(compressor, 'min_bytes', 1)
+    add_document(app, user_id)
+    headers = {**auth_headers, 'Accept-Encoding': 'gzip'}
+
+    first = client.get('/api/documents', headers=headers)
+    assert first.headers['Content-Encoding'] == 'gzip'
+    assert first.headers['ETag'].endswith('-gzip"')
+    assert gzip.decompress(first.data).startswith(b'[')
+
+    second = client.get('/api/documents', headers={**headers, 'If-None-Match': first.headers['ETag']})
+    assert second.status_code == 304
+    assert second.headers['ETag'] == first.headers['ETag']
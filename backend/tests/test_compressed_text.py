@@ -0,0 +1,58 @@
+import pytest
+from sqlalchemy import text
+from sqlalchemy.dialects import postgresql, sqlite
+
+from models import db, CompressedText, Chat, Document, Message, User
+
+SQLITE = sqlite.dialect()
+LONG_TEXT = 'Ünïcode text that repeats. ' * 100
+
+
+@pytest.mark.parametrize('value', ['', 'short', LONG_TEXT, 'x' * 511, 'y' * 512])
+def test_round_trip(value):
+    column = CompressedText()
+    stored = column.process_bind_param(value, SQLITE)
+
+    assert column.process_result_value(stored, SQLITE) == value
+
+
+def test_only_long_values_are_compressed():
+    column = CompressedText()
+
+    assert column.process_bind_param('short', SQLITE) == 'short'
+    stored = column.process_bind_param(LONG_TEXT, SQLITE)
+    assert stored.startswith(CompressedText.COMPRESSED_PREFIX)
+    assert len(stored) < len(LONG_TEXT.encode('utf-8'))
+
+
+def test_other_databases_and_null_are_untouched():
+    column = CompressedText()
+
+    assert column.process_bind_param(LONG_TEXT, postgresql.dialect()) == LONG_TEXT
+    assert column.process_bind_param(None, SQLITE) is None
+    assert column.process_result_value(None, SQLITE) is None
+
+
+def test_rows_written_before_compression_read_unchanged():
+    assert CompressedText.decompress('plain legacy text') == 'plain legacy text'
+    assert CompressedText.decompress(b'legacy bytes') == 'legacy bytes'
+
+
+def test_database_round_trip_and_sql_function(app):
+    with app.app_context():
+        user = User(username='compressed', email='compressed@example.com', password_hash='x')
+        document = Document(user=user, filename='c.txt', extracted_text='')
+        chat = Chat(user=user, document=document)
+        message = Message(chat=chat, sender='ai', message=LONG_TEXT)
+        db.session.add(message)
+        db.session.commit()
+        message_id = message.id
+        db.session.remove()
+
+        stored = db.session.execute(text('SELECT message FROM messages WHERE id = :id'), {'id': message_id}).scalar()
+        assert stored.startswith(CompressedText.COMPRESSED_PREFIX)
+        assert db.session.execute(
+            text('SELECT decompress_text(message) FROM messages WHERE id = :id'), {'id': message_id}
+        ).scalar() == LONG_TEXT
+        assert db.session.get(Message, message_id).message == LONG_TEXT
+        db.session.remove()
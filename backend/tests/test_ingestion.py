@@ -0,0 +1,98 @@
+import io
+import threading
+import uuid
+
+from ingestion import ExtractionTimeout, ingestion
+from models import db, Document, DocumentChunk
+
+
+def upload(client, headers, text, filename='notes.txt'):
+    data = {'file': (io.BytesIO(text.encode('utf-8')), filename)}
+    return client.post('/api/documents/upload', headers=headers, data=data, content_type='multipart/form-data')
+
+
+def test_upload_is_accepted_then_processed_in_the_background(app, client, auth_headers, wait_for_document):
+    response = upload(client, auth_headers, f'Cells divide by mitosis. {uuid.uuid4()}')
+
+    assert response.status_code == 202
+    document = response.get_json()['document']
+    assert document['status'] == 'pending'
+
+    assert wait_for_document(auth_headers, document['id']) == {
+        'job_id': document['id'], 'document_id': document['id'], 'status': 'ready', 'error': None
+    }
+    with app.app_context():
+        processed = db.session.get(Document, document['id'])
+        assert processed.extracted_text.startswith('Cells divide by mitosis.')
+        assert processed.token_count > 0
+        assert DocumentChunk.query.filter_by(document_id=document['id']).count() == 1
+        db.session.remove()
+
+
+def test_document_is_extracting_while_its_text_is_extracted(client, auth_headers, wait_for_document, monkeypatch):
+    started, release = threading.Event(), threading.Event()
+    extract_in_pool = ingestion._extract_in_pool
+
+    def blocked(fn, *args):
+        started.set()
+        release.wait(10)
+        return extract_in_pool(fn, *args)
+
+    monkeypatch.setattr(ingestion, '_extract_in_pool', blocked)
+    document_id = upload(client, auth_headers, f'Meiosis makes gametes. {uuid.uuid4()}').get_json()['job_id']
+
+    assert started.wait(10)
+    assert client.get(f'/api/documents/{document_id}/status', headers=auth_headers).get_json()['status'] == 'extracting'
+    release.set()
+    assert wait_for_document(auth_headers, document_id)['status'] == 'ready'
+
+
+def test_document_without_text_fails(client, auth_headers, wait_for_document):
+    document_id = upload(client, auth_headers, '   \n').get_json()['job_id']
+
+    status = wait_for_document(auth_headers, document_id)
+
+    assert status['status'] == 'failed'
+    assert status['error'] == 'No text could be extracted from the document!'
+
+
+def test_extraction_error_fails_the_document(client, auth_headers, wait_for_document, monkeypatch):
+    def timeout(fn, *args):
+        raise ExtractionTimeout('Extraction exceeded 1s')
+
+    monkeypatch.setattr(ingestion, '_extract_in_pool', timeout)
+    document_id = upload(client, auth_headers, f'Osmosis moves water. {uuid.uuid4()}').get_json()['job_id']
+
+    status = wait_for_document(auth_headers, document_id)
+
+    assert status['status'] == 'failed'
+    assert status['error'] == 'Error processing document: Extraction exceeded 1s'
+
+
+def test_recover_documents_settles_interrupted_jobs(app, user_id):
+    with app.app_context():
+        documents = {
+            status: Document(user_id=user_id, filename=f'{status}.txt', extracted_text='Some text.', status=status)
+            for status in (Document.STATUS_PENDING, Document.STATUS_EXTRACTING, Document.STATUS_UPDATING,
+                           Document.STATUS_READY)
+        }
+        db.session.add_all(documents.values())
+        db.session.commit()
+        ids = {status: document.id for status, document in documents.items()}
+        db.session.remove()
+
+    result = app.test_cli_runner().invoke(args=['recover-documents'])
+
+    assert result.exit_code == 0, result.output
+    assert '3 interrupted documents recovered.' in result.output
+    with app.app_context():
+        settled = {status: db.session.get(Document, document_id) for status, document_id in ids.items()}
+        assert settled['pending'].status == settled['extracting'].status == 'failed'
+        assert settled['pending'].error_message == \
+            'Processing was interrupted by a server restart. Please upload the file again.'
+        assert settled['updating'].status == 'ready'
+        assert settled['updating'].error_message == \
+            'Processing of the new version was interrupted. Please upload it again.'
+        assert settled['ready'].status == 'ready'
+        assert settled['ready'].error_message is None
+        db.session.remove()
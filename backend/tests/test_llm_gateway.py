@@ -0,0 +1,64 @@
+import pytest
+
+import llm_gateway
+from llm_gateway import TokenBucket
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 100.0
+        self.slept = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(llm_gateway.time, 'monotonic', clock.monotonic)
+    monkeypatch.setattr(llm_gateway.time, 'sleep', clock.sleep)
+    return clock
+
+
+def test_burst_up_to_capacity_is_not_delayed(clock):
+    bucket = TokenBucket(rate=2, capacity=3)
+
+    for _ in range(3):
+        bucket.acquire()
+
+    assert clock.slept == []
+
+
+def test_requests_beyond_the_burst_wait_for_the_rate(clock):
+    bucket = TokenBucket(rate=2, capacity=1)
+
+    bucket.acquire()
+    bucket.acquire()
+    bucket.acquire()
+
+    assert clock.slept == [0.5, 1.0]
+
+
+def test_tokens_refill_over_time_up_to_capacity(clock):
+    bucket = TokenBucket(rate=1, capacity=2)
+    bucket.acquire()
+    bucket.acquire()
+
+    clock.now += 60
+    for _ in range(3):
+        bucket.acquire()
+
+    assert clock.slept == [1.0]
+
+
+def test_zero_rate_disables_limiting(clock):
+    bucket = TokenBucket(rate=0, capacity=0)
+
+    for _ in range(10):
+        bucket.acquire()
+
+    assert clock.slept == []
@@ -0,0 +1,55 @@
+import uuid
+
+import pytest
+
+import memory
+from memory import build_history
+from models import db, Chat, Document, Message, User
+
+
+@pytest.fixture
+def chat_id(app):
+    with app.app_context():
+        name = uuid.uuid4().hex
+        user = User(username=name, email=f'{name}@example.com', password_hash='x')
+        chat = Chat(user=user, document=Document(user=user, filename='m.txt', extracted_text='Text.'))
+        db.session.add(chat)
+        for number in range(1, 21):
+            db.session.add(Message(chat=chat, sender='user' if number % 2 else 'ai', message=f'message {number}'))
+        db.session.commit()
+        chat_id = chat.id
+        db.session.remove()
+    return chat_id
+
+
+def test_history_is_the_latest_window_oldest_first(app, chat_id):
+    with app.app_context():
+        history = build_history(db.session.get(Chat, chat_id))
+        db.session.remove()
+
+    window = memory.MEMORY_RECENT_MESSAGES + memory.MEMORY_SUMMARIZE_EVERY
+    assert [entry['content'] for entry in history] == [f'message {number}' for number in range(21 - window, 21)]
+    assert history[-1]['role'] == 'assistant'
+
+
+def test_history_starts_with_the_summary_and_skips_summarized_messages(app, chat_id):
+    with app.app_context():
+        chat = db.session.get(Chat, chat_id)
+        chat.summary = 'They talked about messages.'
+        chat.summarized_until_id = Message.query.filter_by(chat_id=chat_id).order_by(Message.id).all()[16].id
+        db.session.commit()
+        last = Message.query.filter_by(chat_id=chat_id).order_by(Message.id.desc()).first()
+
+        history = build_history(chat, before_id=last.id)
+        db.session.remove()
+
+    assert history[0]['role'] == 'system' and 'They talked about messages.' in history[0]['content']
+    assert [entry['content'] for entry in history[1:]] == ['message 18', 'message 19']
+
+
+def test_history_keeps_the_newest_messages_within_the_token_budget(app, chat_id):
+    with app.app_context():
+        history = build_history(db.session.get(Chat, chat_id), token_budget=7)
+        db.session.remove()
+
+    assert [entry['content'] for entry in history] == ['message 19', 'message 20']
@@ -0,0 +1,69 @@
+from sqlalchemy import inspect, text
+
+from models import db, Chat, Document, Message, User
+from search import search_documents, search_messages
+
+
+def test_upgrade_adds_tables_columns_and_indexes(app):
+    with app.app_context():
+        inspector = inspect(db.engine)
+        tables = set(inspector.get_table_names())
+        assert {'extracted_texts', 'document_chunks', 'study_materials', 'messages_fts', 'document_chunks_fts'} <= tables
+
+        for model in (User, Document, Chat, Message):
+            table = model.__table__
+            columns = {column['name'] for column in inspector.get_columns(table.name)}
+            assert {column.name for column in table.columns} <= columns
+            indexes = {index['name'] for index in inspector.get_indexes(table.name)}
+            assert {index.name for index in table.indexes} <= indexes
+
+        assert 'ix_messages_chat_timestamp' not in {index['name'] for index in inspector.get_indexes('messages')}
+
+
+def test_upgrade_keeps_and_backfills_existing_rows(app):
+    with app.app_context():
+        user = db.session.get(User, 1)
+        assert user.change_counter >= 0
+
+        document = db.session.get(Document, 1)
+        assert document.status == Document.STATUS_READY
+        assert document.version == 1
+        assert document.extracted_text == 'Photosynthesis turns light into chemical energy.'
+
+        chat = db.session.get(Chat, 1)
+        assert chat.preview == 'What does photosynthesis produce?'
+        assert chat.last_message_at.isoformat(' ') == '2024-01-01 09:12:00'
+        db.session.remove()
+
+
+def test_upgrade_makes_existing_documents_and_messages_searchable(app):
+    with app.app_context():
+        results, has_more = search_messages(1, 'glucose', limit=10, offset=0)
+        assert [result['message_id'] for result in results] == [2]
+        assert not has_more
+
+        results, has_more = search_documents(1, 'photosynthesis', limit=10, offset=0)
+        assert [result['document_id'] for result in results] == [1]
+        assert '<mark>Photosynthesis</mark>' in results[0]['snippet']
+        db.session.remove()
+
+
+def test_upgrade_is_idempotent(app):
+    app.test_cli_runner().invoke(args=['upgrade-db'])
+    result = app.test_cli_runner().invoke(args=['upgrade-db'])
+
+    assert result.exit_code == 0, result.output
+    assert 'Migrating' not in result.output
+    assert 'Database schema is up to date.' in result.output
+
+
+def test_obsolete_index_is_dropped(app):
+    with app.app_context():
+        with db.engine.begin() as connection:
+            connection.execute(text('CREATE INDEX ix_messages_chat_timestamp ON messages (chat_id, timestamp)'))
+
+    result = app.test_cli_runner().invoke(args=['upgrade-db'])
+
+    assert 'dropping index ix_messages_chat_timestamp' in result.output
+    with app.app_context():
+        assert 'ix_messages_chat_timestamp' not in {index['name'] for index in inspect(db.engine).get_indexes('messages')}
@@ -0,0 +1,105 @@
+import pytest
+
+import groq_service
+from groq_service import PromptTooLarge, check_question, _fit_question
+from models import db, Chat, Document, Message
+from tokens import count_message_tokens, count_tokens, truncate_to_tokens
+
+
+@pytest.mark.parametrize('text, tokens', [
+    ('Hello world', 2),
+    ('internationalization', 4),  # long words cost one token per 6 characters
+    ('12345', 2),  # digits are grouped by three
+    ('café', 2),
+    ('日本語', 3),  # one token per non-ASCII character
+    ('', 1),
+])
+def test_count_tokens(text, tokens):
+    assert count_tokens(text) == tokens
+
+
+def test_truncate_keeps_text_that_fits():
+    assert truncate_to_tokens('Short text.', 10) == 'Short text.'
+
+
+def test_truncate_cuts_at_a_paragraph_break_and_marks_the_cut():
+    text = '\n\n'.join(' '.join(['word'] * 20) for _ in range(5))
+
+    cut = truncate_to_tokens(text, 50)
+
+    assert cut == '\n\n'.join(' '.join(['word'] * 20) for _ in range(2)) + '\n\n[...]'
+    assert count_tokens(cut) <= 50
+
+
+@pytest.fixture
+def max_input_tokens(monkeypatch):
+    # Room for the system prompt (about 300 tokens) and a little more
+    monkeypatch.setattr(groq_service, 'LLM_MAX_INPUT_TOKENS', 500)
+    return 500
+
+
+def conversation(turns):
+    history = [{'role': 'system', 'content': 'Summary of the earlier conversation.'}]
+    for turn in range(turns):
+        history.append({'role': 'user', 'content': f'Question {turn}? ' + 'filler ' * 30})
+        history.append({'role': 'assistant', 'content': f'Answer {turn}. ' + 'filler ' * 30})
+    return history
+
+
+def test_prompt_that_fits_is_unchanged(max_input_tokens):
+    history = conversation(1)
+
+    messages = _fit_question('Plants make glucose.', 'What do plants make?', False, list(history))
+
+    assert messages[1:-1] == history
+
+
+def test_oldest_history_is_dropped_first_and_the_summary_kept(max_input_tokens):
+    history = conversation(4)
+
+    messages = _fit_question('Plants make glucose.', 'What do plants make?', False, list(history))
+
+    assert count_message_tokens(messages) <= max_input_tokens
+    kept = messages[1:-1]
+    assert kept[0] == history[0]
+    assert 1 < len(kept) < len(history)
+    assert kept[1:] == history[len(history) - len(kept) + 1:]
+    assert 'Plants make glucose.' in messages[-1]['content']
+
+
+def test_document_context_is_cut_once_the_history_is_gone(max_input_tokens):
+    context = '\n\n'.join(f'Paragraph {number}. ' + 'detail ' * 40 for number in range(10))
+
+    messages = _fit_question(context, 'What do plants make?', False, conversation(2))
+
+    assert count_message_tokens(messages) <= max_input_tokens
+    assert len(messages) == 2
+    assert 'Paragraph 0.' in messages[-1]['content']
+    assert '[...]' in messages[-1]['content']
+    assert 'What do plants make?' in messages[-1]['content']
+
+
+def test_question_that_cannot_fit_is_rejected(max_input_tokens):
+    with pytest.raises(PromptTooLarge) as error:
+        check_question(' '.join(['why'] * 400))
+
+    assert error.value.tokens == 400
+    assert error.value.limit < max_input_tokens
+
+
+def test_too_long_question_is_answered_with_413_and_not_saved(app, client, auth_headers, user_id, max_input_tokens):
+    with app.app_context():
+        chat = Chat(user_id=user_id, document=Document(user_id=user_id, filename='notes.txt', extracted_text='Text.'))
+        db.session.add(chat)
+        db.session.commit()
+        chat_id = chat.id
+        db.session.remove()
+
+    for url in (f'/api/chats/{chat_id}/messages', f'/api/chats/{chat_id}/messages/stream'):
+        response = client.post(url, headers=auth_headers, json={'message': 'why ' * 400})
+        assert response.status_code == 413
+        assert response.get_json()['message'] == 'Message is too long!'
+
+    with app.app_context():
+        assert Message.query.filter_by(chat_id=chat_id).count() == 0
+        db.session.remove()
@@ -0,0 +1,68 @@
+from retrieval import BM25Index, split_into_chunks, tokenize
+from tokens import count_tokens
+
+
+def test_tokenize_lowercases_and_drops_stopwords():
+    assert tokenize('The Mitochondria is the powerhouse of THE cell.') == ['mitochondria', 'powerhouse', 'cell']
+
+
+def test_short_paragraphs_are_packed_into_one_chunk():
+    text = 'First paragraph.\n\nSecond paragraph.\n\n\n\nThird paragraph.'
+    assert split_into_chunks(text, chunk_tokens=50) == ['First paragraph.\n\nSecond paragraph.\n\nThird paragraph.']
+
+
+def test_chunks_stay_within_the_budget_and_keep_every_word():
+    paragraphs = [' '.join(f'word{p}x{i}' for i in range(30)) for p in range(10)]
+    text = '\n\n'.join(paragraphs)
+
+    chunks = split_into_chunks(text, chunk_tokens=100)
+
+    assert len(chunks) > 1
+    assert all(count_tokens(chunk) <= 100 for chunk in chunks)
+    assert ' '.join(chunks).split() == text.split()
+
+
+def test_paragraph_larger_than_a_chunk_is_split_on_words():
+    paragraph = ' '.join(f'term{i}' for i in range(200))
+
+    chunks = split_into_chunks(paragraph, chunk_tokens=40)
+
+    assert len(chunks) > 1
+    assert all(count_tokens(chunk) <= 40 for chunk in chunks)
+    assert ' '.join(chunks) == paragraph
+
+
+def test_empty_text_has_no_chunks():
+    assert split_into_chunks('  \n\n  ') == []
+
+
+def _index():
+    return BM25Index([10, 20, 30, 40], [
+        'Photosynthesis converts light energy into chemical energy in plants.',
+        'The mitochondria produce energy for the cell through respiration.',
+        'Chlorophyll absorbs light; photosynthesis happens in the chloroplast. Photosynthesis needs water.',
+        'The French revolution began in 1789.',
+    ])
+
+
+def test_bm25_ranks_chunks_matching_more_query_terms_first():
+    results = _index().search('where does photosynthesis happen with chlorophyll', top_k=4)
+
+    assert [chunk_id for chunk_id, _ in results][:2] == [30, 10]
+    assert results[0][1] > results[1][1] > 0
+
+
+def test_bm25_weights_rare_terms_above_common_ones():
+    # "energy" occurs in two chunks, "respiration" in one
+    results = _index().search('energy respiration', top_k=4)
+
+    assert results[0][0] == 20
+
+
+def test_bm25_returns_at_most_top_k_matching_chunks():
+    index = _index()
+
+    assert len(index.search('energy light photosynthesis', top_k=1)) == 1
+    assert {chunk_id for chunk_id, _ in index.search('energy', top_k=10)} == {10, 20}
+    assert index.search('the of and', top_k=4) == []
+    assert index.search('quantum', top_k=4) == []
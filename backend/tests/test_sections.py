@@ -0,0 +1,55 @@
+import hashlib
+
+from document_structure import Section, dump_sections
+from models import db, Document, ExtractedText
+
+TEXT = 'Intro\n\nFirst paragraph.\n\nDetails\n\nSecond paragraph.'
+
+
+def add_document(app, user_id, sections):
+    """A ready document whose text was extracted with `sections` (None: without structure)."""
+    with app.app_context():
+        digest = hashlib.sha256(repr((user_id, sections)).encode()).hexdigest()
+        content = ExtractedText(sha256=digest, text=TEXT, structure=dump_sections(sections) if sections is not None else None)
+        document = Document(user_id=user_id, filename='doc.docx', extracted_text='', content=content)
+        db.session.add(document)
+        db.session.commit()
+        document_id = document.id
+        db.session.remove()
+    return document_id
+
+
+def get_sections(client, auth_headers, document_id):
+    response = client.get(f'/api/documents/{document_id}/sections', headers=auth_headers)
+    assert response.status_code == 200
+    return response.get_json()
+
+
+def test_headings_are_listed_as_sections(app, client, auth_headers, user_id):
+    document_id = add_document(app, user_id, [
+        Section('heading', None, 'Intro', 1, 0, 5),
+        Section('paragraph', None, None, None, 7, 23),
+        Section('heading', None, 'Details', 1, 25, 32),
+        Section('paragraph', None, None, None, 34, 51),
+    ])
+
+    body = get_sections(client, auth_headers, document_id)
+
+    assert body['structured'] is True
+    assert [(section['title'], section['start'], section['end']) for section in body['sections']] == [
+        ('Intro', 0, 23), ('Details', 25, 51)
+    ]
+
+
+def test_documents_without_headings_or_pages_are_not_structured(app, client, auth_headers, user_id):
+    document_id = add_document(app, user_id, [Section('paragraph', None, None, None, 0, len(TEXT))])
+
+    assert get_sections(client, auth_headers, document_id) == {'document_id': document_id, 'structured': False, 'sections': []}
+
+
+def test_plain_text_and_legacy_documents_are_not_structured(app, client, auth_headers, user_id):
+    plain = add_document(app, user_id, [])
+    legacy = add_document(app, user_id, None)
+
+    assert get_sections(client, auth_headers, plain)['structured'] is False
+    assert get_sections(client, auth_headers, legacy)['structured'] is False
@@ -0,0 +1,77 @@
+import json
+
+import pytest
+
+from models import db, Document
+
+TEXT = 'Photosynthesis in plants turns light, water and carbon dioxide into glucose and oxygen.'
+
+
+@pytest.fixture
+def document_id(app, user_id):
+    with app.app_context():
+        document = Document(user_id=user_id, filename='plants.txt', extracted_text=TEXT)
+        db.session.add(document)
+        db.session.commit()
+        document_id = document.id
+        db.session.remove()
+    return document_id
+
+
+def start_chat(client, headers, document_id):
+    response = client.post('/api/chats', headers=headers, json={'document_id': document_id})
+    assert response.status_code == 201
+    return response.get_json()['id']
+
+
+def ask(client, headers, chat_id, question):
+    response = client.post(f'/api/chats/{chat_id}/messages/stream', headers=headers, json={'message': question})
+    assert response.status_code == 200
+    assert response.mimetype == 'text/event-stream'
+    events = []
+    for frame in response.get_data(as_text=True).split('\n\n')[:-1]:
+        name, data = frame.split('\n')
+        events.append((name.removeprefix('event: '), json.loads(data.removeprefix('data: '))))
+    return events
+
+
+def test_answer_is_streamed_token_by_token_and_saved(client, auth_headers, document_id, fake_groq):
+    chat_id = start_chat(client, auth_headers, document_id)
+
+    events = ask(client, auth_headers, chat_id, 'What do plants produce?')
+
+    assert [name for name, _ in events] == ['user_message', 'token', 'token', 'token', 'done']
+    assert events[0][1]['message'] == 'What do plants produce?'
+    assert [payload['token'] for name, payload in events[1:-1]] == ['Plants ', 'make ', 'glucose.']
+    assert events[-1][1]['ai_message']['message'] == 'Plants make glucose.'
+
+    request, = fake_groq.requests
+    assert request['stream'] is True
+    assert TEXT in request['messages'][-1]['content']
+
+    messages = client.get(f'/api/chats/{chat_id}', headers=auth_headers).get_json()
+    assert [(message['sender'], message['message']) for message in messages] == [
+        ('user', 'What do plants produce?'), ('ai', 'Plants make glucose.')
+    ]
+
+
+def test_repeated_question_is_answered_from_the_cache(client, auth_headers, document_id, fake_groq):
+    ask(client, auth_headers, start_chat(client, auth_headers, document_id), 'What is photosynthesis?')
+
+    events = ask(client, auth_headers, start_chat(client, auth_headers, document_id), 'what is photosynthesis')
+
+    assert [name for name, _ in events] == ['user_message', 'token', 'done']
+    assert events[1][1] == {'token': 'Plants make glucose.', 'cached': True}
+    assert len(fake_groq.requests) == 1
+
+
+def test_llm_error_is_sent_as_an_error_event(client, auth_headers, document_id, fake_groq):
+    fake_groq.error = Exception('service unavailable')
+    chat_id = start_chat(client, auth_headers, document_id)
+
+    events = ask(client, auth_headers, chat_id, 'Why is the sky blue?')
+
+    assert [name for name, _ in events] == ['user_message', 'error']
+    assert events[1][1] == {'message': 'Error getting AI response!', 'error': 'Groq API error: service unavailable'}
+    messages = client.get(f'/api/chats/{chat_id}', headers=auth_headers).get_json()
+    assert [message['sender'] for message in messages] == ['user']
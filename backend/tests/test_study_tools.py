@@ -0,0 +1,74 @@
+import io
+import uuid
+
+import pytest
+
+from models import db, StudyMaterial
+
+
+def upload(client, headers, text, document_id=None):
+    url = f'/api/documents/{document_id}/versions' if document_id else '/api/documents/upload'
+    data = {'file': (io.BytesIO(text.encode('utf-8')), 'plants.txt')}
+    return client.post(url, headers=headers, data=data, content_type='multipart/form-data')
+
+
+def study_tools(client, headers, document_id, **options):
+    return client.post(f'/api/documents/{document_id}/study-tools', headers=headers, json=options)
+
+
+@pytest.fixture
+def document_id(client, auth_headers, wait_for_document):
+    document_id = upload(client, auth_headers, f'Plants make glucose from light. {uuid.uuid4()}').get_json()['job_id']
+    assert wait_for_document(auth_headers, document_id)['status'] == 'ready'
+    return document_id
+
+
+def test_material_is_generated_once_then_served_from_the_cache(client, auth_headers, document_id, fake_groq):
+    first = study_tools(client, auth_headers, document_id, type='flashcards')
+
+    assert first.status_code == 200
+    assert first.headers['X-Cache'] == 'MISS'
+    assert first.get_json() == fake_groq.study_material['flashcards']
+
+    second = study_tools(client, auth_headers, document_id, type='flashcards')
+
+    assert second.headers['X-Cache'] == 'HIT'
+    assert second.get_json() == first.get_json()
+    assert len(fake_groq.requests) == 1
+
+
+def test_each_tool_type_is_cached_separately(client, auth_headers, document_id, fake_groq):
+    study_tools(client, auth_headers, document_id, type='flashcards')
+
+    response = study_tools(client, auth_headers, document_id, type='mindmap')
+
+    assert response.headers['X-Cache'] == 'MISS'
+    assert response.get_json() == fake_groq.study_material['mindmap']
+    assert study_tools(client, auth_headers, document_id, type='bogus').status_code == 400
+
+
+def test_regenerate_replaces_the_cached_material(app, client, auth_headers, document_id, fake_groq):
+    study_tools(client, auth_headers, document_id, type='quiz')
+    fake_groq.study_material['quiz'][0]['question'] = 'Where does photosynthesis happen?'
+
+    response = study_tools(client, auth_headers, document_id, type='quiz', regenerate=True)
+
+    assert response.headers['X-Cache'] == 'MISS'
+    assert response.get_json()[0]['question'] == 'Where does photosynthesis happen?'
+    assert study_tools(client, auth_headers, document_id, type='quiz').get_json() == response.get_json()
+    with app.app_context():
+        assert StudyMaterial.query.filter_by(document_id=document_id).count() == 1
+        db.session.remove()
+
+
+def test_new_version_with_other_text_drops_the_cached_material(
+        client, auth_headers, wait_for_document, document_id, fake_groq):
+    study_tools(client, auth_headers, document_id, type='flashcards')
+
+    assert upload(client, auth_headers, f'Plants also need water. {uuid.uuid4()}', document_id).status_code == 202
+    assert wait_for_document(auth_headers, document_id)['status'] == 'ready'
+
+    response = study_tools(client, auth_headers, document_id, type='flashcards')
+    assert response.headers['X-Cache'] == 'MISS'
+    assert len(fake_groq.requests) == 2
+    assert 'Plants also need water.' in fake_groq.requests[-1]['messages'][-1]['content']
@@ -0,0 +1,121 @@
+import io
+import threading
+import uuid
+
+import pytest
+
+from ingestion import ExtractionTimeout, ingestion
+from models import db, Document, DocumentChunk
+
+
+def paragraph(name):
+    # About 200 tokens: each paragraph gets a chunk of its own
+    return ' '.join(f'{name}{i}' for i in range(70))
+
+
+def upload(client, headers, text, filename='notes.txt', document_id=None):
+    url = f'/api/documents/{document_id}/versions' if document_id else '/api/documents/upload'
+    data = {'file': (io.BytesIO(text.encode('utf-8')), filename)}
+    return client.post(url, headers=headers, data=data, content_type='multipart/form-data')
+
+
+def chunks(app, document_id):
+    """Ids of a document's chunks by their first word."""
+    with app.app_context():
+        rows = DocumentChunk.query.filter_by(document_id=document_id).order_by(DocumentChunk.position).all()
+        result = {row.content.split(' ', 1)[0]: row.id for row in rows}
+        db.session.remove()
+    return result
+
+
+@pytest.fixture
+def prefix():
+    # Unique letters (digits would change the token counts), so no other
+    # test's file has the same hash
+    return ''.join(chr(ord('a') + int(digit, 16)) for digit in uuid.uuid4().hex[:8])
+
+
+@pytest.fixture
+def document_id(client, auth_headers, wait_for_document, prefix):
+    text = '\n\n'.join(paragraph(f'{prefix}{name}') for name in ('alpha', 'beta', 'gamma'))
+    document_id = upload(client, auth_headers, text).get_json()['job_id']
+    assert wait_for_document(auth_headers, document_id)['status'] == 'ready'
+    return document_id
+
+
+def test_new_version_keeps_unchanged_chunks(app, client, auth_headers, wait_for_document, document_id, prefix):
+    before = chunks(app, document_id)
+    chat_id = client.post('/api/chats', headers=auth_headers, json={'document_id': document_id}).get_json()['id']
+    text = '\n\n'.join(paragraph(f'{prefix}{name}') for name in ('alpha', 'delta', 'gamma', 'epsilon'))
+
+    response = upload(client, auth_headers, text, filename='notes-v2.txt', document_id=document_id)
+
+    assert response.status_code == 202
+    assert response.get_json()['document']['status'] == 'updating'
+    assert wait_for_document(auth_headers, document_id)['status'] == 'ready'
+    after = chunks(app, document_id)
+    assert list(after) == [f'{prefix}{name}0' for name in ('alpha', 'delta', 'gamma', 'epsilon')]
+    # alpha and gamma kept, beta removed, delta and epsilon added
+    assert set(before.values()) & set(after.values()) == {before[f'{prefix}alpha0'], before[f'{prefix}gamma0']}
+    with app.app_context():
+        document = db.session.get(Document, document_id)
+        assert (document.version, document.filename) == (2, 'notes-v2.txt')
+        assert document.extracted_text == text
+        db.session.remove()
+    assert client.get(f'/api/chats/{chat_id}', headers=auth_headers).status_code == 200
+
+
+def test_identical_file_is_not_processed_again(client, auth_headers, document_id, prefix):
+    text = '\n\n'.join(paragraph(f'{prefix}{name}') for name in ('alpha', 'beta', 'gamma'))
+
+    response = upload(client, auth_headers, text, document_id=document_id)
+
+    assert response.status_code == 200
+    assert response.get_json()['message'] == 'This file is identical to the current version.'
+    assert response.get_json()['document']['version'] == 1
+
+
+def test_previous_version_is_served_while_updating_and_after_a_failure(
+        app, client, auth_headers, wait_for_document, document_id, prefix, monkeypatch):
+    before = chunks(app, document_id)
+    started, release = threading.Event(), threading.Event()
+
+    def blocked(fn, *args):
+        started.set()
+        release.wait(10)
+        raise ExtractionTimeout('Extraction exceeded 1s')
+
+    monkeypatch.setattr(ingestion, '_extract_in_pool', blocked)
+    assert upload(client, auth_headers, paragraph(f'{prefix}zeta'), document_id=document_id).status_code == 202
+    assert started.wait(10)
+
+    again = upload(client, auth_headers, 'Another version.', document_id=document_id)
+    assert again.status_code == 409
+    assert again.get_json() == {'message': 'A new version is already being processed!', 'status': 'updating'}
+    assert client.post('/api/chats', headers=auth_headers, json={'document_id': document_id}).status_code == 201
+
+    release.set()
+    status = wait_for_document(auth_headers, document_id)
+    assert status['status'] == 'ready'
+    assert status['error'] == 'Error processing the new version: Extraction exceeded 1s'
+    assert chunks(app, document_id) == before
+    with app.app_context():
+        assert db.session.get(Document, document_id).version == 1
+        db.session.remove()
+
+
+def test_new_version_of_a_failed_document_becomes_its_first(app, client, auth_headers, wait_for_document, prefix):
+    document_id = upload(client, auth_headers, '\n').get_json()['job_id']
+    assert wait_for_document(auth_headers, document_id)['status'] == 'failed'
+
+    response = upload(client, auth_headers, paragraph(prefix), document_id=document_id)
+
+    assert response.status_code == 202
+    assert response.get_json()['document']['status'] == 'pending'
+    assert wait_for_document(auth_headers, document_id) == {
+        'job_id': document_id, 'document_id': document_id, 'status': 'ready', 'error': None
+    }
+    with app.app_context():
+        assert db.session.get(Document, document_id).version == 1
+        db.session.remove()
+    assert list(chunks(app, document_id)) == [f'{prefix}0']
@@ -0,0 +1,75 @@
+import re
+
+# Offline token estimator for the Llama 3 models served by Groq.
+#
+# Text is split the way byte-level BPE tokenizers pre-tokenize it (words with
+# their leading space, short digit groups, punctuation runs, whitespace), and
+# each piece is costed from its length: common English words are one token,
+# longer words are split every few characters, and non-ASCII text (accented
+# or CJK characters) costs roughly one token per character. This tracks the
+# real tokenizer far more closely than counting characters, without needing
+# its vocabulary.
+PIECE_PATTERN = re.compile(r"'(?:[sdmt]|ll|ve|re)| ?[^\W\d_]+| ?\d{1,3}| ?[^\s\w]+|\s+", re.UNICODE | re.IGNORECASE)
+
+# Characters per token in long ASCII words and punctuation runs
+WORD_CHARS_PER_TOKEN = 6
+PUNCTUATION_CHARS_PER_TOKEN = 3
+
+# Tokens added by the chat template around every message, and once per request
+MESSAGE_OVERHEAD_TOKENS = 4
+REQUEST_OVERHEAD_TOKENS = 3
+
+
+def _piece_tokens(piece):
+    word = piece.lstrip(' ')
+    if not word or word.isspace():
+        return 1
+    if not word.isascii():
+        ascii_chars = sum(char.isascii() for char in word)
+        return len(word) - ascii_chars + -(-ascii_chars // WORD_CHARS_PER_TOKEN)
+    if word[0].isalnum() or word[0] == "'":
+        return 1 + (len(word) - 1) // WORD_CHARS_PER_TOKEN
+    return 1 + (len(word) - 1) // PUNCTUATION_CHARS_PER_TOKEN
+
+
+def count_tokens(text):
+    """Estimated number of tokens in `text` (at least 1)."""
+    if not text:
+        return 1
+    return max(1, sum(map(_piece_tokens, PIECE_PATTERN.findall(text))))
+
+
+def count_message_tokens(messages):
+    """Estimated prompt tokens of a list of chat messages ({'role', 'content'})."""
+    return REQUEST_OVERHEAD_TOKENS + sum(
+        MESSAGE_OVERHEAD_TOKENS + count_tokens(message.get('content') or '') for message in messages
+    )
+
+
+def truncate_to_tokens(text, max_tokens, marker='\n\n[...]'):
+    """
+    Shorten `text` to about `max_tokens` tokens, keeping its beginning.
+
+    The cut is made at the last paragraph break (or, failing that, the last
+    word) that fits, and `marker` is appended so the model can tell the text
+    was cut. Text that already fits is returned unchanged.
+    """
+    if count_tokens(text) <= max_tokens:
+        return text
+
+    budget = max(0, max_tokens - count_tokens(marker))
+    used = 0
+    end = 0
+    for match in PIECE_PATTERN.finditer(text):
+        used += _piece_tokens(match.group())
+        if used > budget:
+            break
+        end = match.end()
+
+    cut = text[:end]
+    boundary = cut.rfind('\n\n')
+    if boundary < len(cut) // 2:
+        boundary = max(cut.rfind(' '), cut.rfind('\n'))
+    if boundary > 0:
+        cut = cut[:boundary]
+    return cut.rstrip() + marker
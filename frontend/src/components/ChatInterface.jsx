@@ -5,12 +5,18 @@ import ReactMarkdown from 'react-markdown'
 import { Prism as SyntaxHighlighter } from 'react-syntax-highlighter'
 import { oneDark } from 'react-syntax-highlighter/dist/esm/styles/prism'
 
+// Messages fetched per request; older ones are loaded on demand
+const MESSAGES_PAGE_SIZE = 50
+
 const ChatInterface = ({ chat, document, onNewChat, onOpenStudyLab }) => {
   const [messages, setMessages] = useState([])
   const [inputMessage, setInputMessage] = useState('')
   const [loading, setLoading] = useState(false)
   const [loadingMessages, setLoadingMessages] = useState(false)
+  const [hasEarlier, setHasEarlier] = useState(false)
+  const [loadingEarlier, setLoadingEarlier] = useState(false)
   const messagesEndRef = useRef(null)
+  const keepScrollRef = useRef(false)
 
   useEffect(() => {
     if (chat) {
@@ -21,6 +27,11 @@ const ChatInterface = ({ chat, document, onNewChat, onOpenStudyLab }) => {
   }, [chat])
 
   useEffect(() => {
+    // Prepending older messages should not jump to the bottom
+    if (keepScrollRef.current) {
+      keepScrollRef.current = false
+      return
+    }
     scrollToBottom()
   }, [messages])
 
@@ -33,8 +44,11 @@ const ChatInterface = ({ chat, document, onNewChat, onOpenStudyLab }) => {
 
     setLoadingMessages(true)
     try {
-      const response = await axios.get(`/api/chats/${chat.id}`)
+      const response = await axios.get(`/api/chats/${chat.id}`, {
+        params: { limit: MESSAGES_PAGE_SIZE }
+      })
       setMessages(response.data)
+      setHasEarlier(response.headers['x-has-more'] === 'true')
     } catch (error) {
       console.error('Error loading messages:', error)
     } finally {
@@ -42,6 +56,59 @@ const ChatInterface = ({ chat, document, onNewChat, onOpenStudyLab }) => {
     }
   }
 
+  const loadEarlierMessages = async () => {
+    if (!chat || messages.length === 0) return
+
+    setLoadingEarlier(true)
+    try {
+      const response = await axios.get(`/api/chats/${chat.id}`, {
+        params: { limit: MESSAGES_PAGE_SIZE, before: messages[0].id }
+      })
+      keepScrollRef.current = true
+      setMessages((prev) => [...response.data, ...prev])
+      setHasEarlier(response.headers['x-has-more'] === 'true')
+    } catch (error) {
+      console.error('Error loading earlier messages:', error)
+    } finally {
+      setLoadingEarlier(false)
+    }
+  }
+
+  // POST to the streaming endpoint and dispatch each Server-Sent Event to onEvent
+  const streamMessage = async (body, onEvent) => {
+    const response = await fetch(`/api/chats/${chat.id}/messages/stream`, {
+      method: 'POST',
+      headers: {
+        'Content-Type': 'application/json',
+        Authorization: axios.defaults.headers.common['Authorization']
+      },
+      body: JSON.stringify(body)
+    })
+
+    if (!response.ok || !response.body) {
+      throw new Error(`Request failed with status ${response.status}`)
+    }
+
+    const reader = response.body.getReader()
+    const decoder = new TextDecoder()
+    let buffer = ''
+
+    while (true) {
+      const { done, value } = await reader.read()
+      if (done) break
+
+      buffer += decoder.decode(value, { stream: true })
+      const frames = buffer.split('\n\n')
+      buffer = frames.pop()
+
+      for (const frame of frames) {
+        const event = frame.match(/^event: (.*)$/m)?.[1]
+        const data = frame.match(/^data: (.*)$/m)?.[1]
+        if (event && data) onEvent(event, JSON.parse(data))
+      }
+    }
+  }
+
   const handleSendMessage = async (e) => {
     e.preventDefault()
 
@@ -52,11 +119,28 @@ const ChatInterface = ({ chat, document, onNewChat, onOpenStudyLab }) => {
     setInputMessage('')
 
     try {
-      const response = await axios.post(`/api/chats/${chat.id}/messages`, {
-        message: userMessage
+      let streamError = null
+
+      await streamMessage({ message: userMessage }, (event, data) => {
+        if (event === 'user_message') {
+          setMessages((prev) => [...prev, data])
+        } else if (event === 'token') {
+          setLoading(false)
+          setMessages((prev) => {
+            const last = prev[prev.length - 1]
+            if (last?.id === 'streaming') {
+              return [...prev.slice(0, -1), { ...last, message: last.message + data.token }]
+            }
+            return [...prev, { id: 'streaming', sender: 'ai', message: data.token, timestamp: new Date().toISOString() }]
+          })
+        } else if (event === 'done') {
+          setMessages((prev) => [...prev.filter((m) => m.id !== 'streaming'), data.ai_message])
+        } else if (event === 'error') {
+          streamError = data.error || data.message
+        }
       })
 
-      setMessages([...messages, response.data.user_message, response.data.ai_message])
+      if (streamError) throw new Error(streamError)
     } catch (error) {
       console.error('Error sending message:', error)
       alert('Error sending message. Please try again.')
@@ -154,7 +238,19 @@ const ChatInterface = ({ chat, document, onNewChat, onOpenStudyLab }) => {
             </div>
           </div>
         ) : (
-          messages.map((message) => (
+          <>
+          {hasEarlier && (
+            <div className="flex justify-center">
+              <button
+                onClick={loadEarlierMessages}
+                disabled={loadingEarlier}
+                className="text-sm text-gray-400 hover:text-white disabled:opacity-50 transition-colors"
+              >
+                {loadingEarlier ? 'Loading...' : 'Load earlier messages'}
+              </button>
+            </div>
+          )}
+          {messages.map((message) => (
             <div
               key={message.id}
               className={`flex ${message.sender === 'user' ? 'justify-end' : 'justify-start'}`}
@@ -231,7 +327,8 @@ const ChatInterface = ({ chat, document, onNewChat, onOpenStudyLab }) => {
                 </div>
               </div>
             </div>
-          ))
+          ))}
+          </>
         )}
 
         {loading && (
@@ -1,11 +1,57 @@
-import React, { useState } from 'react'
+import React, { useState, useEffect, useRef } from 'react'
 import axios from 'axios'
 import { Upload, FileText, Trash2, Calendar, CheckCircle, AlertCircle, X } from 'lucide-react'
 
+// How often the status of an uploaded document is checked while it is processed
+const STATUS_POLL_MS = 1500
+
+const PROCESSING_LABELS = {
+  pending: 'Processing...',
+  extracting: 'Processing...',
+  updating: 'Updating...'
+}
+
 const DocumentManager = ({ documents, onDocumentUploaded, onDeleteDocument, onSelectDocument }) => {
   const [uploading, setUploading] = useState(false)
   const [uploadProgress, setUploadProgress] = useState(null)
   const [error, setError] = useState(null)
+  const mountedRef = useRef(true)
+
+  useEffect(() => {
+    mountedRef.current = true
+    return () => { mountedRef.current = false }
+  }, [])
+
+  // Uploads are extracted in the background: wait until the document is ready or failed
+  const waitForProcessing = async (documentId, filename) => {
+    while (mountedRef.current) {
+      await new Promise(resolve => setTimeout(resolve, STATUS_POLL_MS))
+      if (!mountedRef.current) return
+
+      let status
+      try {
+        status = (await axios.get(`/api/documents/${documentId}/status`)).data
+      } catch (error) {
+        if (error.response?.status === 404) return
+        continue
+      }
+
+      if (status.status === 'ready') {
+        setUploadProgress({ filename, status: 'success' })
+        onDocumentUploaded()
+        setTimeout(() => {
+          if (mountedRef.current) setUploadProgress(null)
+        }, 3000)
+        return
+      }
+      if (status.status === 'failed') {
+        setUploadProgress({ filename, status: 'error' })
+        setError(status.error || 'Error processing document')
+        onDocumentUploaded()
+        return
+      }
+    }
+  }
 
   const handleFileUpload = async (e) => {
     const file = e.target.files?.[0]
@@ -25,15 +71,13 @@ const DocumentManager = ({ documents, onDocumentUploaded, onDeleteDocument, onSe
     const formData = new FormData()
     formData.append('file', file)
 
+    let documentId = null
     try {
-      await axios.post('/api/documents/upload', formData)
+      const response = await axios.post('/api/documents/upload', formData)
+      documentId = response.data.document.id
 
-      setUploadProgress({ filename: file.name, status: 'success' })
+      setUploadProgress({ filename: file.name, status: 'processing' })
       onDocumentUploaded()
-
-      setTimeout(() => {
-        setUploadProgress(null)
-      }, 3000)
     } catch (error) {
       setError(error.response?.data?.message || 'Error uploading document')
       setUploadProgress({ filename: file.name, status: 'error' })
@@ -41,6 +85,10 @@ const DocumentManager = ({ documents, onDocumentUploaded, onDeleteDocument, onSe
       setUploading(false)
       e.target.value = ''
     }
+
+    if (documentId !== null) {
+      await waitForProcessing(documentId, file.name)
+    }
   }
 
   const formatDate = (dateString) => {
@@ -79,7 +127,7 @@ const DocumentManager = ({ documents, onDocumentUploaded, onDeleteDocument, onSe
               {uploading ? 'Uploading...' : 'Click to upload document'}
             </p>
             <p className="text-sm text-gray-400">
-              Supports PDF, DOCX, PPTX, TXT (Max 16MB)
+              Supports PDF, DOCX, PPTX, TXT (Max 256MB)
             </p>
             <input
               id="file-upload"
@@ -111,11 +159,12 @@ const DocumentManager = ({ documents, onDocumentUploaded, onDeleteDocument, onSe
                   }`}>
                   {uploadProgress.status === 'success' ? 'Uploaded successfully: ' :
                     uploadProgress.status === 'error' ? 'Upload failed: ' :
-                      'Uploading: '}
+                      uploadProgress.status === 'processing' ? 'Processing: ' :
+                        'Uploading: '}
                   {uploadProgress.filename}
                 </span>
               </div>
-              {uploadProgress.status !== 'uploading' && (
+              {uploadProgress.status !== 'uploading' && uploadProgress.status !== 'processing' && (
                 <button
                   onClick={() => setUploadProgress(null)}
                   className="p-1 hover:bg-white/10 rounded transition-colors"
@@ -187,6 +236,26 @@ const DocumentManager = ({ documents, onDocumentUploaded, onDeleteDocument, onSe
                     <Calendar className="w-3 h-3 mr-1" />
                     {formatDate(doc.uploaded_at)}
                   </div>
+
+                  {PROCESSING_LABELS[doc.status] && (
+                    <div className="mt-2 flex items-center text-xs text-blue-400">
+                      <div className="w-3 h-3 mr-1 border-2 border-blue-400 border-t-transparent rounded-full animate-spin"></div>
+                      {PROCESSING_LABELS[doc.status]}
+                    </div>
+                  )}
+
+                  {doc.status === 'failed' && (
+                    <div className="mt-2 flex items-start text-xs text-red-400" title={doc.error || ''}>
+                      <AlertCircle className="w-3 h-3 mr-1 mt-0.5 flex-shrink-0" />
+                      <span className="line-clamp-2">{doc.error || 'Processing failed'}</span>
+                    </div>
+                  )}
+
+                  {doc.status !== 'failed' && doc.error && (
+                    <div className="mt-2 text-xs text-yellow-400 line-clamp-2" title={doc.error}>
+                      {doc.error}
+                    </div>
+                  )}
                 </div>
               ))}
             </div>